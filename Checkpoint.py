@@ -0,0 +1,104 @@
+###############################################################################
+# Imports
+
+import os
+import pickle
+import time
+
+from LevelStore import LevelStore
+
+
+###############################################################################
+# Checkpoints
+
+# Key of a search, to check that a checkpoint is resumed by the same search
+def search_key(edges, source, target):
+    edge_keys = tuple((tuple(sorted(map(str, edge.invertex))), tuple(sorted(map(str, edge.outvertex))), tuple(sorted(map(str, edge.attributes or [])))) for edge in edges)
+    return (edge_keys, tuple(sorted(map(str, source))), tuple(sorted(map(str, target))))
+
+
+# Write data to path through a temporary file, so that an interrupted write keeps the old file
+def write_atomic(path, write):
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "wb") as checkpoint_file:
+        write(checkpoint_file)
+        checkpoint_file.flush()
+        os.fsync(checkpoint_file.fileno())
+    os.replace(temporary_path, path)
+
+
+# Checkpoints of the level by level dominance searches (pascal_triangle, hasse, edge_set_tree)
+# After a level is done, and at most every interval seconds, the search saves the index of the
+# level, the dominant edge sets found so far and its frontier (the sets the next level is built
+# from) to directory, one file per engine. A LevelStore frontier is saved to a .npy file of its
+# own, named after the level, and then streamed from it on resume.
+# With resume, load returns the state saved by the same search, if any.
+class Checkpoint(object):
+    def __init__(self, directory, resume=False, interval=0):
+        self.directory = directory
+        self.resume = resume
+        self.interval = interval
+        self.last_save = {} # Time of the last save of each engine
+
+    def state_path(self, engine):
+        return os.path.join(self.directory, "{}.pkl".format(engine))
+
+    def frontier_path(self, engine, level):
+        return os.path.join(self.directory, "{}-frontier-{}.npy".format(engine, level))
+
+    # Save the state of engine after level, unless the last save is less than interval seconds old
+    # dominant_sets are the edge set masks of the dominant metapaths found, frontier is a LevelStore
+    # or a list of edge set masks. Returns True if the state was saved.
+    def save(self, engine, key, level, dominant_sets, frontier, force=False):
+        now = time.time()
+        if not force and now - self.last_save.get(engine, float("-inf")) < self.interval:
+            return False
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+        state = {"key": key, "level": level, "dominant_sets": list(dominant_sets)}
+        if isinstance(frontier, LevelStore):
+            frontier_path = self.frontier_path(engine, level)
+            group_ends = []
+            write_atomic(frontier_path, lambda checkpoint_file: group_ends.extend(frontier.save(checkpoint_file)))
+            state["frontier_group_ends"] = group_ends
+            state["frontier_path"] = os.path.basename(frontier_path)
+        else:
+            state["frontier"] = list(frontier)
+
+        previous_state = self.read_state(engine)
+        write_atomic(self.state_path(engine), lambda checkpoint_file: pickle.dump(state, checkpoint_file))
+
+        # Frontier of the previous checkpoint is no longer referenced
+        if previous_state is not None and previous_state.get("frontier_path") not in (None, state.get("frontier_path")):
+            previous_frontier_path = os.path.join(self.directory, previous_state["frontier_path"])
+            if os.path.exists(previous_frontier_path):
+                os.remove(previous_frontier_path)
+
+        self.last_save[engine] = now
+        print("Checkpoint: {} level {} saved to {}".format(engine, level, self.state_path(engine)))
+        return True
+
+    def read_state(self, engine):
+        if not os.path.exists(self.state_path(engine)):
+            return None
+        with open(self.state_path(engine), "rb") as checkpoint_file:
+            return pickle.load(checkpoint_file)
+
+    # State saved by the search key of engine, None without resume or checkpoint
+    # The frontier of the state is a LevelStore over the saved rows if it was saved from one.
+    def load(self, engine, key, memory_limit=None, scratch_dir=None):
+        if not self.resume:
+            return None
+        state = self.read_state(engine)
+        if state is None:
+            print("Checkpoint: no {} checkpoint in {}, starting over".format(engine, self.directory))
+            return None
+        if state["key"] != key:
+            raise ValueError("Checkpoint {} is not for this search".format(self.state_path(engine)))
+
+        if "frontier_path" in state:
+            frontier_path = os.path.join(self.directory, state["frontier_path"])
+            state["frontier"] = LevelStore.load(frontier_path, state["frontier_group_ends"], memory_limit, scratch_dir)
+        print("Checkpoint: resuming {} after level {}".format(engine, state["level"]))
+        return state
@@ -0,0 +1,953 @@
+###############################################################################
+# Imports
+
+import heapq
+
+from concurrent.futures import ProcessPoolExecutor
+
+
+###############################################################################
+# Compact metagraph
+
+# Integer bitmask representation of a conditional metagraph
+# Each variable and proposition is mapped to a bit position, each edge is stored
+# as three integer masks (invertex, outvertex, attributes) so that covering tests
+# in the metapath searches become a single AND/OR on Python ints.
+class CompactMetagraph(object):
+    def __init__(self, mg):
+        self.edges = tuple(mg.edges) # Edges of the metagraph, index i is bit i of edge masks
+
+        # Bit position of each element, variables first (sorted) then propositions (sorted)
+        self.elements = sorted(mg.variables_set) + sorted(mg.propositions_set - mg.variables_set)
+        self.element_index = {element: idx for idx, element in enumerate(self.elements)}
+        for edge in self.edges: # Elements of edges missing from the sets of the metagraph come last
+            for element in list(edge.invertex) + list(edge.outvertex) + list(edge.attributes or []):
+                if element not in self.element_index:
+                    self.element_index[element] = len(self.elements)
+                    self.elements.append(element)
+        self.unknown_bit = 1 << len(self.elements) # Bit of targets with elements unknown to the metagraph
+
+        self.invertices = [] # Invertex mask of each edge (attributes included, as in mgtoolkit)
+        self.outvertices = [] # Outvertex mask of each edge
+        self.attributes = [] # Attributes mask of each edge
+        for edge in self.edges:
+            self.invertices.append(self.mask(edge.invertex))
+            self.outvertices.append(self.mask(edge.outvertex))
+            self.attributes.append(self.mask(edge.attributes if edge.attributes else []))
+
+        self.edge_count = len(self.edges)
+        self.edge_index = {} # Index of each edge by (invertex, outvertex), first one if listed twice
+        for idx, edge in enumerate(self.edges):
+            self.edge_index.setdefault((edge.invertex, edge.outvertex), idx)
+        self.all_edges = (1 << self.edge_count) - 1 # Mask with every edge set
+
+        # Inverted index for forward chaining: edges using each element in their invertex
+        self.element_edges = [[] for element in self.elements]
+        self.invertex_sizes = []
+        for idx, invertex in enumerate(self.invertices):
+            for element_idx in bit_indices(invertex):
+                self.element_edges[element_idx].append(idx)
+            self.invertex_sizes.append(len(bit_indices(invertex)))
+
+        # Inverted index for backward chaining: edges producing each element in their outvertex
+        self.producer_edges = [[] for element in self.elements]
+        for idx, outvertex in enumerate(self.outvertices):
+            for element_idx in bit_indices(outvertex):
+                self.producer_edges[element_idx].append(idx)
+
+    # Mask of a set of elements. Elements unknown to the metagraph are ignored, they are used
+    # by no edge (targets use target_mask, so that they are never covered).
+    def mask(self, elements):
+        mask = 0
+        for element in elements:
+            idx = self.element_index.get(element)
+            if idx is not None:
+                mask |= 1 << idx
+        return mask
+
+    # Set of elements corresponding to a mask (the unknown bit has no element)
+    def elements_of(self, mask):
+        elements = set()
+        for idx in bit_indices(mask & (self.unknown_bit - 1)):
+            elements.add(self.elements[idx])
+        return elements
+
+    # Mask of a list of edges
+    def edges_mask(self, edges):
+        mask = 0
+        for edge in edges:
+            idx = self.edge_index.get((edge.invertex, edge.outvertex))
+            if idx is not None:
+                mask |= 1 << idx
+        return mask
+
+    # List of edges corresponding to a mask, in edge order
+    def edges_of(self, mask):
+        return [self.edges[idx] for idx in bit_indices(mask)]
+
+
+# Get the compact representation of a metagraph, cached on the metagraph object
+# The cache is rebuilt whenever the edge list of the metagraph changes
+def get_compact_metagraph(mg):
+    compact = getattr(mg, "compact_metagraph", None)
+    if compact is None or compact.edges != tuple(mg.edges):
+        compact = CompactMetagraph(mg)
+        mg.compact_metagraph = compact
+    return compact
+
+
+# Indices of the bits set in a mask, in increasing order
+def bit_indices(mask):
+    indices = []
+    while mask:
+        low_bit = mask & -mask
+        indices.append(low_bit.bit_length() - 1)
+        mask ^= low_bit
+    return indices
+
+
+# Mask of a target given either as a set of elements or as a single element
+# A target with elements unknown to the metagraph gets cm.unknown_bit, which no edge produces,
+# so that it can never be covered.
+def target_mask(cm, C):
+    if not isinstance(C, (set, frozenset, list, tuple)):
+        C = [C]
+    mask = cm.mask(C)
+    if any(element not in cm.element_index for element in C):
+        mask |= cm.unknown_bit
+    return mask
+
+
+###############################################################################
+# Closure
+
+# Forward chaining closure from a source mask, in the style of Horn clause unit propagation
+# Each edge keeps the number of elements of its invertex not reached yet, an edge fires
+# when it reaches zero, so a closure costs O(total size of the invertices and outvertices).
+# Only edges in edges_mask are considered (all edges by default).
+# Returns (covering, fired): the mask of elements produced by fired edges (source not
+# included) and the mask of fired edges.
+def closure(cm, source, edges_mask=None):
+    if edges_mask is None:
+        edges_mask = cm.all_edges
+    element_edges = cm.element_edges
+    outvertices = cm.outvertices
+    unmet = list(cm.invertex_sizes) # Number of invertex elements not reached yet, per edge
+
+    reached = 0 # Elements reached (source and produced)
+    covering = 0
+    fired = 0
+    queue = [] # Elements reached but not propagated yet
+    element_count = len(element_edges)
+
+    def reach(mask):
+        nonlocal reached
+        new = mask & ~reached
+        reached |= new
+        for element_idx in bit_indices(new):
+            if element_idx < element_count: # Elements unknown to the metagraph are used by no edge
+                queue.append(element_idx)
+
+    reach(source)
+    # Edges with an empty invertex fire right away
+    for idx in range(cm.edge_count):
+        if not unmet[idx] and (edges_mask >> idx) & 1:
+            fired |= 1 << idx
+            covering |= outvertices[idx]
+            reach(outvertices[idx])
+
+    while queue:
+        element_idx = queue.pop()
+        for idx in element_edges[element_idx]:
+            unmet[idx] -= 1
+            if not unmet[idx] and (edges_mask >> idx) & 1:
+                fired |= 1 << idx
+                covering |= outvertices[idx]
+                reach(outvertices[idx])
+
+    return covering, fired
+
+
+# Backward closure from a target mask, over the reversed metagraph
+# An element is relevant if it is in the target or in the invertex of a relevant edge, and an
+# edge is relevant if its outvertex contains a relevant element. Every edge of a minimal
+# metapath to the target is relevant, the other edges can be ignored by the searches.
+# Only the edges of edges_mask are used, all of them if None.
+# Returns (elements, edges): the masks of relevant elements and relevant edges.
+def backward_closure(cm, target, edges_mask=None):
+    if edges_mask is None:
+        edges_mask = cm.all_edges
+    producer_edges = cm.producer_edges
+    invertices = cm.invertices
+    element_count = len(producer_edges)
+
+    elements = target
+    edges = 0
+    queue = [element_idx for element_idx in bit_indices(target) if element_idx < element_count]
+    while queue:
+        element_idx = queue.pop()
+        for idx in producer_edges[element_idx]:
+            if not (edges >> idx) & 1 and (edges_mask >> idx) & 1:
+                edges |= 1 << idx
+                new = invertices[idx] & ~elements
+                elements |= new
+                queue.extend(bit_indices(new))
+
+    return elements, edges
+
+
+# Round of forward chaining from source in which each edge fires: round 0 for the edges enabled
+# by source, round r + 1 for those enabled by the outputs of rounds up to r.
+# Returns the list of rounds by edge index, None for the edges never fired.
+def firing_rounds(cm, source):
+    invertices = cm.invertices
+    outvertices = cm.outvertices
+
+    rounds = [None] * cm.edge_count
+    reached = source
+    pending = list(range(cm.edge_count))
+    current_round = 0
+    while pending:
+        enabled = [idx for idx in pending if not invertices[idx] & ~reached]
+        if not enabled:
+            break
+        for idx in enabled:
+            rounds[idx] = current_round
+            reached |= outvertices[idx]
+        pending = [idx for idx in pending if rounds[idx] is None]
+        current_round += 1
+    return rounds
+
+
+# Element graph of the metagraph: successors of an element are the outputs of the edges using it
+# Only the edges of edges_mask are used, all of them if None.
+def element_successors(cm, edges_mask=None):
+    if edges_mask is None:
+        edges_mask = cm.all_edges
+    successors = []
+    for edges in cm.element_edges:
+        outputs = 0
+        for idx in edges:
+            if (edges_mask >> idx) & 1:
+                outputs |= cm.outvertices[idx]
+        successors.append(bit_indices(outputs))
+    return successors
+
+
+# Strongly connected components of the graph over nodes 0..n-1 given by successor lists
+# Iterative Tarjan, so the depth of the graph is not bounded by the recursion limit.
+# Returns the components as lists of nodes, in reverse topological order (successors first).
+def strongly_connected_components(successors):
+    node_count = len(successors)
+    unvisited = -1
+    ids = [unvisited] * node_count
+    low = [0] * node_count
+    on_stack = [False] * node_count
+    stack = [] # Nodes of the components not closed yet
+    components = []
+    next_id = 0
+
+    for root in range(node_count):
+        if ids[root] != unvisited:
+            continue
+        ids[root] = low[root] = next_id
+        next_id += 1
+        stack.append(root)
+        on_stack[root] = True
+        work = [(root, 0)] # (node, position of the next successor to visit)
+
+        while work:
+            node, position = work[-1]
+            node_successors = successors[node]
+            if position < len(node_successors):
+                work[-1] = (node, position + 1)
+                next_node = node_successors[position]
+                if ids[next_node] == unvisited:
+                    ids[next_node] = low[next_node] = next_id
+                    next_id += 1
+                    stack.append(next_node)
+                    on_stack[next_node] = True
+                    work.append((next_node, 0))
+                elif on_stack[next_node]:
+                    low[node] = min(low[node], ids[next_node])
+                continue
+
+            # All successors visited, node is the root of a component if its low-link is its id
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                low[parent] = min(low[parent], low[node])
+            if low[node] == ids[node]:
+                component = []
+                while True:
+                    member = stack.pop()
+                    on_stack[member] = False
+                    component.append(member)
+                    if member == node:
+                        break
+                components.append(component)
+
+    return components
+
+
+###############################################################################
+# Shortest hyperpaths
+
+# Generalised Dijkstra over the edges of the metagraph (Knuth's superior functions, Gallo's
+# B-hyperpaths): the distance of an element is 0 if it is in source, else the lowest
+# weights[idx] + combine(distances of the invertex) over the edges idx producing it, combine being
+# "sum" or "max". An edge is relaxed once, when the last element of its invertex is settled, so a
+# search costs O((elements + total size of the vertices) log elements). Weights must not be negative.
+# Returns (distances, predecessors) by element index: the distance of each element (None if not
+# reached) and the edge giving it (None for the source and the elements not reached).
+def hyperpath_distances(cm, source, weights, combine="sum"):
+    if combine not in ("sum", "max"):
+        raise ValueError("Unknown combine {}, expected sum or max".format(combine))
+    invertices = cm.invertices
+    outvertices = cm.outvertices
+    element_edges = cm.element_edges
+
+    element_count = len(cm.elements)
+    distances = [None] * element_count
+    predecessors = [None] * element_count
+    settled = [False] * element_count
+    remaining = list(cm.invertex_sizes) # Elements of each invertex not settled yet
+    inputs_cost = [0] * cm.edge_count # Combined distance of the settled elements of each invertex
+
+    heap = []
+    for element_idx in bit_indices(source):
+        distances[element_idx] = 0
+        heap.append((0, element_idx))
+    for idx in range(cm.edge_count):
+        if not invertices[idx]: # Edge without inputs, enabled from the start
+            remaining[idx] = -1
+            for element_idx in bit_indices(outvertices[idx]):
+                if distances[element_idx] is None or weights[idx] < distances[element_idx]:
+                    distances[element_idx] = weights[idx]
+                    predecessors[element_idx] = idx
+                    heap.append((weights[idx], element_idx))
+    heapq.heapify(heap)
+
+    while heap:
+        distance, element_idx = heapq.heappop(heap)
+        if settled[element_idx]:
+            continue
+        settled[element_idx] = True
+        if element_idx >= len(element_edges): # Element unknown to the edges
+            continue
+        for idx in element_edges[element_idx]:
+            if combine == "sum":
+                inputs_cost[idx] += distance
+            else:
+                inputs_cost[idx] = max(inputs_cost[idx], distance)
+            remaining[idx] -= 1
+            if remaining[idx]:
+                continue
+            edge_distance = weights[idx] + inputs_cost[idx] # Last input settled, edge relaxed
+            for output_idx in bit_indices(outvertices[idx]):
+                if not settled[output_idx] and (distances[output_idx] is None or edge_distance < distances[output_idx]):
+                    distances[output_idx] = edge_distance
+                    predecessors[output_idx] = idx
+                    heapq.heappush(heap, (edge_distance, output_idx))
+
+    return distances, predecessors
+
+
+# Cheapest metapath from source to target along the shortest hyperpaths of hyperpath_distances
+# The edges are collected backwards from the target through the predecessors, then those the
+# target does not need are removed, highest weight first, keeping the edges that still fire
+# from source (closure). The result is a metapath whose edges
+# can fire in order from source, of total weight at most the sum of the target distances. With
+# combine="sum", an edge shared by two branches is counted once in the total weight but twice in
+# the distances, so the result is not always the cheapest edge set (an NP-hard problem).
+# Returns (edges_mask, weight), None if target is not reachable.
+def cheapest_hyperpath(cm, source, target, weights, combine="sum"):
+    distances, predecessors = hyperpath_distances(cm, source, weights, combine)
+    target_elements = bit_indices(target & ~source)
+    if any(element_idx >= len(distances) or distances[element_idx] is None for element_idx in target_elements):
+        return None
+
+    edges_mask = 0
+    stack = target_elements
+    seen = target | source
+    while stack:
+        idx = predecessors[stack.pop()]
+        if (edges_mask >> idx) & 1:
+            continue
+        edges_mask |= 1 << idx
+        for element_idx in bit_indices(cm.invertices[idx] & ~seen):
+            seen |= 1 << element_idx
+            stack.append(element_idx)
+
+    for idx in sorted(bit_indices(edges_mask), key=lambda idx: -weights[idx]):
+        if not (edges_mask >> idx) & 1:
+            continue
+        covering, fired = closure(cm, source, edges_mask & ~(1 << idx))
+        if not target & ~source & ~covering:
+            edges_mask = fired
+
+    return edges_mask, sum(weights[idx] for idx in bit_indices(edges_mask))
+
+
+###############################################################################
+# Searches
+
+# Lazy depth-first search of all metapaths from B, with their covering as target
+# Yields (covering, path) on every node of the search tree except the root, where path
+# is the list of edge indices taken. The list is reused by the search, copy it to keep it.
+# With distinct=True each edge set is produced exactly once: a node only extends with
+# edges which are not excluded, and each child excludes the valid edges of its elder
+# siblings, so an edge set is only built from the ordering where, at every step, the
+# lowest indexed edge of the remaining ones usable is taken.
+# The search can start from an inner node of the tree by giving its excluded mask.
+# With a budget (PolicyAnalysisHelper.SearchBudget) the search stops once it is exhausted and
+# does not extend metapaths beyond budget.max_edges edges (taken edges included).
+def iter_metapaths(cm, source, covering, taken, distinct=False, excluded=0, budget=None):
+    invertices = cm.invertices
+    outvertices = cm.outvertices
+    edge_count = cm.edge_count
+    taken_number = len(bit_indices(taken)) # Edges in the metapath before the search
+
+    path = []
+    stack = [(covering, taken, excluded, 0)] # (covering, taken, excluded, next edge index) of each node
+    if covering:
+        yield covering, path
+
+    while stack:
+        covering, taken, excluded, start = stack[-1]
+        available = covering | source
+        blocked = taken | excluded
+
+        # Next valid edge of the node
+        next_idx = -1
+        for idx in range(start, edge_count):
+            if not (blocked >> idx) & 1 and not invertices[idx] & ~available:
+                next_idx = idx
+                break
+
+        if next_idx < 0: # Node fully explored
+            stack.pop()
+            if path:
+                path.pop()
+            continue
+
+        if budget is not None:
+            if budget.exhausted(): # Out of time or results, the node is left out
+                return
+            if not budget.allows_edges(taken_number + len(path) + 1): # Children too long, the node is a leaf
+                stack.pop()
+                if path:
+                    path.pop()
+                continue
+
+        # Edge sets containing next_idx are all built by this child
+        if distinct:
+            stack[-1] = (covering, taken, excluded | (1 << next_idx), next_idx + 1)
+        else:
+            stack[-1] = (covering, taken, excluded, next_idx + 1)
+
+        covering = covering | outvertices[next_idx]
+        path.append(next_idx)
+        stack.append((covering, taken | (1 << next_idx), excluded, 0))
+        if covering:
+            yield covering, path
+
+
+# Depth-first search of a metapath from B to C, returns the list of edge indices taken or None
+# Coverings already explored without success are not explored again, since the
+# edges usable from a covering do not depend on the order in which it was reached.
+# Only edges relevant to the target (backward_closure) are taken, and only when they bring a
+# new relevant element.
+def search_a_metapath(cm, source, target, covering, taken, path):
+    invertices = cm.invertices
+    outvertices = cm.outvertices
+    edge_count = cm.edge_count
+    failed = set()
+    relevant_elements, relevant_edges = backward_closure(cm, target)
+    blocked = cm.all_edges & ~relevant_edges
+
+    def recurse(covering, taken):
+        if covering and not target & ~covering:
+            return True
+        if covering in failed:
+            return False
+
+        available = covering | source
+        for idx in range(edge_count):
+            # Edges which bring no new relevant element cannot help reaching the target
+            if not ((taken | blocked) >> idx) & 1 and not invertices[idx] & ~available and outvertices[idx] & relevant_elements & ~covering:
+                path.append(idx)
+                if recurse(covering | outvertices[idx], taken | (1 << idx)):
+                    return True
+                path.pop()
+
+        failed.add(covering)
+        return False
+
+    if recurse(covering, taken):
+        return path
+    return None
+
+
+# Branch-and-bound search of the minimal metapaths from source to target
+# Yields the edge masks of the metapaths of which no edge can be removed. Edge sets are
+# enumerated once each, as in iter_metapaths(distinct=True), with three cuts:
+# - a node whose covering contains the target is not extended, so no superset of a metapath
+#   found is built (any branch containing a minimal metapath covers the target),
+# - edges not relevant to the target (backward_closure) or which bring no new relevant
+#   element are never taken, since they can be removed from any metapath built with them,
+# - candidates are checked for minimality by leaving each edge out in turn (closure).
+def iter_minimal_metapaths(cm, source, target, budget=None):
+    invertices = cm.invertices
+    outvertices = cm.outvertices
+    edge_count = cm.edge_count
+
+    relevant_elements, relevant_edges = backward_closure(cm, target)
+
+    path = []
+    stack = [(0, 0, cm.all_edges & ~relevant_edges, 0)] # (covering, taken, excluded, next edge index) of each node
+
+    while stack:
+        covering, taken, excluded, start = stack[-1]
+        available = covering | source
+        blocked = taken | excluded
+
+        next_idx = -1
+        for idx in range(start, edge_count):
+            if not (blocked >> idx) & 1 and not invertices[idx] & ~available and outvertices[idx] & relevant_elements & ~covering:
+                next_idx = idx
+                break
+
+        if next_idx < 0:
+            stack.pop()
+            if path:
+                path.pop()
+            continue
+
+        if budget is not None:
+            if budget.exhausted():
+                return
+            if not budget.allows_edges(len(path) + 1):
+                stack.pop()
+                if path:
+                    path.pop()
+                continue
+
+        stack[-1] = (covering, taken, excluded | (1 << next_idx), next_idx + 1)
+        covering = covering | outvertices[next_idx]
+        taken = taken | (1 << next_idx)
+
+        if not target & ~covering: # Metapath found, supersets are not minimal
+            if is_minimal_metapath(cm, source, target, taken):
+                yield taken
+            continue
+
+        path.append(next_idx)
+        stack.append((covering, taken, excluded, 0))
+
+
+# Check that no edge can be removed from the metapath with edge mask edges_mask
+def is_minimal_metapath(cm, source, target, edges_mask):
+    for idx in bit_indices(edges_mask):
+        covering, _ = closure(cm, source, edges_mask & ~(1 << idx))
+        if not target & ~covering:
+            return False
+    return True
+
+
+###############################################################################
+# Dominance
+
+# The checks below give the answers of mgtoolkit on Metapath(source, target, edges), where a
+# metapath is an edge set whose inputs are all in source or produced by one of its edges, and
+# whose outputs contain target (cycles allowed, no firing order required).
+# Edge sets with supported inputs are closed under union, so every edge set has a greatest
+# supported subset, and a proper subset of M is a metapath iff the greatest supported subset
+# of M minus one of its edges covers the target: edge dominance needs one pruning per edge
+# of M instead of a check of each of its 2^|M| subsets.
+
+# Number of edges of edges_mask producing each element
+def producer_counts(cm, edges_mask):
+    counts = [0] * len(cm.producer_edges)
+    for idx in bit_indices(edges_mask):
+        for element_idx in bit_indices(cm.outvertices[idx]):
+            counts[element_idx] += 1
+    return counts
+
+
+# Remove the edges of edges_mask with inputs neither in source nor produced, until none is left
+# counts are the producer_counts of edges_mask, updated in place. removed is a mask of edges to
+# remove first. Returns the mask of the greatest supported subset.
+def prune_unsupported(cm, source, edges_mask, counts, removed=0):
+    invertices = cm.invertices
+    outvertices = cm.outvertices
+    element_edges = cm.element_edges
+
+    queue = bit_indices(removed & edges_mask)
+    edges_mask &= ~removed
+    for idx in bit_indices(edges_mask):
+        for element_idx in bit_indices(invertices[idx] & ~source):
+            if element_idx >= len(counts) or not counts[element_idx]:
+                queue.append(idx)
+                edges_mask &= ~(1 << idx)
+                break
+
+    while queue:
+        idx = queue.pop()
+        for element_idx in bit_indices(outvertices[idx]):
+            counts[element_idx] -= 1
+            if not counts[element_idx] and not (source >> element_idx) & 1: # Element no longer available
+                for consumer_idx in element_edges[element_idx]:
+                    if (edges_mask >> consumer_idx) & 1:
+                        edges_mask &= ~(1 << consumer_idx)
+                        queue.append(consumer_idx)
+
+    return edges_mask
+
+
+# Check that every element of target is produced, according to counts
+def covers_target(counts, target):
+    if target >> len(counts): # Elements unknown to the metagraph are never produced
+        return False
+    for element_idx in bit_indices(target):
+        if not counts[element_idx]:
+            return False
+    return True
+
+
+# Check if edges_mask is a metapath from source to target (mgtoolkit is_metapath)
+def is_metapath_mask(cm, source, target, edges_mask):
+    inputs = 0
+    outputs = 0
+    for idx in bit_indices(edges_mask):
+        inputs |= cm.invertices[idx]
+        outputs |= cm.outvertices[idx]
+    return not inputs & ~outputs & ~source and not target & ~outputs
+
+
+# Check if edges_mask is an edge-dominant metapath (mgtoolkit is_edge_dominant_metapath)
+# The producer counts of the edge set are computed once, then each leave-one-out subset is
+# pruned from a copy of them.
+def is_edge_dominant_mask(cm, source, target, edges_mask):
+    if not is_metapath_mask(cm, source, target, edges_mask):
+        return False
+
+    counts = producer_counts(cm, edges_mask)
+    for idx in bit_indices(edges_mask):
+        subset_counts = list(counts)
+        prune_unsupported(cm, source, edges_mask, subset_counts, 1 << idx)
+        if covers_target(subset_counts, target):
+            return False
+    return True
+
+
+# Check if there is a metapath from source to target using the edges of edges_mask
+def has_metapath(cm, source, target, edges_mask=None):
+    if edges_mask is None:
+        edges_mask = cm.all_edges
+    counts = producer_counts(cm, edges_mask)
+    prune_unsupported(cm, source, edges_mask, counts)
+    return covers_target(counts, target)
+
+
+# Mask of the elements produced by the metapaths from source
+# Every metapath from source is within the greatest supported subset of the edges (the union of
+# two supported edge sets is supported), so there is a metapath from source to target iff target
+# is within the outputs of that subset, as in has_metapath, for any target.
+def metapath_outputs(cm, source):
+    outputs = 0
+    for idx in bit_indices(prune_unsupported(cm, source, cm.all_edges, producer_counts(cm, cm.all_edges))):
+        outputs |= cm.outvertices[idx]
+    return outputs
+
+
+# Mask of the edges which can be in a dominant metapath from source to target
+# The relevant edges (backward closure to target) of a dominant metapath form a metapath, so they
+# are all of its edges, and its inputs are supported: it is within the greatest edge set relevant
+# to target among its own edges and whose inputs are all in source or produced. That set is found
+# by alternating backward closures and pruning of unsupported edges until neither removes an edge.
+# Returns 0 if there is no metapath at all.
+def dominant_candidate_edges(cm, source, target):
+    edges_mask = cm.all_edges
+    while True:
+        _, relevant_edges = backward_closure(cm, target, edges_mask)
+        counts = producer_counts(cm, relevant_edges)
+        supported_edges = prune_unsupported(cm, source, relevant_edges, counts)
+        if not covers_target(counts, target):
+            return 0
+        if supported_edges == edges_mask:
+            return edges_mask
+        edges_mask = supported_edges
+
+
+# Mask of the edges reached from source when a single input of an edge is enough to reach it
+def downstream_edges(cm, source):
+    invertices = cm.invertices
+    outvertices = cm.outvertices
+    reached = source
+    edges_mask = 0
+    changed = True
+    while changed:
+        changed = False
+        for idx in range(cm.edge_count):
+            if not (edges_mask >> idx) & 1 and invertices[idx] & reached:
+                edges_mask |= 1 << idx
+                reached |= outvertices[idx]
+                changed = True
+    return edges_mask
+
+
+# Check if no proper subset of source has a metapath to target (mgtoolkit is_input_dominant_metapath,
+# without the metapath check). Having a metapath is monotone in the source, so only the subsets
+# one element smaller are checked. extra_source is added to every subset, as the propositions
+# are by ConditionalMetagraph.get_all_metapaths_from.
+# mgtoolkit only finds metapaths along the paths of its closure matrix, which start at the
+# source: the edges not downstream of the subset are left out. Cycles that mgtoolkit's A*
+# search still misses can make the two answers differ.
+def is_input_dominant_source(cm, source, target, extra_source=0):
+    elements = bit_indices(source)
+    if len(elements) < 2: # No proper non-empty subset
+        return True
+    for element_idx in elements:
+        subset = (source & ~(1 << element_idx)) | extra_source
+        if has_metapath(cm, subset, target, downstream_edges(cm, subset)):
+            return False
+    return True
+
+
+###############################################################################
+# Parallel searches
+
+# Split the search tree of iter_metapaths at depth prefix_depth
+# Returns the steps of the serial depth-first order: ("node", covering, path) for the nodes
+# above prefix_depth (root included when its covering is not empty) and ("subtree", node)
+# for the nodes at prefix_depth, node being (covering, taken, excluded, path). Subtrees can
+# then be searched independently and their results put back in serial order.
+def split_metapaths(cm, source, covering, taken, prefix_depth, distinct=False, excluded=0):
+    invertices = cm.invertices
+    outvertices = cm.outvertices
+    edge_count = cm.edge_count
+
+    steps = []
+    if prefix_depth <= 0:
+        steps.append(("subtree", (covering, taken, excluded, ())))
+        return steps
+
+    path = []
+    stack = [(covering, taken, excluded, 0)]
+    if covering:
+        steps.append(("node", covering, ()))
+
+    while stack:
+        covering, taken, excluded, start = stack[-1]
+        available = covering | source
+        blocked = taken | excluded
+
+        next_idx = -1
+        for idx in range(start, edge_count):
+            if not (blocked >> idx) & 1 and not invertices[idx] & ~available:
+                next_idx = idx
+                break
+
+        if next_idx < 0:
+            stack.pop()
+            if path:
+                path.pop()
+            continue
+
+        if distinct:
+            stack[-1] = (covering, taken, excluded | (1 << next_idx), next_idx + 1)
+        else:
+            stack[-1] = (covering, taken, excluded, next_idx + 1)
+
+        child = (covering | outvertices[next_idx], taken | (1 << next_idx), excluded)
+        path.append(next_idx)
+        if len(path) == prefix_depth: # Searched by a worker
+            steps.append(("subtree", child + (tuple(path),)))
+            path.pop()
+        else:
+            stack.append(child + (0,))
+            if child[0]:
+                steps.append(("node", child[0], tuple(path)))
+
+    return steps
+
+
+search_context = None # (cm, source, target, distinct, budget) of the searches of a worker process
+
+# Initialise a worker process of parallel_metapaths
+def init_search_worker(cm, source, target, distinct, budget):
+    global search_context
+    search_context = (cm, source, target, distinct, budget)
+
+
+# Search one subtree in a worker process
+# Returns the (covering, path) of the metapaths found and whether the budget ran out.
+# Each worker counts results against its own copy of the budget.
+def search_subtree(node):
+    cm, source, target, distinct, budget = search_context
+    covering, taken, excluded, prefix = node
+    if budget is not None and not budget.allows_edges(len(bit_indices(taken))): # Subtree root too long
+        return [], True
+
+    results = []
+    for covering, path in iter_metapaths(cm, source, covering, taken, distinct, excluded, budget):
+        if target is None or not target & ~covering:
+            if budget is not None and not budget.add_result():
+                break
+            results.append((covering, prefix + tuple(path)))
+    return results, budget is not None and budget.truncated
+
+
+# Parallel version of iter_metapaths, restricted to metapaths covering target (all if None)
+# The search tree is split at prefix_depth (1: one subtree per first edge) and the subtrees
+# are spread over a pool of worker processes. Results are merged in the serial order, so
+# the output does not depend on the number of workers.
+# Returns the list of (covering, path) found, path being a tuple of edge indices.
+# Workers check their copy of the budget, budget.truncated is set if any of them ran out of it.
+# Results are not counted against the budget, this is left to the caller.
+def parallel_metapaths(cm, source, target, covering, taken, distinct=False, workers=None, prefix_depth=1, budget=None, excluded=0):
+    steps = split_metapaths(cm, source, covering, taken, prefix_depth, distinct, excluded)
+    subtrees = [step[1] for step in steps if step[0] == "subtree"]
+
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_search_worker, initargs=(cm, source, target, distinct, budget)) as executor:
+        subtree_results = executor.map(search_subtree, subtrees) # Results come back in submission order
+        for step in steps:
+            if step[0] == "node":
+                if target is None or not target & ~step[1]:
+                    if budget is None or budget.allows_edges(len(bit_indices(taken)) + len(step[2])):
+                        results.append((step[1], step[2]))
+            else:
+                subtree_metapaths, truncated = next(subtree_results)
+                results.extend(subtree_metapaths)
+                if truncated:
+                    budget.truncated = True
+
+    return results
+
+
+###############################################################################
+# Component decomposition
+
+# Edge graph of the metagraph: successors of an edge are the edges using one of its outputs
+# Only the edges of edges_mask are used. Returns successor lists by edge index.
+def edge_successors(cm, edges_mask):
+    successors = [[] for idx in range(cm.edge_count)]
+    for idx in bit_indices(edges_mask):
+        consumers = 0
+        for element_idx in bit_indices(cm.outvertices[idx]):
+            for consumer_idx in cm.element_edges[element_idx]:
+                consumers |= 1 << consumer_idx
+        successors[idx] = bit_indices(consumers & edges_mask)
+    return successors
+
+
+# Condensation of the edge graph of the edges of edges_mask
+# Returns (components, successors): the edge masks of the strongly connected components in
+# topological order (an edge only feeds edges of its own or of later components) and the set of
+# successor components of each component.
+def edge_condensation(cm, edges_mask):
+    successors = edge_successors(cm, edges_mask)
+    components = []
+    component_of = {}
+    for component in reversed(strongly_connected_components(successors)):
+        if not (edges_mask >> component[0]) & 1: # Edge left out, alone in its component
+            continue
+        mask = 0
+        for idx in component:
+            mask |= 1 << idx
+            component_of[idx] = len(components)
+        components.append(mask)
+
+    component_successors = [set() for component in components]
+    for idx, component_idx in component_of.items():
+        for successor_idx in successors[idx]:
+            if component_of[successor_idx] != component_idx:
+                component_successors[component_idx].add(component_of[successor_idx])
+    return components, component_successors
+
+
+# Edge sets of a component which can be its part of a dominant metapath from source
+# Every subset of the component is listed, but those with an edge of which each output is in
+# source or produced by another edge of the subset: the edge could be removed from any metapath.
+# Returns a list of (edges, inputs, outputs, unique_outputs), the empty set first, inputs being
+# the inputs not in source and unique_outputs the outputs that only each edge produces.
+def component_edge_sets(cm, source, component):
+    indices = bit_indices(component)
+    edge_sets = [(0, 0, 0, ())]
+    for subset in range(1, 1 << len(indices)):
+        members = [indices[position] for position in range(len(indices)) if (subset >> position) & 1]
+        edges = 0
+        inputs = 0
+        outputs = 0
+        once = 0 # Outputs of exactly one edge of the subset
+        for idx in members:
+            edges |= 1 << idx
+            inputs |= cm.invertices[idx]
+            once = (once & ~cm.outvertices[idx]) | (cm.outvertices[idx] & ~outputs)
+            outputs |= cm.outvertices[idx]
+        unique_outputs = tuple(cm.outvertices[idx] & once & ~source for idx in members)
+        if all(unique_outputs):
+            edge_sets.append((edges, inputs & ~source, outputs, unique_outputs))
+    return edge_sets
+
+
+component_context = None # (cm, source) of the component tables of a worker process
+
+# Initialise a worker process of component_tables
+def init_component_worker(cm, source):
+    global component_context
+    component_context = (cm, source)
+
+
+def component_worker_edge_sets(component):
+    cm, source = component_context
+    return component_edge_sets(cm, source, component)
+
+
+# component_edge_sets of each component, computed in parallel over a pool of worker processes
+# (serially with workers=1 or a single component). Tables come back in the order of components.
+def component_tables(cm, source, components, workers=None):
+    if workers == 1 or len(components) < 2:
+        return [component_edge_sets(cm, source, component) for component in components]
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_component_worker, initargs=(cm, source)) as executor:
+        return list(executor.map(component_worker_edge_sets, components))
+
+
+# Edge masks of the candidate dominant metapaths from source to target, stitched from the tables
+# of the components (edge_condensation and component_tables of the same edges)
+# Components are taken from the last one to the first one, with the inputs still needed by the
+# edges taken so far (and the target) as the demand: since an edge only feeds edges of its own or
+# of later components, the demand left once a component is taken must be produced by earlier
+# ones. A component edge set is taken if each of its edges produces an element only it produces
+# among them, needed by the demand or by the set itself, and if the earlier components produce
+# the new demand. Partial metapaths with the same demand are stitched together.
+# Every dominant metapath is among the results, which are metapaths but are not all dominant.
+def stitch_components(cm, source, target, components, tables):
+    earlier_outputs = [0] # Outputs of the edges of the components before each component
+    for component in components:
+        outputs = 0
+        for idx in bit_indices(component):
+            outputs |= cm.outvertices[idx]
+        earlier_outputs.append(earlier_outputs[-1] | outputs)
+
+    demands = {target & ~source: [0]} # Partial metapaths by demand
+    if target & ~source & ~earlier_outputs[-1]:
+        return []
+    for component_idx in reversed(range(len(components))):
+        next_demands = {}
+        for demand, partials in demands.items():
+            for edges, inputs, outputs, unique_outputs in tables[component_idx]:
+                needed = demand | inputs
+                if not all(unique & needed for unique in unique_outputs):
+                    continue
+                next_demand = needed & ~outputs
+                if next_demand & ~earlier_outputs[component_idx]:
+                    continue
+                next_demands.setdefault(next_demand, []).extend(partial | edges for partial in partials)
+        demands = next_demands
+    return demands.get(0, [])
+
+
+###############################################################################
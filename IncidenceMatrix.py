@@ -0,0 +1,201 @@
+###############################################################################
+# Imports
+
+from collections import OrderedDict
+
+import numpy as np
+import scipy.sparse as sparse
+
+import CompactMetagraph
+
+
+###############################################################################
+# Incidence matrices
+
+# Sparse incidence matrices of a metagraph, edges x elements
+# Rows are the edges of the compact metagraph (cm.edges), columns its elements (cm.elements:
+# variables then propositions). invertex[i, j] is 1 if element j is in the invertex of edge i
+# (attributes included, as in mgtoolkit), outvertex[i, j] if it is in its outvertex.
+class IncidenceMatrices(object):
+    def __init__(self, cm):
+        self.cm = cm
+        self.element_count = len(cm.elements)
+        self.invertex = self.matrix(cm.invertices)
+        self.outvertex = self.matrix(cm.outvertices)
+        self.invertex_sizes = np.asarray(self.invertex.sum(axis=1)).ravel() # |invertex| of each edge
+
+    # CSR matrix with one row per mask
+    def matrix(self, masks):
+        rows = []
+        columns = []
+        for idx, mask in enumerate(masks):
+            for element_idx in CompactMetagraph.bit_indices(mask):
+                rows.append(idx)
+                columns.append(element_idx)
+        return sparse.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, columns)), shape=(len(masks), self.element_count))
+
+
+# Incidence matrices of a metagraph, cached on its compact metagraph
+def get_incidence_matrices(mg):
+    cm = CompactMetagraph.get_compact_metagraph(mg)
+    matrices = getattr(cm, "incidence_matrices", None)
+    if matrices is None:
+        matrices = IncidenceMatrices(cm)
+        cm.incidence_matrices = matrices
+    return matrices
+
+
+###############################################################################
+# Batch closure
+
+# Boolean matrix (masks x element_count) of element masks
+def masks_to_matrix(masks, element_count):
+    if element_count < 63:
+        return (np.array(masks, dtype=np.int64).reshape(-1, 1) >> np.arange(element_count, dtype=np.int64)) & 1 == 1
+    matrix = np.zeros((len(masks), element_count), dtype=bool)
+    for row, mask in enumerate(masks):
+        matrix[row, CompactMetagraph.bit_indices(mask)] = True
+    return matrix
+
+
+# Element masks of the rows of a boolean matrix
+def matrix_to_masks(matrix):
+    element_count = matrix.shape[1]
+    if element_count < 63:
+        return (matrix.astype(np.int64) << np.arange(element_count, dtype=np.int64)).sum(axis=1).tolist()
+    masks = []
+    for row in matrix:
+        mask = 0
+        for element_idx in np.nonzero(row)[0].tolist():
+            mask |= 1 << element_idx
+        masks.append(mask)
+    return masks
+
+
+# Forward closures of many sources at once, one fixpoint over the whole batch
+# sources is a list of element masks. An edge fires for a source once the number of elements of
+# its invertex reached equals the size of its invertex, i.e. when invertex @ X == |invertex| for
+# the column X of reached elements, and its outvertex is then reached. Rounds stop when no source
+# reaches a new element. Only the edges of edges_mask are used (all of them if None).
+# Returns the masks of the elements produced by the edges fired from each source (source not
+# included, as in CompactMetagraph.closure).
+def batch_closure(matrices, sources, edges_mask=None):
+    invertex = matrices.invertex
+    outvertex = matrices.outvertex
+    invertex_sizes = matrices.invertex_sizes
+    if edges_mask is not None:
+        kept = masks_to_matrix([edges_mask], matrices.cm.edge_count)[0]
+        invertex = invertex[kept]
+        outvertex = outvertex[kept]
+        invertex_sizes = invertex_sizes[kept]
+
+    source_matrix = masks_to_matrix(sources, matrices.element_count).T # Elements x sources
+    outvertex_transpose = outvertex.T.tocsr()
+    produced = np.zeros_like(source_matrix)
+    while True:
+        fired = (invertex @ (source_matrix | produced).astype(np.int32)) == invertex_sizes.reshape(-1, 1) # Edges x sources
+        next_produced = (outvertex_transpose @ fired.astype(np.int32)) > 0
+        if np.array_equal(next_produced, produced):
+            break
+        produced = next_produced
+    return matrix_to_masks(produced.T)
+
+
+# Outputs of the metapaths from many sources at once, as CompactMetagraph.metapath_outputs
+# Greatest supported subset fixpoint over the whole batch: every edge starts kept for every source,
+# and stays kept while its invertex is within the source and the outputs of the kept edges, i.e.
+# invertex @ X == |invertex| for the column X of available elements. Rounds stop when no edge is
+# dropped. Returns the masks of the outputs of the edges kept for each source.
+def batch_metapath_outputs(matrices, sources):
+    invertex = matrices.invertex
+    outvertex_transpose = matrices.outvertex.T.tocsr()
+    invertex_sizes = matrices.invertex_sizes.reshape(-1, 1)
+
+    source_matrix = masks_to_matrix(sources, matrices.element_count).T # Elements x sources
+    kept = np.ones((matrices.cm.edge_count, len(sources)), dtype=bool) # Edges x sources
+    while True:
+        outputs = (outvertex_transpose @ kept.astype(np.int32)) > 0
+        next_kept = kept & ((invertex @ (source_matrix | outputs).astype(np.int32)) == invertex_sizes)
+        if np.array_equal(next_kept, kept):
+            return matrix_to_masks(outputs.T)
+        kept = next_kept
+
+
+SWEEP_BATCH = 1024 # Sources given at once to batch_metapath_outputs by metapath_output_masks
+
+
+# Outputs of the metapaths from each source mask of a metagraph, SWEEP_BATCH sources at a time
+def metapath_output_masks(mg, sources):
+    matrices = get_incidence_matrices(mg)
+    output_masks = []
+    for start in range(0, len(sources), SWEEP_BATCH):
+        output_masks.extend(batch_metapath_outputs(matrices, sources[start:start + SWEEP_BATCH]))
+    return output_masks
+
+
+###############################################################################
+# Reachability index
+
+INDEX_BATCH = 1024 # Sources closed at once when building a ReachabilityIndex
+RECENT_CLOSURES = 64 # Closures of sources outside the index kept by a ReachabilityIndex
+
+
+# Closures of the single elements and of the distinct invertices and outvertices of a metagraph
+# Built with batch_closure, INDEX_BATCH sources at a time, and stored as element masks, so that
+# reachability from any of them is a dict lookup and an AND. Closures of other sources are
+# computed with CompactMetagraph.closure, and only the RECENT_CLOSURES last used are kept.
+class ReachabilityIndex(object):
+    def __init__(self, cm, matrices):
+        self.cm = cm
+        self.element_count = len(cm.elements)
+
+        sources = [1 << element_idx for element_idx in range(self.element_count)]
+        sources.extend(sorted(set(cm.invertices) | set(cm.outvertices)))
+        self.closures = {} # Elements produced from each source mask (source not included)
+        for start in range(0, len(sources), INDEX_BATCH):
+            batch = sources[start:start + INDEX_BATCH]
+            self.closures.update(zip(batch, batch_closure(matrices, batch)))
+        self.recent_closures = OrderedDict() # Closures of other sources, least recently used first
+
+    # Elements produced from source, as CompactMetagraph.closure
+    def produced(self, source):
+        produced = self.closures.get(source)
+        if produced is not None:
+            return produced
+        produced = self.recent_closures.pop(source, None)
+        if produced is None:
+            produced, _ = CompactMetagraph.closure(self.cm, source)
+            if len(self.recent_closures) >= RECENT_CLOSURES:
+                self.recent_closures.popitem(last=False)
+        self.recent_closures[source] = produced
+        return produced
+
+    # Elements reachable from source, source included
+    def reachable(self, source):
+        return self.produced(source) | source
+
+    # Check if every element of target is reachable from source
+    def reaches(self, source, target):
+        return not target & ~self.reachable(source)
+
+    # Mask of the edges fired from source, those whose invertex is reachable
+    def fired_edges(self, source):
+        reachable = self.reachable(source)
+        edges_mask = 0
+        for idx, invertex in enumerate(self.cm.invertices):
+            if not invertex & ~reachable:
+                edges_mask |= 1 << idx
+        return edges_mask
+
+
+# Reachability index of a metagraph, cached on its compact metagraph
+def get_reachability_index(mg):
+    cm = CompactMetagraph.get_compact_metagraph(mg)
+    index = getattr(cm, "reachability_index", None)
+    if index is None:
+        index = ReachabilityIndex(cm, get_incidence_matrices(mg))
+        cm.reachability_index = index
+    return index
+
+
+###############################################################################
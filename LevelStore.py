@@ -0,0 +1,158 @@
+###############################################################################
+# Imports
+
+import os
+import tempfile
+
+import numpy as np
+
+
+###############################################################################
+# Level store
+
+WORD_BITS = 64
+WORD_MASK = (1 << WORD_BITS) - 1
+FLUSH_ROWS = 4096 # Edge sets buffered before being packed
+READ_ROWS = 4096 # Edge sets decoded at once when streaming
+
+
+# Packed storage of the edge sets of one level of pascal_triangle or hasse
+# Edge sets are int masks of at most bits bits, stored as fixed-width rows of 64-bit words in a
+# NumPy array, and split into consecutive groups (end_group closes the current one). Once the
+# array would take more than memory_limit bytes, it is moved to a memory-mapped file of
+# scratch_dir (the default temporary directory if None), removed by close.
+# Rows are read back in order by iter_group and iteration, a chunk at a time.
+class LevelStore(object):
+    def __init__(self, bits, memory_limit=None, scratch_dir=None, capacity=1024):
+        self.words = max(1, -(-bits // WORD_BITS))
+        self.memory_limit = memory_limit
+        self.scratch_dir = scratch_dir
+        self.capacity = capacity # Rows allocated first
+        self.path = None # Memory-mapped file, once spilled
+
+        self.rows = np.zeros((0, self.words), dtype=np.uint64)
+        self.size = 0 # Rows written to self.rows
+        self.group_ends = [] # End row of each group
+        self.pending = [] # Edge sets not packed yet
+
+    # Number of groups
+    def __len__(self):
+        return len(self.group_ends)
+
+    def __iter__(self):
+        self.flush()
+        return self.iter_rows(0, self.size)
+
+    def __repr__(self):
+        return repr([list(self.iter_group(group)) for group in range(len(self))])
+
+    def append(self, edges_set):
+        self.pending.append(edges_set)
+        if len(self.pending) >= FLUSH_ROWS:
+            self.flush()
+
+    def extend(self, edges_sets):
+        for edges_set in edges_sets:
+            self.append(edges_set)
+
+    # Close the current group, possibly empty
+    def end_group(self):
+        self.flush()
+        self.group_ends.append(self.size)
+
+    # Number of edge sets stored
+    def row_count(self):
+        return self.size + len(self.pending)
+
+    def spilled(self):
+        return self.path is not None
+
+    def iter_group(self, group):
+        self.flush()
+        start = self.group_ends[group - 1] if group else 0
+        return self.iter_rows(start, self.group_ends[group])
+
+    def iter_rows(self, start, end):
+        for chunk_start in range(start, end, READ_ROWS):
+            for edges_set in self.decode(self.rows[chunk_start:min(chunk_start + READ_ROWS, end)]):
+                yield edges_set
+
+    # Pack pending edge sets into rows
+    def flush(self):
+        if not self.pending:
+            return
+        if self.words == 1:
+            block = np.array(self.pending, dtype=np.uint64).reshape(-1, 1)
+        else:
+            block = np.array([[(edges_set >> (WORD_BITS * word)) & WORD_MASK for word in range(self.words)] for edges_set in self.pending], dtype=np.uint64)
+        self.reserve(len(block))
+        self.rows[self.size:self.size + len(block)] = block
+        self.size += len(block)
+        self.pending = []
+
+    # Make room for count more rows, in memory up to memory_limit bytes and in a mapped file beyond
+    def reserve(self, count):
+        capacity = len(self.rows)
+        if self.size + count <= capacity:
+            return
+        new_capacity = max(2 * capacity, self.size + count, self.capacity)
+        nbytes = new_capacity * self.words * self.rows.itemsize
+
+        if self.path is None and (self.memory_limit is None or nbytes <= self.memory_limit):
+            rows = np.zeros((new_capacity, self.words), dtype=np.uint64)
+            rows[:self.size] = self.rows[:self.size]
+            self.rows = rows
+            return
+
+        if self.path is None: # Spill to disk
+            fd, self.path = tempfile.mkstemp(prefix="level-", suffix=".dat", dir=self.scratch_dir)
+            os.close(fd)
+            old_rows = self.rows
+        else:
+            self.rows.flush()
+            old_rows = None
+            self.rows = None # Unmap before resizing
+
+        with open(self.path, "r+b") as level_file:
+            level_file.truncate(nbytes)
+        self.rows = np.memmap(self.path, dtype=np.uint64, mode="r+", shape=(new_capacity, self.words))
+        if old_rows is not None:
+            self.rows[:self.size] = old_rows[:self.size]
+
+    def decode(self, block):
+        if self.words == 1:
+            return block[:, 0].tolist()
+        edges_sets = []
+        for row in block.tolist():
+            edges_set = 0
+            for word, value in enumerate(row):
+                edges_set |= value << (WORD_BITS * word)
+            edges_sets.append(edges_set)
+        return edges_sets
+
+    # Write the rows to level_file, an open binary file, in .npy format
+    # Returns the end row of each group, needed to load them back.
+    def save(self, level_file):
+        self.flush()
+        np.save(level_file, np.asarray(self.rows[:self.size]))
+        return list(self.group_ends)
+
+    # Store over the rows saved to path, read from the file as they are streamed
+    @classmethod
+    def load(cls, path, group_ends, memory_limit=None, scratch_dir=None):
+        rows = np.load(path, mmap_mode="r")
+        level_store = cls(rows.shape[1] * WORD_BITS, memory_limit, scratch_dir)
+        level_store.rows = rows
+        level_store.size = len(rows)
+        level_store.group_ends = list(group_ends)
+        return level_store
+
+    # Release the rows, and remove the mapped file if any
+    def close(self):
+        self.rows = np.zeros((0, self.words), dtype=np.uint64)
+        self.size = 0
+        self.group_ends = []
+        self.pending = []
+        if self.path is not None:
+            os.remove(self.path)
+            self.path = None
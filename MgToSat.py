@@ -9,6 +9,8 @@ import Utility
 import YawlToMetagraph
 import TriplesToMetagraph
 import PolicyAnalysisHelper
+import CompactMetagraph
+import IncidenceMatrix
 
 from mgtoolkit.library import *
 
@@ -57,26 +59,17 @@ def load_workflow_from_test():
     return workflow_metagraph
 
 
+# Forward closure from B: elements reachable from B and edges that can be taken
+# Looked up in the reachability index of the metagraph, mg.edges is left untouched
 def find_all_reachable_elements(mg, B, covering=set(), edges_taken=[]):
+    cm = CompactMetagraph.get_compact_metagraph(mg)
     covering = covering.union(B) # Add B to the covering
 
-    edges_not_taken = mg.edges # Initialize edges not taken
-    valid_edges = mg.edges[0] # Initialize to any edge to trigger while loop
-
-    while valid_edges:
-        # Compute valid edges from edges not yet taken
-        valid_edges = set()
-        for edge in edges_not_taken:
-            if covering.issuperset(edge.invertex):
-                valid_edges.add(edge)
-
-        # Add outvertex variables coming from valid edges
-        # Add edges to edges_taken
-        # Remove edges from edges_not_taken
-        for edge in valid_edges:
-            covering = covering.union(edge.outvertex)
-            edges_taken.append(edge)
-            edges_not_taken.remove(edge)
+    source = cm.mask(covering)
+    index = IncidenceMatrix.get_reachability_index(mg)
+    produced, fired = index.produced(source), index.fired_edges(source)
+    covering = covering.union(cm.elements_of(produced))
+    edges_taken = list(edges_taken) + cm.edges_of(fired)
 
     return covering, edges_taken
 
@@ -84,9 +77,10 @@ def find_all_unreachable_elements(mg, B, covering=set(), edges_taken=[]):
     reachable_variables, reachable_edges = find_all_reachable_elements(mg, B, covering, edges_taken)
 
     unreachable_variables = mg.variables_set - reachable_variables
+    reachable_edges_set = set(reachable_edges)
     unreachable_edges = []
     for edge in mg.edges:
-        if edge not in reachable_edges:
+        if edge not in reachable_edges_set:
             unreachable_edges.append(edge)
 
     if glob_verbose >= 2:
@@ -341,6 +335,9 @@ def forced_edge_true(constraints, edge_name_conversion, forced_edge):
     # No need to XOR since it is already enforced by constraints_variables_unique_time
     Utility.print_section("Generating constraints: Forced edge is True at some point")
 
+    if forced_edge is None: # Any metapath
+        return constraints
+
     forced_edge_index = [idx for idx, conversion in enumerate(edge_name_conversion) if conversion[0] == forced_edge][0]
     timesteps = len(edge_name_conversion)
 
@@ -601,11 +598,13 @@ def constraints_on_destination(constraints, variable_name_conversion, edge_name_
     return constraints
 
 
-def solver_instantiation(workflow, mg, yawl_mode, source, target, forced_edge):
+def solver_instantiation(workflow, mg, yawl_mode, source, target, forced_edge, output_sat_name=None):
     ### Creates a file that contains the SAT instantiation of the MG-FE-SPP
+    ### Without forced edge (None) it is the shortest metapath problem
 
     # Generate output file name
-    output_sat_name = generate_output_file_name(workflow, yawl_mode)
+    if output_sat_name is None:
+        output_sat_name = generate_output_file_name(workflow, yawl_mode)
 
     # Make tuple list associating names of variables/edges in the metagraph to those in SAT
     variable_name_conversion, edge_name_conversion = conversions(mg)
@@ -15,6 +15,7 @@ from mgtoolkit.library import *
 
 
 import PolicyAnalysisHelper
+import Checkpoint
 import PolicyInconsistencies
 import PolicyInconsistenciesCouple
 import AtomicChange
@@ -54,6 +55,11 @@ def get_parser():
     parser.add_argument("-o", "--output-file", type=str, metavar="OUTPUT_FILE", default="measures/equivalence.dat", help="path to output file")
     parser.add_argument("-t", "--test", action="store_true", help="Test random atomic changes on movie workflow")
     parser.add_argument("-y", "--yawl-mode", action="store_true", help="specification is in YAWL")
+    parser.add_argument("--dominant-engine", type=str, choices=["auto"] + list(PolicyAnalysisHelper.DOMINANT_ENGINES.keys()), default="auto", help="engine searching the dominant metapaths")
+    parser.add_argument("--edge-ordering", type=str, choices=PolicyAnalysisHelper.EDGE_ORDERINGS.keys(), default="edges_order", help="order of the edges given to pascal_triangle")
+    parser.add_argument("--resume", action="store_true", help="resume dominant metapath searches from their last checkpoint")
+    parser.add_argument("--checkpoint-dir", type=str, metavar="CHECKPOINT_DIR", default="checkpoints/", help="directory of dominant metapath search checkpoints")
+    parser.add_argument("--checkpoint-interval", type=float, metavar="CHECKPOINT_INTERVAL", default=600, help="minimum time between checkpoints, in seconds")
 
     return parser
 
@@ -121,14 +127,14 @@ def load_workflow_from_test():
 
 
 # Profile function
-def perf_profile(function, *args):
+def perf_profile(function, *args, **kwargs):
     output_stream = io.StringIO()
     profiler_status = pstats.Stats(stream=output_stream)
     profiler = cProfile.Profile()
     profiler.enable()
 
     # Function to profile
-    function_results = function(*args)
+    function_results = function(*args, **kwargs)
 
     profiler.disable()
     profiler_status.add(profiler)
@@ -166,9 +172,9 @@ def conf_and_red(algorithm, *args):
     return results, et
 
 # Launch and profile algorithm
-def find_doms(algorithm, *args):
+def find_doms(algorithm, *args, **kwargs):
     print_section("Searching for dominant metapaths ({})".format(algorithm.__name__))
-    results, et = perf_profile(algorithm, *args)
+    results, et = perf_profile(algorithm, *args, **kwargs)
     pprint(results)
     print("Execution time: {}".format(et))
     return results, et
@@ -258,7 +264,7 @@ def print_results(et_full_couple, et_couple_recalc, et_full_couple_2):
 ###############################################################################
 # Main
 
-def main(verbose, workflow, atomic_change_type, output_file, test, yawl_mode):
+def main(verbose, workflow, atomic_change_type, output_file, test, yawl_mode, dominant_engine, edge_ordering, resume, checkpoint_dir, checkpoint_interval):
     global glob_verbose
     glob_verbose = verbose
 
@@ -298,7 +304,7 @@ def main(verbose, workflow, atomic_change_type, output_file, test, yawl_mode):
     print(scc)
     #terminate_app(0)
 
-    edges_by_order = PolicyAnalysisHelper.edges_order(workflow_metagraph, source)
+    edges_by_order = PolicyAnalysisHelper.order_edges(workflow_metagraph, source, target, edge_ordering)
     pprint(edges_by_order)
 
 
@@ -306,15 +312,17 @@ def main(verbose, workflow, atomic_change_type, output_file, test, yawl_mode):
     print("A metapath")
     print(a_metapath)
 
-    dominant_edges, redundant_edges = PolicyAnalysisHelper.break_method(workflow_metagraph, source, target)
+    dominant_edges, redundant_edges = PolicyAnalysisHelper.classify_edges(workflow_metagraph, source, target)
     print(dominant_edges)
     print(redundant_edges)
 
-    (results_tri, et_tri) = find_doms(PolicyAnalysisHelper.pascal_triangle, workflow_metagraph, source, target, edges_by_order)
-    #(results_prefix, et_prefix) = find_doms(PolicyAnalysisHelper.edge_set_tree, workflow_metagraph, source, target)
-    #(results_hasse, et_hasse) = find_doms(PolicyAnalysisHelper.hasse, workflow_metagraph, source, target)
+    checkpoint = Checkpoint.Checkpoint(checkpoint_dir, resume, checkpoint_interval)
+    (results_tri, et_tri) = find_doms(PolicyAnalysisHelper.pascal_triangle, workflow_metagraph, source, target, edges_by_order, checkpoint=checkpoint)
+    # Checkpoints of their own, the engine may be pascal_triangle again with another edge order
+    dominant_checkpoint = Checkpoint.Checkpoint(os.path.join(checkpoint_dir, "find_dominant_metapaths"), resume, checkpoint_interval)
+    (results_doms, et_doms) = find_doms(PolicyAnalysisHelper.find_dominant_metapaths, workflow_metagraph, source, target, strategy=dominant_engine, checkpoint=dominant_checkpoint)
 
-    #print(et_tri, et_prefix)
+    #print(et_tri, et_doms)
 
     terminate_app(0)
 
@@ -396,7 +404,7 @@ if __name__ == '__main__':
     print(args)
 
     # Call main
-    main(args.verbose, args.workflow, args.atomic_change_type, args.output_file, args.test, args.yawl_mode)
+    main(args.verbose, args.workflow, args.atomic_change_type, args.output_file, args.test, args.yawl_mode, args.dominant_engine, args.edge_ordering, args.resume, args.checkpoint_dir, args.checkpoint_interval)
 
     terminate_app(0)
 
@@ -3,13 +3,19 @@
 
 import sys
 import argparse # Argument parser
+import time
+import random
 
 from termcolor import colored
 from mgtoolkit.library import *
 
-from bitarray import bitarray, frozenbitarray, util
 from pprint import pprint
 
+import CompactMetagraph
+import Checkpoint
+import IncidenceMatrix
+from LevelStore import LevelStore
+
 
 ###############################################################################
 # General utility
@@ -107,8 +113,196 @@ def edge_in_list(edge, edges):
             return True
     return False
 
+# Insertion-ordered set of metapaths with O(1) insert and membership test
+# Two metapaths are the same if they have the same source, target and set of edges
+class MetapathSet(object):
+    def __init__(self, metapaths=[]):
+        self.metapaths = [] # Metapaths in insertion order
+        self.keys = set() # Keys of metapaths in self.metapaths
+        self.truncated = False # True if computed by a search which ran out of budget
+        for metapath in metapaths:
+            self.add(metapath)
+
+    # Add metapath if it is not in the set, returns True if it was added
+    def add(self, metapath):
+        key = metapath_key(metapath)
+        if key in self.keys:
+            return False
+        self.keys.add(key)
+        self.metapaths.append(metapath)
+        return True
+
+    def __contains__(self, metapath):
+        return metapath_key(metapath) in self.keys
+
+    def __len__(self):
+        return len(self.metapaths)
+
+    def __iter__(self):
+        return iter(self.metapaths)
+
+    def __getitem__(self, index):
+        return self.metapaths[index]
+
+    def __repr__(self):
+        return "MetapathSet({})".format(self.metapaths)
+
+
+# Budget of a metapath query, shared by every search loop it is given to
+# max_edges bounds the number of edges of a metapath, max_results the number of results and
+# timeout the wall-clock time in seconds. A search which runs out of budget stops early and
+# sets truncated: its results are then only part of the full answer. truncated is only set when
+# a result or a search node is actually left out, a search which finds exactly max_results
+# results and nothing more is not truncated.
+class SearchBudget(object):
+    def __init__(self, max_edges=None, max_results=None, timeout=None):
+        self.max_edges = max_edges
+        self.max_results = max_results
+        self.deadline = None if timeout is None else time.monotonic() + timeout
+        self.results = 0 # Results counted so far
+        self.dropped = False # True once a result over max_results was found
+        self.truncated = False
+
+    # Count one result, returns False if max_results are already counted: the result must then be
+    # dropped, the results are marked as truncated and the search must stop
+    def add_result(self):
+        if self.max_results is not None and self.results >= self.max_results:
+            self.dropped = True
+            self.truncated = True
+            return False
+        self.results += 1
+        return True
+
+    # Check if the search must stop, marks the results as truncated if so
+    # It must once out of time or once a result was dropped (add_result)
+    def exhausted(self):
+        if self.dropped:
+            return True
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            self.truncated = True
+            return True
+        return False
+
+    # Check if a metapath can have edges_number edges, marks the results as truncated if not
+    def allows_edges(self, edges_number):
+        if self.max_edges is not None and edges_number > self.max_edges:
+            self.truncated = True
+            return False
+        return True
+
+    def __repr__(self):
+        return "SearchBudget(max_edges={}, max_results={}, results={}, truncated={})".format(self.max_edges, self.max_results, self.results, self.truncated)
+
+
+# Candidate counts of a dominant metapath search
+# evaluated counts the candidates checked for dominance, pruned those dropped without a check
+# because they contain a dominant metapath already found.
+class SearchStats(object):
+    def __init__(self):
+        self.evaluated = 0
+        self.pruned = 0
+
+    def __repr__(self):
+        return "SearchStats(evaluated={}, pruned={})".format(self.evaluated, self.pruned)
+
+
+# Set-trie of edge sets, answers "is a stored set a subset of this candidate" without scanning
+# every stored set. Sets are given as increasing edge indices (e.g. CompactMetagraph.bit_indices).
+class SubsetIndex(object):
+    def __init__(self):
+        self.root = {} # Children of a node by edge index, None marks the end of a stored set
+        self.size = 0
+
+    # Store a set
+    def add(self, indices):
+        node = self.root
+        for index in indices:
+            node = node.setdefault(index, {})
+        if None not in node:
+            node[None] = True
+            self.size += 1
+
+    # Check if a stored set is a subset of the candidate set
+    def has_subset_of(self, indices):
+        indices = list(indices)
+        stack = [(self.root, 0)] # (node, first position of indices still usable)
+        while stack:
+            node, start = stack.pop()
+            if None in node:
+                return True
+            for position in range(start, len(indices)):
+                child = node.get(indices[position])
+                if child is not None:
+                    stack.append((child, position + 1))
+        return False
+
+    def __len__(self):
+        return self.size
+
+
+# Dominance checks of edge sets from source to target, on the compact metagraph
+# Gives the answer of metagraph.is_dominant_metapath(Metapath(source, target, edges)) without
+# building the metapath. Edge sets are int masks, bit i being edges[i]. Input dominance only
+# depends on source and target, so it is computed once.
+class DominanceChecker(object):
+    def __init__(self, metagraph, source, target, edges=None):
+        if edges is None:
+            edges = metagraph.edges
+        self.cm = CompactMetagraph.get_compact_metagraph(metagraph)
+
+        # Bit of each edge of edges in the compact metagraph
+        compact_index = {id(edge): idx for idx, edge in enumerate(self.cm.edges)}
+        self.edge_bits = []
+        for edge in edges:
+            idx = compact_index.get(id(edge))
+            if idx is None:
+                idx = self.cm.edge_index[(edge.invertex, edge.outvertex)]
+            self.edge_bits.append(1 << idx)
+
+        self.source = self.cm.mask(source)
+        self.target = CompactMetagraph.target_mask(self.cm, target)
+        # ConditionalMetagraph.get_all_metapaths_from adds the propositions to every source
+        propositions = self.cm.mask(getattr(metagraph, "propositions_set", set()))
+        self.input_dominant = CompactMetagraph.is_input_dominant_source(self.cm, self.source, self.target, propositions)
+
+    # Mask of an edge set in the compact metagraph
+    def compact_mask(self, edges_set):
+        mask = 0
+        for index in CompactMetagraph.bit_indices(edges_set):
+            mask |= self.edge_bits[index]
+        return mask
+
+    def is_metapath(self, edges_set):
+        return CompactMetagraph.is_metapath_mask(self.cm, self.source, self.target, self.compact_mask(edges_set))
+
+    def is_edge_dominant(self, edges_set):
+        return CompactMetagraph.is_edge_dominant_mask(self.cm, self.source, self.target, self.compact_mask(edges_set))
+
+    def is_input_dominant(self, edges_set):
+        return self.input_dominant and self.is_metapath(edges_set)
+
+    def is_dominant(self, edges_set):
+        return self.input_dominant and self.is_edge_dominant(edges_set)
+
+
+# Hashable key of a metapath: (source, target, edges), sources and targets as frozensets
+# A single element target (as used by find_all_metapaths_from) is kept as is
+def metapath_key(metapath):
+    source = metapath.source
+    target = metapath.target
+    if not isinstance(source, str):
+        source = frozenset(source)
+    if not isinstance(target, str):
+        target = frozenset(target)
+    return (source, target, frozenset(metapath.edge_list))
+
+
 # Add metapath to list of metapaths if its not in it
 def add_metapath(metapath, metapaths):
+    if isinstance(metapaths, MetapathSet):
+        metapaths.add(metapath)
+        return metapaths
+
     metapath_in_list = False
     for mp in metapaths:
         if metapaths_equal(mp, metapath):
@@ -147,110 +341,138 @@ def affected_metapaths_dominance_recalculation(metapaths, affected_edges):
 
 
 # Call find_all_metapaths(mg, B, set(), [], []) to populate the set of metapaths from B.
-def find_all_metapaths(mg, B, covering=set(), edges_taken=[], glob_verbose=0):
-    all_metapaths = []
+# The search runs on the compact (bitmask) representation of the metagraph.
+# With distinct=True each edge set is enumerated once, instead of once per ordering.
+# With workers > 1 the search tree is split at prefix_depth and searched by a pool of processes.
+# With a SearchBudget the search stops when it runs out, budget.truncated tells if it did.
+def find_all_metapaths(mg, B, covering=set(), edges_taken=[], glob_verbose=0, distinct=True, workers=None, prefix_depth=1, budget=None):
+    cm = CompactMetagraph.get_compact_metagraph(mg)
+    source = cm.mask(B)
 
     if glob_verbose >= 1:
         print("\nCalled with params:")
         print("B: {}".format(B))
         print("covering: {}".format(covering))
         print("edges_taken: {}".format(edges_taken))
-        print("all_metapaths_before: {}".format(all_metapaths))
-    if covering: # and "49" in covering:
-        add_metapath(Metapath(B, covering, edges_taken), all_metapaths)
-    if glob_verbose >= 1:
-        print("all_metapaths_after: {}\n".format(all_metapaths))
-
-    # Compute valid edges
-    valid_edges = set()
-    edges_not_taken = set()
-    for edge in mg.edges:
-        if not edge_in_list(edge, edges_taken):
-            edges_not_taken.add(edge)
-    if glob_verbose >= 1:
-        print("edges_not_taken: {}".format(edges_not_taken))
-    for edge in edges_not_taken:
-        if covering.union(B).issuperset(edge.invertex):
-            valid_edges.add(edge)
-    if glob_verbose >= 1:
-        print("valid_edges: {}".format(valid_edges))
 
-    # Compute next edges from valid edges (recursive)
-    for edge in valid_edges:
-        new_covering = covering.union(edge.outvertex)
-        new_edges_taken = list(edges_taken)
-        new_edges_taken.append(edge)
+    all_metapaths = []
+    seen = set() # (covering, edges) masks of metapaths already in all_metapaths
+    prefix = list(edges_taken)
+    prefix_mask = cm.edges_mask(edges_taken)
 
-        new_metapaths = find_all_metapaths(mg, B, new_covering, new_edges_taken)
-        for metapath in new_metapaths:
-            add_metapath(metapath, all_metapaths)
+    if workers is not None and workers > 1:
+        search = CompactMetagraph.parallel_metapaths(cm, source, None, cm.mask(covering), prefix_mask, distinct, workers, prefix_depth, budget)
+    else:
+        search = CompactMetagraph.iter_metapaths(cm, source, cm.mask(covering), prefix_mask, distinct, budget=budget)
+
+    for covering_mask, path in search:
+        edges_mask = prefix_mask
+        for idx in path:
+            edges_mask |= 1 << idx
+        key = (covering_mask, edges_mask)
+        if key not in seen:
+            if budget is not None and not budget.add_result():
+                break
+            seen.add(key)
+            all_metapaths.append(Metapath(B, cm.elements_of(covering_mask), prefix + [cm.edges[idx] for idx in path]))
 
-    return all_metapaths
+    if glob_verbose >= 1:
+        print("all_metapaths: {}\n".format(all_metapaths))
 
+    return all_metapaths
 
-# Call find_all_metapaths(mg, B, set(), []) to populate the set of metapaths from B.
-def find_all_metapaths_from(mg, B, C, covering=set(), edges_taken=[], glob_verbose=0):
-    all_metapaths = []
 
+# Call find_all_metapaths_from(mg, B, C) to populate the list of metapaths from B to C.
+# The search runs on the compact (bitmask) representation of the metagraph.
+# By default a metapath is listed once per ordering of its edges, with distinct=True
+# each edge set is enumerated exactly once.
+# With workers > 1 the search tree is split at prefix_depth and searched by a pool of processes,
+# the metapaths are returned in the same order as the serial search.
+# With a SearchBudget the search stops when it runs out, budget.truncated tells if it did.
+# With relevant_only=True edges which cannot help reach C (CompactMetagraph.backward_closure)
+# are ignored: metapaths using them are not listed, none of them is dominant.
+def find_all_metapaths_from(mg, B, C, covering=set(), edges_taken=[], glob_verbose=0, distinct=False, workers=None, prefix_depth=1, budget=None, relevant_only=False):
     if glob_verbose >= 1:
         print("\nCalled with params:")
         print("B: {}".format(B))
+        print("C: {}".format(C))
         print("covering: {}".format(covering))
         print("edges_taken: {}".format(edges_taken))
+
+    if workers is not None and workers > 1:
+        cm = CompactMetagraph.get_compact_metagraph(mg)
+        prefix = list(edges_taken)
+        target = CompactMetagraph.target_mask(cm, C)
+        results = CompactMetagraph.parallel_metapaths(cm, cm.mask(B), target, cm.mask(covering), cm.edges_mask(edges_taken), distinct, workers, prefix_depth, budget, irrelevant_edges(cm, target, relevant_only))
+        all_metapaths = []
+        for covering_mask, path in results:
+            if budget is not None and not budget.add_result():
+                break
+            all_metapaths.append(Metapath(B, C, prefix + [cm.edges[idx] for idx in path]))
+    else:
+        all_metapaths = list(iter_metapaths_from(mg, B, C, covering, edges_taken, distinct, budget, relevant_only))
+
     if glob_verbose >= 2:
-        print("all_metapaths_before: {}".format(all_metapaths))
-    if covering and C in covering:
-        all_metapaths.append(Metapath(B, C, edges_taken)) # .add(B, C, edges)
-    if glob_verbose >= 2:
-        print("all_metapaths_after: {}\n".format(all_metapaths))
+        print("all_metapaths: {}\n".format(all_metapaths))
 
-    valid_edges = set()
-    edges_not_taken = set()
-    for edge in mg.edges:
-        if not edge_in_list(edge, edges_taken):
-            edges_not_taken.add(edge)
-    if glob_verbose >= 1:
-        print("edges_not_taken: {}".format(edges_not_taken))
-    for edge in edges_not_taken:
-        if covering.union(B).issuperset(edge.invertex):
-            valid_edges.add(edge)
-    if glob_verbose >= 1:
-        print("valid_edges: {}".format(valid_edges))
+    return all_metapaths
 
-    for edge in valid_edges:
-        new_covering = covering.union(edge.outvertex)
-        new_edges_taken = list(edges_taken)
-        new_edges_taken.append(edge)
 
-        new_metapaths = find_all_metapaths_from(mg, B, C, new_covering, new_edges_taken)
-        for metapath in new_metapaths:
-            all_metapaths.append(metapath)
+# Generator version of find_all_metapaths_from: metapaths from B to C are yielded as
+# they are found, so callers can process them with bounded memory and stop early.
+def iter_metapaths_from(mg, B, C, covering=set(), edges_taken=[], distinct=False, budget=None, relevant_only=False):
+    cm = CompactMetagraph.get_compact_metagraph(mg)
+    source = cm.mask(B)
+    target = CompactMetagraph.target_mask(cm, C)
+    prefix = list(edges_taken)
+    excluded = irrelevant_edges(cm, target, relevant_only)
 
-    return all_metapaths
+    for covering_mask, path in CompactMetagraph.iter_metapaths(cm, source, cm.mask(covering), cm.edges_mask(edges_taken), distinct, excluded, budget):
+        if not target & ~covering_mask:
+            if budget is not None and not budget.add_result():
+                return
+            yield Metapath(B, C, prefix + [cm.edges[idx] for idx in path])
 
 
 
+# Mask of the edges the searches from B to target ignore, those which cannot help reach target
+# if relevant_only is set, none otherwise
+def irrelevant_edges(cm, target, relevant_only):
+    if not relevant_only:
+        return 0
+    _, relevant_edges = CompactMetagraph.backward_closure(cm, target)
+    return cm.all_edges & ~relevant_edges
+
+
+# Classify edges as those on a metapath from B to C (dominant) or not (redundant)
+# Reachability is decided with forward chaining closures of the compact metagraph:
+# there is a metapath from X to Y iff Y is produced by the closure of X. Closures are looked up
+# in the reachability index of the metagraph (IncidenceMatrix.get_reachability_index).
 def break_method(metagraph, B, C):
     print("Source: {}; Target: {}".format(B, C))
     dominant_edges = []
     redundant_edges = []
 
-    for edge in metagraph.edges:
+    cm = CompactMetagraph.get_compact_metagraph(metagraph)
+    target = CompactMetagraph.target_mask(cm, C)
+    source = cm.mask(B)
+    index = IncidenceMatrix.get_reachability_index(metagraph)
+    reachable_from_B = index.produced(source)
+
+    for idx, edge in enumerate(cm.edges):
         print("\nTesting edge {}".format(edge))
 
-        B_to_invertex = False
+        B_to_invertex = not source & ~cm.invertices[idx] or not cm.invertices[idx] & ~reachable_from_B
         outvertex_to_C = False
 
         print(B, edge.invertex, edge.outvertex, C)
-        if B.intersection(edge.invertex) == B:
-            B_to_invertex = True
-        elif len(find_a_metapath_from(metagraph, B, edge.invertex)) > 0:
-            B_to_invertex = True
 
-        if C.intersection(edge.outvertex) == C:
-            outvertex_to_C = True
-        elif len(find_a_metapath_from(metagraph, edge.outvertex, C)) > 0:
-            outvertex_to_C = True
+        if B_to_invertex: # Unreachable edges need no backward check
+            if C.intersection(edge.outvertex) == C:
+                outvertex_to_C = True
+            else:
+                if not target & ~index.produced(cm.outvertices[idx]):
+                    outvertex_to_C = True
 
 
         if B_to_invertex and outvertex_to_C: # There is a dominant metapath from B to C using this edge
@@ -261,9 +483,87 @@ def break_method(metagraph, B, C):
     return dominant_edges, redundant_edges
 
 
-# Call find_all_metapaths(mg, B, set(), []) to populate the set of metapaths from B.
+# Classify edges as break_method does, with one forward closure from B and one backward sweep to C
+# An edge is dominant if it fires from B (CompactMetagraph.closure) and if it is relevant to C
+# among the fired edges (CompactMetagraph.backward_closure): one of its outputs is in C or in the
+# invertex of a relevant edge. Both sweeps are linear in the size of the metagraph.
+# It differs from break_method on these edges only (checked in tests/test_edge_classification.py):
+# - an edge whose invertex contains B but which does not fire from B is dominant for
+#   break_method, redundant here;
+# - an edge which fires from B while its invertex neither contains B nor is produced from B
+#   (it uses elements of B which no edge produces again) is redundant for break_method;
+# - an edge which fires from B and is relevant to C, while C is neither within its outvertex nor
+#   produced from its outvertex alone (its outputs reach C together with other elements reachable
+#   from B), is redundant for break_method.
+# Edges only on metapaths supported by a cycle of their own edges do not fire from B, they are
+# redundant here (dominant_candidate_edges gives the exact candidates of dominant metapaths).
+# Returns (dominant_edges, redundant_edges), in the order of the edges of the metagraph.
+def classify_edges(metagraph, B, C):
+    cm = CompactMetagraph.get_compact_metagraph(metagraph)
+    source = cm.mask(B)
+    target = CompactMetagraph.target_mask(cm, C)
+
+    covering, fired = CompactMetagraph.closure(cm, source)
+    if target & ~(covering | source): # No metapath from B to C
+        relevant = 0
+    else:
+        _, relevant = CompactMetagraph.backward_closure(cm, target, fired)
+
+    dominant_edges = cm.edges_of(fired & relevant)
+    redundant_edges = cm.edges_of(cm.all_edges & ~(fired & relevant))
+    print("Source: {}; Target: {}; Dominant edges: {} out of {}".format(B, C, len(dominant_edges), cm.edge_count))
+    return dominant_edges, redundant_edges
+
+
+# Branch-and-bound search of the dominant metapaths from B to C
+# Only minimal metapaths are enumerated (CompactMetagraph.iter_minimal_metapaths), instead of
+# every metapath followed by a dominance check. Input dominance only depends on B and C, it
+# is checked once on the first metapath found, edge dominance is checked on each of them.
+# With a SearchBudget the search stops when it runs out, the result is then marked truncated.
+# Metapaths are built by firing edges from B, so dominant metapaths whose inputs are only
+# produced through a cycle of their own edges are missed: the search is exact on metagraphs whose
+# relevant elements have no cycle (see choose_dominant_engine), use hasse or edge_set_tree otherwise.
+def find_dominant_metapaths_from(mg, B, C, glob_verbose=0, budget=None):
+    cm = CompactMetagraph.get_compact_metagraph(mg)
+
+    dominant_metapaths = MetapathSet()
+    input_dominant = None
+    for edges_mask in CompactMetagraph.iter_minimal_metapaths(cm, cm.mask(B), CompactMetagraph.target_mask(cm, C), budget):
+        metapath = Metapath(B, C, cm.edges_of(edges_mask))
+        if glob_verbose >= 2:
+            print(metapath)
+
+        if input_dominant is None:
+            input_dominant = mg.is_input_dominant_metapath(metapath)
+            if not input_dominant: # No metapath from B to C is dominant
+                break
+
+        if mg.is_edge_dominant_metapath(metapath):
+            if budget is not None and not budget.add_result():
+                break
+            dominant_metapaths.add(metapath)
+
+    if budget is not None and budget.truncated:
+        dominant_metapaths.truncated = True
+
+    if glob_verbose >= 1:
+        print("dominant_metapaths: {}\n".format(dominant_metapaths))
+
+    return dominant_metapaths
+
+
+# Elements produced by the metapaths from B (CompactMetagraph.metapath_outputs)
+# There is a metapath from B to C, in the sense of mgtoolkit is_metapath, iff C is within them.
+# Unlike the closures of the reachability index, the edges of a metapath need not fire in order from B.
+def metapath_outputs(mg, B):
+    cm = CompactMetagraph.get_compact_metagraph(mg)
+    return cm.elements_of(CompactMetagraph.metapath_outputs(cm, cm.mask(B)))
+
+
+# Call find_a_metapath_from(mg, B, C) to find one metapath from B to C.
+# The search runs on the compact (bitmask) representation of the metagraph.
 def find_a_metapath_from(mg, B, C, covering=set(), edges_taken=[], glob_verbose=0):
-    all_metapaths = []
+    cm = CompactMetagraph.get_compact_metagraph(mg)
 
     if glob_verbose >= 1:
         print("\nCalled with params:")
@@ -271,37 +571,14 @@ def find_a_metapath_from(mg, B, C, covering=set(), edges_taken=[], glob_verbose=
         print("C: {}".format(C))
         print("covering: {}".format(covering))
         print("edges_taken: {}".format(edges_taken))
-    if glob_verbose >= 2:
-        print("all_metapaths_before: {}".format(all_metapaths))
-    if covering and C.issubset(covering):
-        all_metapaths.append(Metapath(B, C, edges_taken)) # .add(B, C, edges)
-        return all_metapaths
-    if glob_verbose >= 2:
-        print("all_metapaths_after: {}\n".format(all_metapaths))
-
-    valid_edges = set()
-    edges_not_taken = set()
-    for edge in mg.edges:
-        if not edge_in_list(edge, edges_taken):
-            edges_not_taken.add(edge)
-    if glob_verbose >= 1:
-        print("edges_not_taken: {}".format(edges_not_taken))
-    for edge in edges_not_taken:
-        if covering.union(B).issuperset(edge.invertex):
-            valid_edges.add(edge)
-    if glob_verbose >= 1:
-        print("valid_edges: {}".format(valid_edges))
 
-    for edge in valid_edges:
-        new_covering = covering.union(edge.outvertex)
-        new_edges_taken = list(edges_taken)
-        new_edges_taken.append(edge)
-
-        new_metapaths = find_a_metapath_from(mg, B, C, new_covering, new_edges_taken)
-        all_metapaths += new_metapaths
+    all_metapaths = []
+    path = CompactMetagraph.search_a_metapath(cm, cm.mask(B), CompactMetagraph.target_mask(cm, C), cm.mask(covering), cm.edges_mask(edges_taken), [])
+    if path is not None:
+        all_metapaths.append(Metapath(B, C, list(edges_taken) + [cm.edges[idx] for idx in path]))
 
-        if len(all_metapaths) > 0:
-            return all_metapaths
+    if glob_verbose >= 2:
+        print("all_metapaths: {}\n".format(all_metapaths))
 
     return all_metapaths
 
@@ -335,27 +612,31 @@ def breadth_first_search(metagraph, source):
                 visited[i] = True
 
 
-def tarjan_scc(metagraph):
-    nodes = list(metagraph_nodes(metagraph)) # Nodes in graph
-    n = len(nodes) # Number of nodes in graph
-    g = metagraph_adjacency_list(metagraph) # Adjacency list with directed edges
-
-    stack = [] # Stack for dfs
-
-    unvisited = -1 # Mark nodes unvisited
-    id = 0 # Used to give each node an id
-    scc_count = 0 # Used to count the number of SCCs
-
-    # Index i represents node i
-    ids = [unvisited] * n
-    low = [0] * n
-    on_stack = [False] * n
+# Strongly connected components of the node graph of a metagraph
+# Nodes are the invertices and outvertices of the edges (frozensets), with an arc from the invertex
+# to the outvertex of each edge of edges (all the edges of the metagraph if None). Node ids come
+# from a dict and the search is the iterative Tarjan of CompactMetagraph, in O(V + E).
+# Returns (nodes, components): the nodes in order of first appearance and the components as lists
+# of nodes, in reverse topological order.
+def tarjan_scc(metagraph, edges=None):
+    if edges is None:
+        edges = metagraph.edges
 
-    for idx, node in enumerate(nodes):
-        if ids[idx] == unvisited:
-            g, stack, unvisited, id, scc_count, ids, low, on_stack = dfs_tarjan(nodes[idx], idx, nodes, g, stack, unvisited, id, scc_count, ids, low, on_stack)
+    node_ids = {} # Id of each node
+    successors = [] # Successor ids of each node id
+    for edge in edges:
+        edge_node_ids = []
+        for node in (frozenset(edge.invertex), frozenset(edge.outvertex)):
+            node_id = node_ids.get(node)
+            if node_id is None:
+                node_id = node_ids[node] = len(successors)
+                successors.append([])
+            edge_node_ids.append(node_id)
+        successors[edge_node_ids[0]].append(edge_node_ids[1])
 
-    return (nodes, low)
+    nodes = list(node_ids)
+    components = [[nodes[node_id] for node_id in component] for component in CompactMetagraph.strongly_connected_components(successors)]
+    return nodes, components
 
 
 # Find id of node in list of nodes (frozensets)
@@ -365,45 +646,6 @@ def find_id(nodes, target_node):
             return idx
     return -1
 
-def dfs_tarjan(at, at_id, nodes, g, stack, unvisited, id, scc_count, ids, low, on_stack):
-    print('Called with:')
-    print("Stack: {}".format(stack))
-    print("ids: {}".format(ids))
-    print("low: {}".format(low))
-    print("on_stack: {}".format(on_stack))
-    print("id: {}".format(id))
-    print()
-    #print(at, at_id, stack, unvisited, id, scc_count, ids, low, on_stack)
-
-    stack.append(at_id)
-    on_stack[at_id] = True
-    low[at_id] = id
-    ids[at_id] = id
-    id += 1
-
-    # Visit all neighbours & min low-link on callback
-    if frozenset(at) in g.keys():
-        for next_node in g[frozenset(at)]:
-            next_node_id = find_id(nodes, next_node)
-            if ids[next_node_id] == unvisited:
-                g, stack, unvisited, id, scc_count, ids, low, on_stack = dfs_tarjan(next_node, next_node_id, nodes, g, stack, unvisited, id, scc_count, ids, low, on_stack)
-            if on_stack[next_node_id]:
-                low[at_id] = min(low[at_id], low[next_node_id])
-
-    # After having visited all the neighbours of 'at'
-    # if we're at the start of a SCC empty the seen
-    # stack until we're back to the start of the SCC.
-    if ids[at_id] == low[at_id]:
-        for idx in range(len(stack)):
-            node_id = stack.pop()
-            on_stack[node_id] = False
-            low[node_id] = ids[at_id]
-            if nodes[node_id] == at:
-                break
-        scc_count += 1
-
-    return (g, stack, unvisited, id, scc_count, ids, low, on_stack)
-
 
 
 def edges_order(metagraph, source, mode="bfs"):
@@ -501,350 +743,784 @@ def bfs(at, at_id, nodes, g, unvisited, id, ids, stack, on_stack):
 
 
 
-def dijkstra(metagraph, source):
-    dist = [-1] * metagraph_node_count(metagraph)
+# Edge orderings for pascal_triangle
+# The triangle prunes the supersets of the dominant metapaths found, so orders introducing the
+# edges of short metapaths early prune more. An ordering takes (metagraph, source, target, seed)
+# and returns the edges of the metagraph in a new order, ties kept in metagraph order.
+
+# Order of edges_order, the bfs/dfs variant over the node adjacency list (edges rebuilt from it)
+# Unlike the other orderings it can leave edges out.
+def edges_order_ordering(metagraph, source, target, seed=0):
+    return edges_order(metagraph, source)
+
+
+# Edges by round of forward chaining from source, edges never fired last
+def source_distance_ordering(metagraph, source, target, seed=0):
+    cm = CompactMetagraph.get_compact_metagraph(metagraph)
+    rounds = CompactMetagraph.firing_rounds(cm, cm.mask(source))
+    unfired = cm.edge_count
+    order = sorted(range(cm.edge_count), key=lambda idx: unfired if rounds[idx] is None else rounds[idx])
+    return [cm.edges[idx] for idx in order]
+
+
+# Edges by topological order of the strongly connected components of their inputs in the element
+# graph (latest input component first, then earliest output component)
+def scc_topological_ordering(metagraph, source, target, seed=0):
+    cm = CompactMetagraph.get_compact_metagraph(metagraph)
+    components = CompactMetagraph.strongly_connected_components(CompactMetagraph.element_successors(cm))
+    rank = [0] * len(cm.elements) # Topological rank of the component of each element
+    for component_rank, component in enumerate(reversed(components)):
+        for element_idx in component:
+            rank[element_idx] = component_rank
+
+    def key(idx):
+        input_ranks = [rank[element_idx] for element_idx in CompactMetagraph.bit_indices(cm.invertices[idx])]
+        output_ranks = [rank[element_idx] for element_idx in CompactMetagraph.bit_indices(cm.outvertices[idx])]
+        return (max(input_ranks, default=-1), min(output_ranks, default=-1))
+
+    return [cm.edges[idx] for idx in sorted(range(cm.edge_count), key=key)]
+
+
+# Edges by fan-in (invertex size) first, then by decreasing fan-out (number of edges using their outputs)
+def degree_ordering(metagraph, source, target, seed=0):
+    cm = CompactMetagraph.get_compact_metagraph(metagraph)
+
+    def key(idx):
+        consumers = set()
+        for element_idx in CompactMetagraph.bit_indices(cm.outvertices[idx]):
+            consumers.update(cm.element_edges[element_idx])
+        return (cm.invertex_sizes[idx], -len(consumers))
+
+    return [cm.edges[idx] for idx in sorted(range(cm.edge_count), key=key)]
+
+
+# Edges shuffled with seed
+def random_ordering(metagraph, source, target, seed=0):
+    edges = list(metagraph.edges)
+    random.Random(seed).shuffle(edges)
+    return edges
+
+
+EDGE_ORDERINGS = {
+    "edges_order": edges_order_ordering,
+    "source_distance": source_distance_ordering,
+    "scc_topological": scc_topological_ordering,
+    "degree": degree_ordering,
+    "random": random_ordering,
+}
+
+
+# Edges of metagraph in the order of strategy, one of EDGE_ORDERINGS
+def order_edges(metagraph, source, target, strategy="edges_order", seed=0):
+    if strategy not in EDGE_ORDERINGS:
+        raise ValueError("Unknown edge ordering {}, expected one of {}".format(strategy, sorted(EDGE_ORDERINGS)))
+    return EDGE_ORDERINGS[strategy](metagraph, source, target, seed)
+
+
+# Weight of each edge of the compact metagraph, weight(edge) for a callable, 1 for None
+def edge_weights(cm, weight=None):
+    if weight is None:
+        return [1] * cm.edge_count
+    weights = [weight(edge) for edge in cm.edges]
+    if any(edge_weight < 0 for edge_weight in weights):
+        raise ValueError("Edge weights must not be negative")
+    return weights
+
+
+# Distances of the elements reached from source along B-hyperpaths (CompactMetagraph.hyperpath_distances)
+# weight gives the weight of an edge (1 by default, i.e. distances in edges), combine is "sum" or
+# "max" of the distances of the invertex of an edge. Returns a dict of distance by element reached.
+def dijkstra(metagraph, source, weight=None, combine="sum"):
+    cm = CompactMetagraph.get_compact_metagraph(metagraph)
+    distances, _ = CompactMetagraph.hyperpath_distances(cm, cm.mask(source), edge_weights(cm, weight), combine)
+    return {cm.elements[element_idx]: distance for element_idx, distance in enumerate(distances) if distance is not None}
+
+
+# Cheapest metapath from source to target (CompactMetagraph.cheapest_hyperpath), in polynomial time
+# weight and combine as in dijkstra: with the default weights the metapath has few edges, but not
+# always the fewest, which the MgToSat program finds. Returns None if target is not reachable.
+def cheapest_metapath(metagraph, source, target, weight=None, combine="sum"):
+    cm = CompactMetagraph.get_compact_metagraph(metagraph)
+    result = CompactMetagraph.cheapest_hyperpath(cm, cm.mask(source), CompactMetagraph.target_mask(cm, target), edge_weights(cm, weight), combine)
+    if result is None:
+        return None
+    edges_mask, total_weight = result
+    print("Cheapest metapath: {} edges, weight {}".format(mask_size(edges_mask), total_weight))
+    return Metapath(source, target, cm.edges_of(edges_mask))
 
 
 def find_all_metapaths_from_edges(metagraph, edges, source, target):
     starting_set = {}
 
 
-def bit_array_to_edges(edges, bit_array):
-    edges_from_bit_array = []
-    indices = bit_array.search(1)
-    for index in indices:
-        edges_from_bit_array.append(edges[index])
-    return edges_from_bit_array
+# List of edges of an edge mask, bit i being edges[i]
+def mask_to_edges(edges, mask):
+    return [edges[index] for index in CompactMetagraph.bit_indices(mask)]
 
 
-def edges_to_bit_array(edges, input_edges):
-    edges_bit_array = bitarray(len(edges))
-    edges_bit_array.setall(0)
-    for input_edge in input_edges:
-        for index, edge in enumerate(edges):
-            if input_edge == edge:
-                edges_bit_array[index] = 1
-                break
-    return frozenbitarray(edges_bit_array)
+# Number of edges in an edge mask
+def mask_size(mask):
+    return bin(mask).count("1")
+
+
+# Edge mask printed as a bit string, bit 0 first
+def mask_to_str(mask, size):
+    return "".join("1" if (mask >> index) & 1 else "0" for index in range(size))
+
+
+# Edges of edges which can be in a dominant metapath from source to target, in the order of edges
+# The other edges are left out by CompactMetagraph.dominant_candidate_edges with polynomial closure
+# checks: searching the subsets of the edges kept finds the same dominant metapaths.
+def dominant_candidate_edges(metagraph, source, target, edges=None):
+    if edges is None:
+        edges = metagraph.edges
+    cm = CompactMetagraph.get_compact_metagraph(metagraph)
+    candidates = CompactMetagraph.dominant_candidate_edges(cm, cm.mask(source), CompactMetagraph.target_mask(cm, target))
+
+    kept_edges = []
+    for edge in edges:
+        idx = cm.edge_index.get((edge.invertex, edge.outvertex))
+        if idx is None or (candidates >> idx) & 1: # Edges unknown to the metagraph are kept
+            kept_edges.append(edge)
+    print("Candidate edges: {} out of {}".format(len(kept_edges), len(edges)))
+    return kept_edges
+
+
+# Edge set masks of metapaths whose edges are taken from edges, bit i being edges[i]
+def metapaths_to_masks(edges, metapaths):
+    edge_position = {id(edge): index for index, edge in enumerate(edges)}
+    masks = []
+    for metapath in metapaths:
+        mask = 0
+        for edge in metapath.edge_list:
+            mask |= 1 << edge_position[id(edge)]
+        masks.append(mask)
+    return masks
+
+
+# Dominant metapaths and next level of a search resumed from a checkpoint state
+# The edge sets of the dominant metapaths are added to dominant_edge_sets.
+def restore_checkpoint(state, source, target, edges, dominant_edge_sets):
+    dominant_metapaths = []
+    for edges_set in state["dominant_sets"]:
+        dominant_metapaths.append(Metapath(source, target, mask_to_edges(edges, edges_set)))
+        dominant_edge_sets.add(CompactMetagraph.bit_indices(edges_set))
+    return dominant_metapaths, state["level"] + 1
 
 
 # Construct one level of the Hasse diagram
-def hasse_construct_next_level(metagraph, source, target, edges, hasse_diagram, level, previous_level_sets, glob_verbose=0):
+# Edge sets are int masks, bit i being edges[i]. Candidates of a level are generated Apriori
+# style: two sets of the previous level are only joined if they share all their edges but
+# the last one (highest bit), and a candidate is only kept if all of its subsets one edge
+# smaller survived the previous level, i.e. if none of its proper subsets is dominant
+# (dominant_edge_sets). A superset of a dominant metapath is never dominant, so no dominant
+# metapath is missed. The diagram is only filled if hasse_diagram is not None.
+# Levels are LevelStores with one group per prefix (set without its last edge), the next level
+# being built by streaming over the groups of previous_level_sets.
+# Candidates are checked with dominance, a DominanceChecker over edges (built if not given).
+def hasse_construct_next_level(metagraph, source, target, edges, hasse_diagram, level, previous_level_sets, glob_verbose=0, dominance=None, dominant_edge_sets=None, memory_limit=None, scratch_dir=None):
     print("\n-- LEVEL {} --".format(level))
+    if dominance is None:
+        dominance = DominanceChecker(metagraph, source, target, edges)
+    if dominant_edge_sets is None:
+        dominant_edge_sets = SubsetIndex()
 
     dominant_metapaths = []
-    new_previous_level_sets = []
+    new_previous_level_sets = LevelStore(len(edges), memory_limit, scratch_dir)
 
-    if level == 1:
-        for edge in edges: # First iteration, edges_set is only one edge
-            mp = Metapath(source, target, [edge])
+    # Check candidates sharing a prefix, and store the survivors as a group of the new level
+    def check_candidates(candidates):
+        survivors = []
+        for edges_set in candidates:
             if glob_verbose >= 1:
-                print(mp)
-            if metagraph.is_dominant_metapath(mp):
-                dominant_metapaths.append(mp)
+                print(Metapath(source, target, mask_to_edges(edges, edges_set)))
+            if dominance.is_dominant(edges_set):
+                dominant_metapaths.append(Metapath(source, target, mask_to_edges(edges, edges_set)))
+                dominant_edge_sets.add(CompactMetagraph.bit_indices(edges_set))
             else:
-                new_previous_level_sets.append([edge])
-            hasse_diagram[edges_to_bit_array(edges, [edge])] = []
-        if glob_verbose >= 2:
-            pprint(hasse_diagram)
-            print()
-    else:
-        if glob_verbose >= 2:
-            print(previous_level_sets)
+                survivors.append(edges_set)
+
+            if hasse_diagram is not None:
+                hasse_diagram[edges_set] = []
+                for index in CompactMetagraph.bit_indices(edges_set):
+                    subset = edges_set ^ (1 << index)
+                    if subset in hasse_diagram:
+                        hasse_diagram[subset].append(edges_set)
+
+        if survivors:
+            new_previous_level_sets.extend(survivors)
+            new_previous_level_sets.end_group()
+
+    try:
+        if level == 1:
+            check_candidates([1 << index for index in range(len(edges))]) # First iteration, edges_set is only one edge
+        else:
+            if glob_verbose >= 2:
+                print([mask_to_str(edges_set, len(edges)) for edges_set in previous_level_sets])
+
+            check_dominants = len(dominant_edge_sets) > 0
+            for group in range(len(previous_level_sets)):
+                prefix_sets = list(previous_level_sets.iter_group(group)) # At most one set per edge
+                for idx1, edges_set_1 in enumerate(prefix_sets):
+                    candidates = []
+                    for edges_set_2 in prefix_sets[idx1 + 1:]:
+                        combined_edges_set = edges_set_1 | edges_set_2
+                        if check_dominants and dominant_edge_sets.has_subset_of(CompactMetagraph.bit_indices(combined_edges_set)):
+                            if glob_verbose >= 2:
+                                print("Pruned: {}".format(mask_to_str(combined_edges_set, len(edges))))
+                            continue
+                        candidates.append(combined_edges_set)
+                    check_candidates(candidates) # Sets with prefix edges_set_1
 
-        # Prendre sets deux a deux et combiner en nouveau set.
-        # Uniquement fait partie du niveau suivant si bon nombre d'elements dans le combined set
-        for idx1, edges_set_1 in enumerate(previous_level_sets):
-            for idx2, edges_set_2 in enumerate(previous_level_sets):
-                if glob_verbose >= 2:
-                    print(edges_set_1, edges_set_2)
-                if idx1 < idx2: # Do not redo combinations
-                    edges_set_1_bit_array = edges_to_bit_array(edges, edges_set_1)
-                    edges_set_2_bit_array = edges_to_bit_array(edges, edges_set_2)
-                    combined_edges_set_bit_array = edges_set_1_bit_array | edges_set_2_bit_array
-                    combined_edges_set = bit_array_to_edges(edges, combined_edges_set_bit_array)
-                    if glob_verbose >= 2:
-                        print(edges_set_1_bit_array, edges_set_2_bit_array, combined_edges_set_bit_array)
-                        print(combined_edges_set)
-
-                    if edges_to_bit_array(edges, combined_edges_set) not in hasse_diagram.keys() and len(combined_edges_set) == level:
-                        mp = Metapath(source, target, combined_edges_set)
-                        if glob_verbose >= 1:
-                            print(mp)
-                        if metagraph.is_dominant_metapath(mp):
-                            dominant_metapaths.append(mp)
-                        else:
-                            new_previous_level_sets.append(combined_edges_set)
-                        hasse_diagram[edges_set_1_bit_array].append(combined_edges_set_bit_array)
-                        hasse_diagram[edges_set_2_bit_array].append(combined_edges_set_bit_array)
-                        hasse_diagram[combined_edges_set_bit_array] = []
         if glob_verbose >= 2:
-            pprint(hasse_diagram)
-            print()
-
-    if glob_verbose >= 2:
-        print(new_previous_level_sets)
+            if hasse_diagram is not None:
+                pprint(hasse_diagram)
+                print()
+            print(new_previous_level_sets)
+    except BaseException: # Interrupted, the level is not returned
+        new_previous_level_sets.close()
+        raise
     return dominant_metapaths, hasse_diagram, new_previous_level_sets
 
 # Constructs hasse diagram by combining elements of each level two by two to construct next level
-def hasse(metagraph, source, target, edges=None):
+# With store_diagram=True the adjacency list of the diagram (edge set masks to the masks of their
+# supersets one edge larger) is kept and returned with the dominant metapaths.
+# Levels above memory_limit bytes are spilled to scratch_dir (see LevelStore).
+# With a Checkpoint, the search is saved after each level and resumed from the last one saved
+# (the diagram then only has the levels built after it).
+# With relevant_only, only the dominant_candidate_edges of edges are searched.
+def hasse(metagraph, source, target, edges=None, store_diagram=False, memory_limit=None, scratch_dir=None, checkpoint=None, relevant_only=True):
     if edges is None:
         edges = metagraph.edges
+    if relevant_only:
+        edges = dominant_candidate_edges(metagraph, source, target, edges)
 
     dominant_metapaths = [] # Dominant metapaths found
-    hasse_diagram = {} # Adjacency list of hasse diagram
+    dominant_edge_sets = SubsetIndex() # Edge sets of dominant metapaths
+    hasse_diagram = {} if store_diagram else None # Adjacency list of hasse diagram, edge sets as int masks
+    dominance = DominanceChecker(metagraph, source, target, edges)
 
-    edges_bit_array_size = len(edges) # Size of bit vector
-    #edges_bit_array = bitarray(edges_bit_array_size) # Bit vector representing edges in set
-    #edges_bit_array.setall(0)
-    previous_level_sets = []
+    edges_number = len(edges)
+    previous_level_sets = None
+    first_level = 1
 
-    #edges_bit_array_size = 2
+    if checkpoint is not None:
+        key = Checkpoint.search_key(edges, source, target)
+        state = checkpoint.load("hasse", key, memory_limit, scratch_dir)
+        if state is not None:
+            dominant_metapaths, first_level = restore_checkpoint(state, source, target, edges, dominant_edge_sets)
+            previous_level_sets = state["frontier"]
 
     # Construct Hasse adjacency_list
-    for level in range(1, edges_bit_array_size + 1):
-        dominant_metapaths_of_level, hasse_diagram_of_level, previous_level_sets = hasse_construct_next_level(metagraph, source, target, edges, hasse_diagram, level, previous_level_sets)
-        dominant_metapaths += dominant_metapaths_of_level # Add new metapaths
-        hasse_diagram = hasse_diagram_of_level
-
+    # The last level is closed however the loop ends, so that no spilled level is left behind
+    try:
+        for level in range(first_level, edges_number + 1):
+            if previous_level_sets is not None and not previous_level_sets.row_count(): # No candidate left for the next levels
+                break
+            dominant_metapaths_of_level, hasse_diagram, level_sets = hasse_construct_next_level(metagraph, source, target, edges, hasse_diagram, level, previous_level_sets, dominance=dominance, dominant_edge_sets=dominant_edge_sets, memory_limit=memory_limit, scratch_dir=scratch_dir)
+            dominant_metapaths += dominant_metapaths_of_level # Add new metapaths
+            finished_level_sets, previous_level_sets = previous_level_sets, level_sets
+            if finished_level_sets is not None:
+                finished_level_sets.close()
+            if checkpoint is not None:
+                checkpoint.save("hasse", key, level, metapaths_to_masks(edges, dominant_metapaths), previous_level_sets, force=level == edges_number or not previous_level_sets.row_count())
+    finally:
+        if previous_level_sets is not None:
+            previous_level_sets.close()
+
+    if store_diagram:
+        return dominant_metapaths, hasse_diagram
     return dominant_metapaths
 
 
-def edge_set_tree_construct_next_level(metagraph, source, target, edges, level, dominant_metapaths_bit_arrays, previous_level_sets, glob_verbose=0):
+# Candidates containing a dominant metapath already found (dominant_edge_sets) are dropped
+# without a dominance check, none of their supersets can be dominant either.
+# Edge sets are int masks, bit i being edges[i]
+# Candidates are checked with dominance, a DominanceChecker over edges (built if not given).
+def edge_set_tree_construct_next_level(metagraph, source, target, edges, level, dominant_edge_sets, previous_level_sets, glob_verbose=0, dominance=None):
     print("\n-- LEVEL {} --".format(level))
+    if dominance is None:
+        dominance = DominanceChecker(metagraph, source, target, edges)
 
     dominant_metapaths = []
     new_previous_level_sets = []
-    level_bit_mask = bitarray(len(edges))
-    level_bit_mask.setall(0)
 
     if level == 1:
-        for edge in edges: # First iteration, set is only one edge
-            mp = Metapath(source, target, [edge])
+        for index, edge in enumerate(edges): # First iteration, set is only one edge
             if glob_verbose >= 2:
-                print(mp)
-            if metagraph.is_dominant_metapath(mp):
-                dominant_metapaths.append(mp)
-                dominant_metapaths_bit_arrays.append(edges_to_bit_array(edges, [edge]))
+                print(Metapath(source, target, [edge]))
+            if dominance.is_dominant(1 << index):
+                dominant_metapaths.append(Metapath(source, target, [edge]))
+                dominant_edge_sets.add([index])
             else:
-                new_previous_level_sets.append(edges_to_bit_array(edges, [edge]))
+                new_previous_level_sets.append(1 << index)
     else:
-        new_edges_bit_arrays = []
         if glob_verbose >= 1:
-            print("previous_level_sets: {}".format(previous_level_sets))
-        for edges_bit_array in previous_level_sets:
-            # Set bit mask
-            index = util.rindex(edges_bit_array)
-            level_bit_mask[0:index] = True
-            level_bit_mask[index:] = False
-            if glob_verbose >= 1:
-                print(colored("SET bit mask", "green"))
-                print("IDX: {}".format(index))
-                print(colored("level_bit_mask: {}".format(level_bit_mask), "green"))
-
-            # remove indices of elements in bit mask
-            masked_bit_array = edges_bit_array | level_bit_mask
-            if glob_verbose >= 1:
-                print("edges_bit_array: {}".format(edges_bit_array))
-                print("level_bit_mask: {}".format(level_bit_mask))
-                print("masked_bit_array : {}".format(masked_bit_array))
-
-            indices = masked_bit_array.search(0)
-
-            for index in indices:
-                new_edges_bit_array = bitarray(edges_bit_array)
-                new_edges_bit_array[index] = True
-                new_edges_bit_array = frozenbitarray(new_edges_bit_array)
+            print("previous_level_sets: {}".format([mask_to_str(edges_set, len(edges)) for edges_set in previous_level_sets]))
+        for edges_set in previous_level_sets:
+            # Only extend with edges after the last edge of the set
+            for index in range(edges_set.bit_length(), len(edges)):
+                new_edges_set = edges_set | (1 << index)
                 if glob_verbose >= 1:
-                    print("new_edges_bit_array: {}".format(colored(new_edges_bit_array, "red")))
+                    print("new_edges_set: {}".format(colored(mask_to_str(new_edges_set, len(edges)), "red")))
+
+                if dominant_edge_sets.has_subset_of(CompactMetagraph.bit_indices(new_edges_set)):
+                    if glob_verbose >= 1:
+                        print("SUPERSET OF DOMINANT: removing {}".format(colored(mask_to_str(new_edges_set, len(edges)), "yellow")))
+                    continue
 
-                mp = Metapath(source, target, bit_array_to_edges(edges, new_edges_bit_array))
                 if glob_verbose >= 2:
-                    print(mp)
-                if metagraph.is_dominant_metapath(mp):
+                    print(Metapath(source, target, mask_to_edges(edges, new_edges_set)))
+                if dominance.is_dominant(new_edges_set):
                     if glob_verbose >= 1:
-                        print("DOMINANT: removing {}".format(colored(new_edges_bit_array, "yellow")))
-                    dominant_metapaths.append(mp)
-                    dominant_metapaths_bit_arrays.append(new_edges_bit_array)
+                        print("DOMINANT: removing {}".format(colored(mask_to_str(new_edges_set, len(edges)), "yellow")))
+                    dominant_metapaths.append(Metapath(source, target, mask_to_edges(edges, new_edges_set)))
+                    dominant_edge_sets.add(CompactMetagraph.bit_indices(new_edges_set))
                 else:
-                    new_previous_level_sets.append(new_edges_bit_array)
-
-                new_edges_bit_arrays.append(new_edges_bit_array)
+                    new_previous_level_sets.append(new_edges_set)
 
     if glob_verbose >= 2:
         print("new_previous_level_sets: {}".format(new_previous_level_sets))
-    return dominant_metapaths, dominant_metapaths_bit_arrays, new_previous_level_sets
+    return dominant_metapaths, dominant_edge_sets, new_previous_level_sets
 
 # Constructs a prefix tree for edge sets
-def edge_set_tree(metagraph, source, target, edges=None):
+# With a Checkpoint, the search is saved after each level and resumed from the last one saved.
+# With relevant_only, only the dominant_candidate_edges of edges are searched.
+def edge_set_tree(metagraph, source, target, edges=None, checkpoint=None, relevant_only=True):
     if edges is None:
         edges = metagraph.edges
+    if relevant_only:
+        edges = dominant_candidate_edges(metagraph, source, target, edges)
 
     dominant_metapaths = [] # Dominant metapaths found
-    dominant_metapaths_bit_arrays = []
-    edges_bit_array_size = len(edges) # Size of bit vector
+    dominant_edge_sets = SubsetIndex() # Edge sets of dominant metapaths
+    dominance = DominanceChecker(metagraph, source, target, edges)
+    edges_number = len(edges)
     previous_level_sets = []
+    first_level = 1
+
+    if checkpoint is not None:
+        key = Checkpoint.search_key(edges, source, target)
+        state = checkpoint.load("edge_set_tree", key)
+        if state is not None:
+            dominant_metapaths, first_level = restore_checkpoint(state, source, target, edges, dominant_edge_sets)
+            previous_level_sets = state["frontier"]
 
-    for level in range(1, edges_bit_array_size + 1):
-        dominant_metapaths_of_level, dominant_metapaths_bit_arrays, previous_level_sets = edge_set_tree_construct_next_level(metagraph, source, target, edges, level, dominant_metapaths_bit_arrays, previous_level_sets)
+    for level in range(first_level, edges_number + 1):
+        dominant_metapaths_of_level, dominant_edge_sets, previous_level_sets = edge_set_tree_construct_next_level(metagraph, source, target, edges, level, dominant_edge_sets, previous_level_sets, dominance=dominance)
         dominant_metapaths += dominant_metapaths_of_level # Add new metapaths
+        if checkpoint is not None:
+            checkpoint.save("edge_set_tree", key, level, metapaths_to_masks(edges, dominant_metapaths), previous_level_sets, force=level == edges_number)
 
     return dominant_metapaths
 
 
-def pascal_triangle_construct_level(metagraph, source, target, current_edges, level, dominant_metapaths_bit_arrays, previous_level_sets, glob_verbose=0):
-    print("\n-- LEVEL {} --".format(level))
-    if glob_verbose >= 1:
-        print("previous_level_sets: {}".format(previous_level_sets))
-        print("current_edges: {}".format(current_edges))
+# Depth-first variant of edge_set_tree, visiting the same prefix tree of edge sets
+# Each node of the stack keeps the inputs and outputs (covering) of its edge set, so a child only
+# adds its new edge to them: the metapath check of a child costs one edge update, and memory is
+# bounded by the depth of the tree instead of the width of a level. A metapath is not extended,
+# none of its supersets can be dominant; other supersets of the metapaths found are skipped.
+# Dominant metapaths are returned in depth-first order.
+# With relevant_only, only the dominant_candidate_edges of edges are searched.
+def edge_set_tree_depth_first(metagraph, source, target, edges=None, glob_verbose=0, relevant_only=True):
+    if edges is None:
+        edges = metagraph.edges
+    if relevant_only:
+        edges = dominant_candidate_edges(metagraph, source, target, edges)
+    edges = list(edges)
 
     dominant_metapaths = [] # Dominant metapaths found
-    check_dominants = False
+    dominance = DominanceChecker(metagraph, source, target, edges)
+    if not dominance.input_dominant: # No metapath from source to target can be dominant
+        return dominant_metapaths
+
+    cm = dominance.cm
+    source_mask = dominance.source
+    target_mask = dominance.target
+    edge_inputs = []
+    edge_outputs = []
+    for edge_bit in dominance.edge_bits:
+        compact_index = edge_bit.bit_length() - 1
+        edge_inputs.append(cm.invertices[compact_index])
+        edge_outputs.append(cm.outvertices[compact_index])
+
+    metapath_edge_sets = SubsetIndex() # Edge sets of metapaths found
+    stack = [(0, 0, 0, 0)] # (edges_set, inputs, outputs, next edge index) of each node of the path
+    while stack:
+        edges_set, inputs, outputs, index = stack.pop()
+        if index >= len(edges):
+            continue
+        stack.append((edges_set, inputs, outputs, index + 1)) # Next sibling of the child
+
+        new_edges_set = edges_set | (1 << index)
+        new_inputs = inputs | edge_inputs[index]
+        new_outputs = outputs | edge_outputs[index]
+        if glob_verbose >= 1:
+            print("new_edges_set: {}".format(mask_to_str(new_edges_set, len(edges))))
 
-    level_sets = [] # List containing sets for each element of the level of Pascal's triangle.
-    if level == 1:
-        # Construct sets corresponding to the first level of Pascal's triangle
-        empty_bit_array = bitarray(1)
-        empty_bit_array.setall(0)
-        level_sets = [[empty_bit_array]]
+        if metapath_edge_sets.has_subset_of(CompactMetagraph.bit_indices(new_edges_set)):
+            if glob_verbose >= 1:
+                print("SUPERSET OF METAPATH: removing {}".format(colored(mask_to_str(new_edges_set, len(edges)), "yellow")))
+            continue
 
-        full_bit_array = bitarray(1)
-        full_bit_array.setall(1)
+        if not new_inputs & ~new_outputs & ~source_mask and not target_mask & ~new_outputs: # Metapath
+            metapath_edge_sets.add(CompactMetagraph.bit_indices(new_edges_set))
+            if dominance.is_edge_dominant(new_edges_set):
+                if glob_verbose >= 1:
+                    print("DOMINANT: {}".format(colored(mask_to_str(new_edges_set, len(edges)), "yellow")))
+                dominant_metapaths.append(Metapath(source, target, mask_to_edges(edges, new_edges_set)))
+            continue
 
-        mp = Metapath(source, target, bit_array_to_edges(current_edges, full_bit_array))
-        if glob_verbose >= 1:
-            print(mp)
-        if metagraph.is_dominant_metapath(mp):
-            dominant_metapaths.append(mp)
-            dominant_metapaths_bit_arrays.append(full_bit_array)
-            if glob_verbose >= 1:
-                print("full_bit_array: {}".format(colored(full_bit_array, "green")))
-            level_sets.append([])
-        else:
-            level_sets.append([full_bit_array])
+        stack.append((new_edges_set, new_inputs, new_outputs, index + 1)) # First child
+
+    return dominant_metapaths
 
-    else: # Construct sets corresponding to the nth level of Pascal's triangle
 
-        # Append the 1 on the left of Pascal's triangle
-        empty_bit_array = bitarray(len(current_edges))
-        empty_bit_array.setall(0)
-        if glob_verbose >= 1:
-            print("empty_bit_array: {}".format(colored(empty_bit_array, "red")))
-        level_sets.append([empty_bit_array])
+# With a budget, sets with more than budget.max_edges edges are dropped and the level stops
+# being built once the budget is exhausted (the search then ends after this level).
+# Edge sets are int masks, bit i being current_edges[i]: the edge added by a level is its highest bit.
+# Candidates are checked with dominance, a DominanceChecker over current_edges or a longer list
+# starting with them (built if not given).
+# Levels are LevelStores with one group per element of the level of Pascal's triangle, the new
+# level being built by streaming over the rows of previous_level_sets.
+def pascal_triangle_construct_level(metagraph, source, target, current_edges, level, dominant_edge_sets, previous_level_sets, glob_verbose=0, budget=None, dominance=None, memory_limit=None, scratch_dir=None, stats=None):
+    print("\n-- LEVEL {} --".format(level))
+    if dominance is None:
+        dominance = DominanceChecker(metagraph, source, target, current_edges)
+    if stats is None:
+        stats = SearchStats()
+    if glob_verbose >= 1:
+        print("previous_level_sets: {}".format(previous_level_sets))
+        print("current_edges: {}".format(current_edges))
+
+    dominant_metapaths = [] # Dominant metapaths found
+    check_dominants = len(dominant_edge_sets) > 0 # Dominants of the previous levels prune this one too
+    new_edge_bit = 1 << (level - 1) # Bit of the edge added by this level
+    full_set = (1 << level) - 1 # Set of all current edges
 
-        # Iterate previous level two by two to construct middle of Pascal's triangle
-        for left_level_set, right_level_set in zip(previous_level_sets, previous_level_sets[1:]):
-            # Compute combination of set: new_edge * left_level_set + right_level_set
-            combined_set = list() # Combined set corresponding to one element on this level of Pascal's triangle
+    level_sets = LevelStore(level, memory_limit, scratch_dir) # Sets for each element of the level of Pascal's triangle, one group each
+    try:
+        if level == 1:
+            # Construct sets corresponding to the first level of Pascal's triangle
+            level_sets.append(0)
+            level_sets.end_group()
 
-            # new_edge * left_level_set
             if glob_verbose >= 1:
-                print("left_level_set: {}".format(left_level_set))
-            for level_set in left_level_set:
-                if glob_verbose >= 1:
-                    print("level_set: {}".format(level_set))
-                new_level_set = bitarray(level_set)
-                new_level_set.append(1) # Add new edge to each level_set
+                print(Metapath(source, target, mask_to_edges(current_edges, full_set)))
+            stats.evaluated += 1
+            if dominance.is_dominant(full_set):
+                if budget is None or budget.add_result():
+                    dominant_metapaths.append(Metapath(source, target, mask_to_edges(current_edges, full_set)))
+                dominant_edge_sets.add(CompactMetagraph.bit_indices(full_set))
                 if glob_verbose >= 1:
-                    print("new_level_set: {}".format(colored(new_level_set, "red")))
-                    print(current_edges)
+                    print("full_set: {}".format(colored(mask_to_str(full_set, level), "green")))
+            else:
+                level_sets.append(full_set)
+            level_sets.end_group()
 
-                # Check if dominant metapath which is a subset already exists
-                dominant_subset_exists = False
-                if check_dominants:
-                    if glob_verbose >= 1:
-                        print(dominant_metapaths_bit_arrays)
-                    for dominant_metapaths_bit_array in dominant_metapaths_bit_arrays:
-                        if glob_verbose >= 1:
-                            print(len(dominant_metapaths_bit_array))
-                            print(len(new_level_set))
+        else: # Construct sets corresponding to the nth level of Pascal's triangle
 
-                        # Extend length of previous bit strings for comparison
-                        if len(new_level_set) != len(dominant_metapaths_bit_array):
-                            toapp = [0] * (len(new_level_set) - len(dominant_metapaths_bit_array))
-                            if glob_verbose >= 1:
-                                print(toapp)
-                            dominant_metapaths_bit_array.extend(toapp)
+            # Append the 1 on the left of Pascal's triangle
+            level_sets.append(0)
+            level_sets.end_group()
 
-                        if new_level_set & dominant_metapaths_bit_array == dominant_metapaths_bit_array:
-                            # A dominant metapath which is a subset exists
-                            dominant_subset_exists = True
+            # Iterate previous level two by two to construct middle of Pascal's triangle
+            for left_group in range(len(previous_level_sets) - 1):
+                if budget is not None and budget.exhausted():
+                    break
 
+                # Compute combination of set: new_edge * left_level_set + right_level_set
+                # The combined set corresponding to one element on this level of Pascal's triangle is the new group
 
-                if not dominant_subset_exists:
-                    mp = Metapath(source, target, bit_array_to_edges(current_edges, new_level_set))
-                    if glob_verbose >= 1:
-                        print(mp)
-                    if metagraph.is_dominant_metapath(mp):
-                        dominant_metapaths.append(mp)
-                        dominant_metapaths_bit_arrays.append(new_level_set)
-                        check_dominants = True
-                        if glob_verbose >= 1:
-                            print("new_level_set: {}".format(colored(new_level_set, "green")))
-                    else:
-                        combined_set.append(new_level_set)
+                # new_edge * left_level_set
+                if glob_verbose >= 1:
+                    print("left_level_set: {}".format(list(previous_level_sets.iter_group(left_group))))
+                for level_set in previous_level_sets.iter_group(left_group):
+                    new_level_set = level_set | new_edge_bit # Add new edge to each level_set
                     if glob_verbose >= 1:
-                        print()
-
+                        print("new_level_set: {}".format(colored(mask_to_str(new_level_set, level), "red")))
+                    if budget is not None and not budget.allows_edges(mask_size(new_level_set)):
+                        continue # Supersets are too long as well
+
+                    # Check if dominant metapath which is a subset already exists
+                    dominant_subset_exists = False
+                    if check_dominants:
+                        dominant_subset_exists = dominant_edge_sets.has_subset_of(CompactMetagraph.bit_indices(new_level_set))
+                        if dominant_subset_exists:
+                            stats.pruned += 1
+                            if glob_verbose >= 1:
+                                print("Dominant subset of {} exists".format(mask_to_str(new_level_set, level)))
 
-            # + right_level_set
-            if glob_verbose >= 1:
-                print("right_level_set: {}".format(right_level_set))
-            for level_set in right_level_set:
-                if glob_verbose >= 1:
-                    print("level_set: {}".format(level_set))
-                new_level_set = bitarray(level_set)
-                new_level_set.append(0) # Extend bit_array to consider new edge
-                if glob_verbose >= 1:
-                    print("new_level_set: {}\n".format(colored(new_level_set, "red")))
+                    if not dominant_subset_exists:
+                        if glob_verbose >= 1:
+                            print(Metapath(source, target, mask_to_edges(current_edges, new_level_set)))
+                        stats.evaluated += 1
+                        if dominance.is_dominant(new_level_set):
+                            if budget is None or budget.add_result():
+                                dominant_metapaths.append(Metapath(source, target, mask_to_edges(current_edges, new_level_set)))
+                            dominant_edge_sets.add(CompactMetagraph.bit_indices(new_level_set))
+                            check_dominants = True
+                            if glob_verbose >= 1:
+                                print("new_level_set: {}".format(colored(mask_to_str(new_level_set, level), "green")))
+                        else:
+                            level_sets.append(new_level_set)
+                        if glob_verbose >= 1:
+                            print()
 
+                # + right_level_set
                 # No need to check those for dominance, they are not new sets
-                combined_set.append(new_level_set)
-
-            level_sets.append(combined_set)
+                if glob_verbose >= 1:
+                    print("right_level_set: {}".format(list(previous_level_sets.iter_group(left_group + 1))))
+                level_sets.extend(previous_level_sets.iter_group(left_group + 1))
 
-        # Append the 1 on the right of Pascal's triangle
-        full_bit_array = bitarray(len(current_edges))
-        full_bit_array.setall(1)
-        if glob_verbose >= 1:
-            print("full_bit_array: {}".format(colored(full_bit_array, "red")))
+                level_sets.end_group()
 
-        mp = Metapath(source, target, bit_array_to_edges(current_edges, full_bit_array))
-        if glob_verbose >= 1:
-            print(mp)
-        if metagraph.is_dominant_metapath(mp):
-            dominant_metapaths.append(mp)
-            dominant_metapaths_bit_arrays.append(full_bit_array)
-            check_dominants = True
+            # Append the 1 on the right of Pascal's triangle
             if glob_verbose >= 1:
-                print("full_bit_array: {}".format(colored(full_bit_array, "green")))
-            level_sets.append([])
-        else:
-            level_sets.append([full_bit_array])
+                print("full_set: {}".format(colored(mask_to_str(full_set, level), "red")))
 
-    return dominant_metapaths, dominant_metapaths_bit_arrays, level_sets
-
-def pascal_triangle(metagraph, source, target, edges=None):
+            if check_dominants: # Every dominant metapath found is a subset of the full set
+                stats.pruned += 1
+            elif budget is None or (not budget.exhausted() and budget.allows_edges(level)):
+                if glob_verbose >= 1:
+                    print(Metapath(source, target, mask_to_edges(current_edges, full_set)))
+                stats.evaluated += 1
+                if dominance.is_dominant(full_set):
+                    if budget is None or budget.add_result():
+                        dominant_metapaths.append(Metapath(source, target, mask_to_edges(current_edges, full_set)))
+                    dominant_edge_sets.add(CompactMetagraph.bit_indices(full_set))
+                    check_dominants = True
+                    if glob_verbose >= 1:
+                        print("full_set: {}".format(colored(mask_to_str(full_set, level), "green")))
+                else:
+                    level_sets.append(full_set)
+            level_sets.end_group()
+    except BaseException: # Interrupted, the level is not returned
+        level_sets.close()
+        raise
+
+    return dominant_metapaths, dominant_edge_sets, level_sets
+
+# With a SearchBudget the construction stops when it runs out, budget.truncated tells if it did.
+# Levels above memory_limit bytes are spilled to scratch_dir (see LevelStore).
+# With a Checkpoint, the search is saved after each level built in full (not cut by the budget)
+# and resumed from the last one saved.
+# The candidates evaluated and pruned are counted in stats (a SearchStats) and printed at the end.
+# With relevant_only, only the dominant_candidate_edges of edges are searched, in their order.
+def pascal_triangle(metagraph, source, target, edges=None, budget=None, memory_limit=None, scratch_dir=None, checkpoint=None, stats=None, relevant_only=True):
     if edges is None:
         edges = metagraph.edges
     else:
         print("Edges provided.")
+    if relevant_only:
+        edges = dominant_candidate_edges(metagraph, source, target, edges)
 
     dominant_metapaths = [] # Dominant metapaths found
-    dominant_metapaths_bit_arrays = [] # Bit arrays of dominant metapaths
+    dominant_edge_sets = SubsetIndex() # Edge sets of dominant metapaths
+    dominance = DominanceChecker(metagraph, source, target, edges)
+    if stats is None:
+        stats = SearchStats()
 
     # Number of edges
     # The number of levels in Pascal triangle is the number of edges + 1  (level 0)
     edges_number = len(edges)
-    previous_level_sets = []
+    previous_level_sets = None
     current_edges = []
+    first_level = 1
+
+    if checkpoint is not None:
+        key = Checkpoint.search_key(edges, source, target)
+        state = checkpoint.load("pascal_triangle", key, memory_limit, scratch_dir)
+        if state is not None:
+            dominant_metapaths, first_level = restore_checkpoint(state, source, target, edges, dominant_edge_sets)
+            previous_level_sets = state["frontier"]
+            current_edges = list(edges[:first_level - 1])
+
+    # The last level is closed however the loop ends, so that no spilled level is left behind
+    try:
+        for level in range(first_level, edges_number + 1):
+            if budget is not None and budget.exhausted():
+                break
+            new_edge = edges[level - 1] # Edge added to construct next level of Pascal's triangle
+            current_edges.append(new_edge)
+            dominant_metapaths_of_level, dominant_edge_sets, level_sets = pascal_triangle_construct_level(metagraph, source, target, current_edges, level, dominant_edge_sets, previous_level_sets, budget=budget, dominance=dominance, memory_limit=memory_limit, scratch_dir=scratch_dir, stats=stats)
+            dominant_metapaths += dominant_metapaths_of_level # Add new metapaths
+            finished_level_sets, previous_level_sets = previous_level_sets, level_sets
+            if finished_level_sets is not None:
+                finished_level_sets.close()
+            if checkpoint is not None and (budget is None or not budget.truncated):
+                checkpoint.save("pascal_triangle", key, level, metapaths_to_masks(edges, dominant_metapaths), previous_level_sets, force=level == edges_number)
+    finally:
+        if previous_level_sets is not None:
+            previous_level_sets.close()
+
+    print("Candidates evaluated: {}, pruned: {}".format(stats.evaluated, stats.pruned))
+    return dominant_metapaths
 
-    for level in range(1, edges_number + 1):
-        new_edge = edges[level - 1] # Edge added to construct next level of Pascal's triangle
-        current_edges.append(new_edge)
-        dominant_metapaths_of_level, dominant_metapaths_bit_arrays, previous_level_sets = pascal_triangle_construct_level(metagraph, source, target, current_edges, level, dominant_metapaths_bit_arrays, previous_level_sets)
-        dominant_metapaths += dominant_metapaths_of_level # Add new metapaths
 
+# Dominant metapaths from source to target, searched component by component
+# The candidate edges (dominant_candidate_edges) are split into the strongly connected components
+# of their edge graph, an edge feeding the edges using its outputs. The edge sets of each component
+# are listed on their own, in parallel over workers processes, then stitched together along the
+# condensation DAG (CompactMetagraph.stitch_components) and checked for dominance. The search is
+# exponential in the size of the largest component instead of the number of edges: a chain of
+# small cycles is cheap. Components of more than max_component_edges edges raise a ValueError.
+# Dominant metapaths are returned by increasing number of edges.
+def component_decomposition(metagraph, source, target, edges=None, workers=None, max_component_edges=16):
+    if edges is None:
+        edges = metagraph.edges
+    cm = CompactMetagraph.get_compact_metagraph(metagraph)
+    source_mask = cm.mask(source)
+    target_mask = CompactMetagraph.target_mask(cm, target)
+    candidates = CompactMetagraph.dominant_candidate_edges(cm, source_mask, target_mask) & cm.edges_mask(edges)
+
+    components, _ = CompactMetagraph.edge_condensation(cm, candidates)
+    sizes = [mask_size(component) for component in components]
+    print("Components: {} over {} candidate edges, largest {}".format(len(components), mask_size(candidates), max(sizes, default=0)))
+    if sizes and max(sizes) > max_component_edges:
+        raise ValueError("Component of {} edges, more than max_component_edges={}".format(max(sizes), max_component_edges))
+
+    tables = CompactMetagraph.component_tables(cm, source_mask, components, workers)
+    stitched = CompactMetagraph.stitch_components(cm, source_mask, target_mask, components, tables)
+
+    dominance = DominanceChecker(metagraph, source, target, cm.edges)
+    dominant_metapaths = []
+    for edges_mask in sorted(stitched, key=lambda edges_mask: (mask_size(edges_mask), edges_mask)):
+        if edges_mask and dominance.is_dominant(edges_mask):
+            dominant_metapaths.append(Metapath(source, target, cm.edges_of(edges_mask)))
+    print("Stitched candidates: {}, dominant: {}".format(len(stitched), len(dominant_metapaths)))
+    return dominant_metapaths
+
+
+# Engines searching the dominant metapaths from source to target, called as engine(mg, source, target)
+# All of them return every dominant metapath but branch_and_bound, which only returns those whose
+# edges can fire in some order from source (the metapaths the MgToSat encoding models). It is
+# exact when the relevant part of the metagraph has no cycle.
+DOMINANT_ENGINES = {
+    "hasse": hasse,
+    "edge_set_tree": edge_set_tree,
+    "edge_set_tree_depth_first": edge_set_tree_depth_first,
+    "pascal_triangle": pascal_triangle,
+    "branch_and_bound": find_dominant_metapaths_from,
+    "components": component_decomposition,
+}
+
+# Keyword arguments of the engines which can be checkpointed or spilled to disk, passed on by
+# find_dominant_metapaths
+DOMINANT_ENGINE_OPTIONS = {
+    "hasse": ("checkpoint", "memory_limit", "scratch_dir"),
+    "edge_set_tree": ("checkpoint",),
+    "pascal_triangle": ("checkpoint", "memory_limit", "scratch_dir"),
+}
+
+# Largest component (edges) for which choose_dominant_engine picks components, when the candidate
+# edges split into several components
+COMPONENT_ENGINE_MAX_EDGES = 12
+
+# Cost model of the engines: log10 of the search time in seconds, as a linear function of the
+# features (intercept, relevant_edges, average_invertex, cyclic_components) of dominant_search_features.
+# Fitted by least squares on the engines mode of bulk-metapath-benchmark (refit when the engines change).
+ENGINE_COST_MODEL = {
+    "hasse": (-4.336, 0.252, 0.011, -0.229),
+    "edge_set_tree": (-4.448, 0.260, -0.022, -0.283),
+    "edge_set_tree_depth_first": (-4.463, 0.275, -0.071, -0.297),
+    "pascal_triangle": (-4.433, 0.242, 0.044, -0.159),
+    "branch_and_bound": (-4.768, 0.093, -0.010, -0.079),
+}
+
+
+# Cheap features of a dominant metapath search from source to target
+# relevant_edges counts the edges the engines search (CompactMetagraph.dominant_candidate_edges),
+# the others are in no dominant metapath. cyclic_components counts the cycles (strongly connected
+# components of more than one element) of the element graph over these edges, edge_components and
+# largest_edge_component the components of their edge graph (CompactMetagraph.edge_condensation).
+def dominant_search_features(metagraph, source, target):
+    cm = CompactMetagraph.get_compact_metagraph(metagraph)
+    relevant_edges = CompactMetagraph.dominant_candidate_edges(cm, cm.mask(source), CompactMetagraph.target_mask(cm, target))
+    relevant = CompactMetagraph.bit_indices(relevant_edges)
+
+    successors = CompactMetagraph.element_successors(cm, relevant_edges)
+    cyclic_components = 0
+    for component in CompactMetagraph.strongly_connected_components(successors):
+        if len(component) > 1 or component[0] in successors[component[0]]:
+            cyclic_components += 1
+    edge_components, _ = CompactMetagraph.edge_condensation(cm, relevant_edges)
+
+    return {
+        "edges": cm.edge_count,
+        "relevant_edges": len(relevant),
+        "average_invertex": sum(cm.invertex_sizes[idx] for idx in relevant) / len(relevant) if relevant else 0.0,
+        "cyclic_components": cyclic_components,
+        "edge_components": len(edge_components),
+        "largest_edge_component": max((mask_size(component) for component in edge_components), default=0),
+    }
+
+
+# Estimated time of engine on a search with features, in seconds
+def estimated_cost(engine, features):
+    intercept, per_edge, per_invertex, per_cycle = ENGINE_COST_MODEL[engine]
+    return 10 ** (intercept + per_edge * features["relevant_edges"] + per_invertex * features["average_invertex"] + per_cycle * features["cyclic_components"])
+
+
+# Engine chosen by find_dominant_metapaths, with the reason of the choice
+class EngineChoice(object):
+    def __init__(self, engine, reason, features=None, costs=None):
+        self.engine = engine
+        self.reason = reason
+        self.features = features
+        self.costs = costs # Estimated time of each engine considered
+
+    def __repr__(self):
+        return "EngineChoice(engine={}, reason={})".format(self.engine, self.reason)
+
+
+# Engine of ENGINE_COST_MODEL with the lowest estimated cost on the search from source to target
+# branch_and_bound is only considered when it is exact, i.e. without cycles. components, which has
+# no cost model, is taken when the relevant edges are more than COMPONENT_ENGINE_MAX_EDGES but split
+# into components of at most that many edges.
+def choose_dominant_engine(metagraph, source, target):
+    features = dominant_search_features(metagraph, source, target)
+    if features["edge_components"] > 1 and features["largest_edge_component"] <= COMPONENT_ENGINE_MAX_EDGES < features["relevant_edges"]:
+        reason = "{} relevant edges out of {} split into {} components of at most {} edges".format(features["relevant_edges"], features["edges"], features["edge_components"], features["largest_edge_component"])
+        return EngineChoice("components", reason, features)
+
+    costs = {}
+    for engine in ENGINE_COST_MODEL:
+        if engine == "branch_and_bound" and features["cyclic_components"]:
+            continue
+        costs[engine] = estimated_cost(engine, features)
+
+    engine = min(costs, key=costs.get)
+    reason = "lowest estimated time {:.3g}s for {} relevant edges out of {}, average invertex size {:.2f}, {} cyclic components".format(costs[engine], features["relevant_edges"], features["edges"], features["average_invertex"], features["cyclic_components"])
+    if features["cyclic_components"]:
+        reason += ", branch_and_bound left out as it misses metapaths supported by cycles"
+    return EngineChoice(engine, reason, features, costs)
+
+
+# Dominant metapaths from source to target, searched by the engine strategy of DOMINANT_ENGINES
+# With strategy="auto" the engine is chosen by choose_dominant_engine. The engine and the reason
+# of the choice are printed.
+# Returns a MetapathSet whatever the engine, in the order the engine found the metapaths (engines
+# are called without store_diagram, call hasse directly for its diagram).
+# checkpoint, memory_limit and scratch_dir are passed to the engines which take them
+# (DOMINANT_ENGINE_OPTIONS), the others run without them and the options left out are printed.
+def find_dominant_metapaths(mg, source, target, strategy="auto", checkpoint=None, memory_limit=None, scratch_dir=None):
+    if strategy == "auto":
+        choice = choose_dominant_engine(mg, source, target)
+    elif strategy in DOMINANT_ENGINES:
+        choice = EngineChoice(strategy, "requested")
+    else:
+        raise ValueError("Unknown dominant metapath engine {}, expected auto or one of {}".format(strategy, sorted(DOMINANT_ENGINES)))
+
+    print("Dominant metapath engine: {} ({})".format(choice.engine, choice.reason))
+    options = {"checkpoint": checkpoint, "memory_limit": memory_limit, "scratch_dir": scratch_dir}
+    supported = DOMINANT_ENGINE_OPTIONS.get(choice.engine, ())
+    ignored = sorted(option for option, value in options.items() if value is not None and option not in supported)
+    if ignored:
+        print("Dominant metapath engine {} does not take {}, left out".format(choice.engine, ", ".join(ignored)))
+    dominant_metapaths = DOMINANT_ENGINES[choice.engine](mg, source, target, **{option: options[option] for option in supported})
+    if not isinstance(dominant_metapaths, MetapathSet): # All engines but branch_and_bound return lists
+        dominant_metapaths = MetapathSet(dominant_metapaths)
     return dominant_metapaths
 
 
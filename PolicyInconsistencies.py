@@ -7,7 +7,11 @@ import argparse # Argument parser
 import itertools
 import copy
 
+import numpy as np
+
 import PolicyAnalysisHelper
+import CompactMetagraph
+import IncidenceMatrix
 
 
 ###############################################################################
@@ -36,8 +40,8 @@ def detect_policy_inconsistencies(pmg, glob_verbose=0):
     r1 = {}
     r2 = {}
     processed = []
-    redundancies = []
-    conflicts = []
+    redundancies = PolicyAnalysisHelper.MetapathSet()
+    conflicts = PolicyAnalysisHelper.MetapathSet()
 
     # Identify edge sets with overlapping vertices
     for edge1 in pmg.edges:
@@ -60,7 +64,7 @@ def detect_policy_inconsistencies(pmg, glob_verbose=0):
 
             processed.append((edge1, edge2))
 
-    all_metapaths = []
+    all_metapaths = PolicyAnalysisHelper.MetapathSet()
 
     if glob_verbose >= 1:
         print("R1")
@@ -75,6 +79,7 @@ def detect_policy_inconsistencies(pmg, glob_verbose=0):
         source = edge1.invertex
         for edge2 in r1[edge1]:
             source = source.union(edge2.invertex)
+        outputs = PolicyAnalysisHelper.metapath_outputs(pmg, source.union(pmg.propositions_set)) # Elements produced by the metapaths from source, for pruning
 
         # Target = outvertex of edge in r2
         for edge3, vertex3 in r2.items():
@@ -82,7 +87,7 @@ def detect_policy_inconsistencies(pmg, glob_verbose=0):
             edge1_propositions = edge1.invertex.intersection(pmg.propositions_set)
             edge3_propositions = edge3.invertex.intersection(pmg.propositions_set)
             i4 = edge1_propositions.intersection(edge3_propositions)
-            if len(i4) > 0:
+            if len(i4) > 0 and target.issubset(outputs): # Targets not produced have no metapath
                 metapaths = pmg.get_all_metapaths_from(source, target)
                 for metapath in metapaths:
                     all_metapaths = PolicyAnalysisHelper.add_metapath(metapath, all_metapaths)
@@ -99,9 +104,9 @@ def detect_policy_inconsistencies_fixed(pmg, glob_verbose=0):
     r1 = {}
     r2 = {}
     processed = []
-    redundancies = []
-    conflicts = []
-    dominants = []
+    redundancies = PolicyAnalysisHelper.MetapathSet()
+    conflicts = PolicyAnalysisHelper.MetapathSet()
+    dominants = PolicyAnalysisHelper.MetapathSet()
     all_subsets = []
 
     # Identify edge sets with overlapping vertices
@@ -125,7 +130,7 @@ def detect_policy_inconsistencies_fixed(pmg, glob_verbose=0):
 
             processed.append((edge1, edge2))
 
-    all_metapaths = []
+    all_metapaths = PolicyAnalysisHelper.MetapathSet()
 
     if glob_verbose >= 1:
         print("R1")
@@ -140,6 +145,7 @@ def detect_policy_inconsistencies_fixed(pmg, glob_verbose=0):
         source = edge1.invertex
         for edge2 in r1[edge1]:
             source = source.union(edge2.invertex)
+        outputs = PolicyAnalysisHelper.metapath_outputs(pmg, source.union(pmg.propositions_set)) # Elements produced by the metapaths from source, for pruning
 
         # Target = outvertex of edge in r2
         for edge3, vertex3 in r2.items():
@@ -147,7 +153,7 @@ def detect_policy_inconsistencies_fixed(pmg, glob_verbose=0):
             edge1_propositions = edge1.invertex.intersection(pmg.propositions_set)
             edge3_propositions = edge3.invertex.intersection(pmg.propositions_set)
             i4 = edge1_propositions.intersection(edge3_propositions)
-            if len(i4) > 0:
+            if len(i4) > 0 and target.issubset(outputs): # Targets not produced have no metapath
                 metapaths = pmg.get_all_metapaths_from(source, target)
                 #metapaths = PolicyAnalysisHelper.find_all_metapaths_from(pmg, source, target)
                 if metapaths:
@@ -168,9 +174,9 @@ def detect_policy_inconsistencies_plus(pmg, glob_verbose=0):
     r1 = {}
     r2 = {}
     processed = []
-    redundancies = []
-    conflicts = []
-    dominants = []
+    redundancies = PolicyAnalysisHelper.MetapathSet()
+    conflicts = PolicyAnalysisHelper.MetapathSet()
+    dominants = PolicyAnalysisHelper.MetapathSet()
     all_subsets = []
 
     # Identify edge sets with overlapping vertices
@@ -194,7 +200,7 @@ def detect_policy_inconsistencies_plus(pmg, glob_verbose=0):
 
             processed.append((edge1, edge2))
 
-    all_metapaths = []
+    all_metapaths = PolicyAnalysisHelper.MetapathSet()
 
     if glob_verbose >= 1:
         print("R1")
@@ -209,6 +215,7 @@ def detect_policy_inconsistencies_plus(pmg, glob_verbose=0):
         source = edge1.invertex
         for edge2 in r1[edge1]:
             source = source.union(edge2.invertex)
+        outputs = PolicyAnalysisHelper.metapath_outputs(pmg, source.union(pmg.propositions_set)) # Elements produced by the metapaths from source, for pruning
 
         # Target = outvertex of edge in r2
         for edge3, value3 in r2.items():
@@ -220,7 +227,7 @@ def detect_policy_inconsistencies_plus(pmg, glob_verbose=0):
                 edge1_propositions = edge1.invertex.intersection(pmg.propositions_set)
                 edge3_propositions = edge3.invertex.intersection(pmg.propositions_set)
                 i4 = edge1_propositions.intersection(edge3_propositions)
-                if len(i4) > 0:
+                if len(i4) > 0 and target.issubset(outputs): # Targets not produced have no metapath
                     metapaths = pmg.get_all_metapaths_from(source, target)
                     if metapaths:
                         for metapath in metapaths:
@@ -236,7 +243,11 @@ def detect_policy_inconsistencies_plus(pmg, glob_verbose=0):
     return (redundancies, conflicts, dominants, all_metapaths, all_subsets)
 
 # My exhaustive search algorithm
-def detect_policy_inconsistencies_full(pmg, glob_verbose=0):
+# With a PolicyAnalysisHelper.SearchBudget the same metapaths are enumerated, the budget is checked
+# on each of them: metapaths with more than max_edges edges are left out, the search stops at the
+# first metapath over max_results and at the first source/target couple after the timeout. The
+# returned sets are marked truncated if anything was left out.
+def detect_policy_inconsistencies_full(pmg, glob_verbose=0, budget=None):
     # Get all subsets of variables set
     if glob_verbose >= 3:
         print("Variable set = {}".format(pmg.variables_set))
@@ -258,35 +269,55 @@ def detect_policy_inconsistencies_full(pmg, glob_verbose=0):
         print("Number of subsets (removed non-proper subset): {}".format(len(all_subsets)))
 
     # Find all metapaths and redundancies between all disjoint subsets:
-    redundancies = []
-    conflicts = []
-    dominants = []
-    all_metapaths = []
+    redundancies = PolicyAnalysisHelper.MetapathSet()
+    conflicts = PolicyAnalysisHelper.MetapathSet()
+    dominants = PolicyAnalysisHelper.MetapathSet()
+    all_metapaths = PolicyAnalysisHelper.MetapathSet()
+
+    # Elements produced by the metapaths from every subset, in batches, for pruning
+    cm = CompactMetagraph.get_compact_metagraph(pmg)
+    subset_masks = [cm.mask(subset) for subset in all_subsets]
+    output_masks = IncidenceMatrix.metapath_output_masks(pmg, subset_masks)
+    subset_array = np.array(subset_masks, dtype=np.int64 if len(cm.elements) < 63 else object)
+
     #source = "2"
     #target = "4"
-    for source in all_subsets:
-        for target in all_subsets:
+    for source, source_mask, output_mask in zip(all_subsets, subset_masks, output_masks):
+        if budget is not None and budget.exhausted():
+            break
+        # Targets disjoint from source and produced by its metapaths, other targets have no metapath
+        target_indices = np.nonzero(((subset_array & source_mask) == 0) & ((subset_array & ~output_mask) == 0))[0].tolist()
+        if glob_verbose >= 4:
+            print("{} targets out of {} disjoint from and produced from {}".format(len(target_indices), len(all_subsets), source))
+        for target_idx in target_indices:
+            if budget is not None and budget.exhausted():
+                break
             source_set = set(source)
-            target_set = set(target)
+            target_set = set(all_subsets[target_idx])
             if glob_verbose >= 3:
                 print("source = {}; target = {};".format(source_set, target_set))
-            if source_set.isdisjoint(target_set):
-                metapaths = pmg.get_all_metapaths_from(source_set.intersection(pmg.variables_set), target_set, prop_subset=(source_set.intersection(pmg.propositions_set)))
-                if metapaths:
-                    for metapath in metapaths:
-                        all_metapaths = PolicyAnalysisHelper.add_metapath(metapath, all_metapaths)
+            metapaths = pmg.get_all_metapaths_from(source_set.intersection(pmg.variables_set), target_set, prop_subset=(source_set.intersection(pmg.propositions_set)))
+            if metapaths:
+                for metapath in metapaths:
+                    if budget is not None and metapath not in all_metapaths: # Each metapath counts once
+                        if not budget.allows_edges(len(metapath.edge_list)):
+                            continue
+                        if not budget.add_result():
+                            break
+                    all_metapaths = PolicyAnalysisHelper.add_metapath(metapath, all_metapaths)
 
-                        if pmg.has_redundancies(metapath):
-                            redundancies = PolicyAnalysisHelper.add_metapath(metapath, redundancies)
-                        if pmg.has_conflicts(metapath):
-                            conflicts = PolicyAnalysisHelper.add_metapath(metapath, conflicts)
-                        if pmg.is_dominant_metapath(metapath):
-                            dominants = PolicyAnalysisHelper.add_metapath(metapath, dominants)
-                elif glob_verbose >= 4:
-                    print("No metapaths found!")
+                    if pmg.has_redundancies(metapath):
+                        redundancies = PolicyAnalysisHelper.add_metapath(metapath, redundancies)
+                    if pmg.has_conflicts(metapath):
+                        conflicts = PolicyAnalysisHelper.add_metapath(metapath, conflicts)
+                    if pmg.is_dominant_metapath(metapath):
+                        dominants = PolicyAnalysisHelper.add_metapath(metapath, dominants)
             elif glob_verbose >= 4:
-                print("Source and target not disjoint!")
+                print("No metapaths found!")
 
+    if budget is not None and budget.truncated:
+        for metapaths in (redundancies, conflicts, dominants, all_metapaths):
+            metapaths.truncated = True
 
     return (redundancies, conflicts, dominants, all_metapaths, all_subsets)
 
@@ -296,9 +327,9 @@ def detect_policy_inconsistencies_plus_partial(pmg, added_edge, r1, r2, glob_ver
     r1_p = copy.deepcopy(r1)
     r2_p = copy.deepcopy(r2)
     processed = []
-    redundancies = []
-    conflicts = []
-    dominants = []
+    redundancies = PolicyAnalysisHelper.MetapathSet()
+    conflicts = PolicyAnalysisHelper.MetapathSet()
+    dominants = PolicyAnalysisHelper.MetapathSet()
     all_subsets = []
 
     for edge in pmg.edges:
@@ -318,7 +349,7 @@ def detect_policy_inconsistencies_plus_partial(pmg, added_edge, r1, r2, glob_ver
                     r2_p[added_edge] = []
                 r2_p[added_edge].append(edge)
 
-    all_metapaths = []
+    all_metapaths = PolicyAnalysisHelper.MetapathSet()
 
     if glob_verbose >= 1:
         print("R1_p")
@@ -333,6 +364,7 @@ def detect_policy_inconsistencies_plus_partial(pmg, added_edge, r1, r2, glob_ver
         source = edge1.invertex
         for edge2 in r1[edge1]:
             source = source.union(edge2.invertex)
+        outputs = PolicyAnalysisHelper.metapath_outputs(pmg, source.union(pmg.propositions_set)) # Elements produced by the metapaths from source, for pruning
 
         # Target = outvertex of edge in r2
         for edge3, value3 in r2.items():
@@ -344,7 +376,7 @@ def detect_policy_inconsistencies_plus_partial(pmg, added_edge, r1, r2, glob_ver
                 edge1_propositions = edge1.invertex.intersection(pmg.propositions_set)
                 edge3_propositions = edge3.invertex.intersection(pmg.propositions_set)
                 i4 = edge1_propositions.intersection(edge3_propositions)
-                if len(i4) > 0:
+                if len(i4) > 0 and target.issubset(outputs): # Targets not produced have no metapath
                     metapaths = pmg.get_all_metapaths_from(source, target)
                     if metapaths:
                         for metapath in metapaths:
@@ -393,17 +425,18 @@ def detect_policy_inconsistencies_partial(pmg, added_edge, added_variable, all_s
         print(len(source_subsets))
 
     # Find all metapaths and redundancies between all disjoint subsets:
-    redundancies = []
-    conflicts = []
-    dominants = []
-    all_metapaths = []
+    redundancies = PolicyAnalysisHelper.MetapathSet()
+    conflicts = PolicyAnalysisHelper.MetapathSet()
+    dominants = PolicyAnalysisHelper.MetapathSet()
+    all_metapaths = PolicyAnalysisHelper.MetapathSet()
     for source in source_subsets:
+        outputs = PolicyAnalysisHelper.metapath_outputs(pmg, set(source).union(pmg.propositions_set)) # Elements produced by the metapaths from source, for pruning
         for target in all_subsets:
             source_set = set(source)
             target_set = set(target)
             if glob_verbose >= 3:
                 print("source = {}; target = {};".format(source_set, target_set))
-            if source_set.isdisjoint(target_set):
+            if source_set.isdisjoint(target_set) and target_set.issubset(outputs): # Targets not produced have no metapath
                 metapaths = pmg.get_all_metapaths_from(source_set, target_set)
                 if metapaths:
                     for metapath in metapaths:
@@ -434,9 +467,9 @@ def partial_recalculation(workflow_metagraph):
             recalc_metapaths = affected_metapaths_dominance_recalculation(metapaths_1, affected_edges)
         # Recalculate dominance for previously existing metapaths
         if recalc_metapaths:
-            recalc_redundancies = []
-            recalc_conflicts = []
-            recalc_dominants = []
+            recalc_redundancies = PolicyAnalysisHelper.MetapathSet()
+            recalc_conflicts = PolicyAnalysisHelper.MetapathSet()
+            recalc_dominants = PolicyAnalysisHelper.MetapathSet()
             for metapath in recalc_metapaths:
                 if workflow_metagraph.has_redundancies(metapath):
                     recalc_redundancies = PolicyAnalysisHelper.add_metapath(metapath, recalc_redundancies)
@@ -458,9 +491,9 @@ def partial_recalculation(workflow_metagraph):
             recalc_metapaths = affected_metapaths_dominance_recalculation(metapaths_1, affected_edges)
         # Recalculate dominance for previously existing metapaths
         if recalc_metapaths:
-            recalc_redundancies = []
-            recalc_conflicts = []
-            recalc_dominants = []
+            recalc_redundancies = PolicyAnalysisHelper.MetapathSet()
+            recalc_conflicts = PolicyAnalysisHelper.MetapathSet()
+            recalc_dominants = PolicyAnalysisHelper.MetapathSet()
             for metapath in recalc_metapaths:
                 if workflow_metagraph.has_redundancies(metapath):
                     recalc_redundancies = PolicyAnalysisHelper.add_metapath(metapath, recalc_redundancies)
@@ -511,17 +544,18 @@ def affected_edges_dominance_recalculation(mg, edge):
 # Helper function for partial_recalculation - Pick #0
 def detect_policy_inconsistencies_partial_add_random_edge(pmg, added_edge, all_subsets):
     # Find all metapaths and redundancies between all disjoint subsets:
-    redundancies = []
-    conflicts = []
-    dominants = []
-    all_metapaths = []
+    redundancies = PolicyAnalysisHelper.MetapathSet()
+    conflicts = PolicyAnalysisHelper.MetapathSet()
+    dominants = PolicyAnalysisHelper.MetapathSet()
+    all_metapaths = PolicyAnalysisHelper.MetapathSet()
     for source in all_subsets:
+        outputs = PolicyAnalysisHelper.metapath_outputs(pmg, set(source).union(pmg.propositions_set)) # Elements produced by the metapaths from source, for pruning
         for target in all_subsets:
             source_set = set(source)
             target_set = set(target)
             if glob_verbose >= 3:
                 print("source = {}; target = {};".format(source_set, target_set))
-            if source_set.isdisjoint(target_set):
+            if source_set.isdisjoint(target_set) and target_set.issubset(outputs): # Targets not produced have no metapath
                 metapaths = pmg.get_all_metapaths_from(source_set, target_set)
                 if metapaths:
                     for metapath in metapaths:
@@ -575,17 +609,18 @@ def detect_policy_inconsistencies_partial_add_random_edge_vars(pmg, added_edge,
         print(len(source_subsets))
 
     # Find all metapaths and redundancies between all disjoint subsets:
-    redundancies = []
-    conflicts = []
-    dominants = []
-    all_metapaths = []
+    redundancies = PolicyAnalysisHelper.MetapathSet()
+    conflicts = PolicyAnalysisHelper.MetapathSet()
+    dominants = PolicyAnalysisHelper.MetapathSet()
+    all_metapaths = PolicyAnalysisHelper.MetapathSet()
     for source in source_subsets:
+        outputs = PolicyAnalysisHelper.metapath_outputs(pmg, set(source).union(pmg.propositions_set)) # Elements produced by the metapaths from source, for pruning
         for target in all_subsets:
             source_set = set(source)
             target_set = set(target)
             if glob_verbose >= 3:
                 print("source = {}; target = {};".format(source_set, target_set))
-            if source_set.isdisjoint(target_set):
+            if source_set.isdisjoint(target_set) and target_set.issubset(outputs): # Targets not produced have no metapath
                 metapaths = pmg.get_all_metapaths_from(source_set, target_set)
                 if metapaths:
                     for metapath in metapaths:
@@ -4,6 +4,8 @@
 import sys
 import argparse # Argument parser
 
+from concurrent.futures import ProcessPoolExecutor
+
 import PolicyAnalysisHelper
 
 
@@ -29,7 +31,15 @@ def print_section(title):
 # Functions
 
 # Exhaustive algorithm but only between a source and a target
-def detect_policy_inconsistencies_full_couple(pmg, source, target, glob_verbose=0):
+# With lazy=True the same metapaths are classified one at a time, without being stored in
+# all_metapaths, and the classification can stop early on the first conflict (stop_on_conflict)
+# or once max_dominants dominant metapaths have been found (see detect_policy_inconsistencies_lazy_couple).
+# With workers > 1 (not lazy) the metapaths are still enumerated by mgtoolkit, they are classified
+# by a pool of worker processes (classify_metapath), the results are the same as in serial.
+def detect_policy_inconsistencies_full_couple(pmg, source, target, glob_verbose=0, lazy=False, stop_on_conflict=False, max_dominants=None, workers=None):
+    if lazy:
+        return detect_policy_inconsistencies_lazy_couple(pmg, source, target, glob_verbose, stop_on_conflict, max_dominants)
+
     # Find all metapaths and redundancies between all disjoint subsets:
     redundancies = []
     conflicts = []
@@ -39,27 +49,92 @@ def detect_policy_inconsistencies_full_couple(pmg, source, target, glob_verbose=
 
     if glob_verbose >= 3:
         print("source = {}; target = {};".format(source, target))
-    if source.isdisjoint(target):
-        metapaths = pmg.get_all_metapaths_from(source, target)
-        print("Len mps for {} to {}: {}".format(source, target, len(metapaths)))
+    outputs = PolicyAnalysisHelper.metapath_outputs(pmg, source.union(pmg.propositions_set)) # Elements produced by the metapaths from source, for pruning
+    if source.isdisjoint(target) and target.issubset(outputs): # Targets not produced have no metapath
+        metapaths = pmg.get_all_metapaths_from(source, target) # None if mgtoolkit finds no metapath
+        print("Len mps for {} to {}: {}".format(source, target, len(metapaths) if metapaths else 0))
         if metapaths:
             for i, metapath in enumerate(metapaths):
                 print(i)
                 all_metapaths.append(metapath)
 
     print(len(all_metapaths))
-    for i, metapath in enumerate(all_metapaths):
+    if workers is not None and workers > 1 and len(all_metapaths) > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_classify_worker, initargs=(pmg,)) as executor:
+            classes = list(executor.map(classify_metapath, all_metapaths, chunksize=max(1, len(all_metapaths) // (4 * workers)))) # In submission order
+    else:
+        classes = (metapath_classes(pmg, metapath) for metapath in all_metapaths)
+
+    for i, (metapath, (redundant, conflicting, dominant)) in enumerate(zip(all_metapaths, classes)):
         print(i)
-        if pmg.has_redundancies(metapath):
+        if redundant:
             redundancies.append(metapath)
-        if pmg.has_conflicts(metapath):
+        if conflicting:
             conflicts.append(metapath)
-        if pmg.is_dominant_metapath(metapath):
+        if dominant:
             dominants.append(metapath)
 
     return (redundancies, conflicts, dominants, all_metapaths, all_subsets)
 
 
+# (redundant, conflicting, dominant) classes of a metapath of pmg
+def metapath_classes(pmg, metapath):
+    return pmg.has_redundancies(metapath), pmg.has_conflicts(metapath), pmg.is_dominant_metapath(metapath)
+
+
+# Set the policy metagraph of a classification worker process, sent once per worker
+def init_classify_worker(pmg):
+    global classify_context
+    classify_context = pmg
+
+
+# Classes of a metapath in a worker process (metapath_classes)
+def classify_metapath(metapath):
+    return metapath_classes(classify_context, metapath)
+
+# Helper function for detect_policy_inconsistencies_full_couple - lazy mode
+# The metapaths are generated one at a time by PolicyAnalysisHelper.iter_metapaths_from with
+# distinct=True and classified as they come, so memory stays bounded by the depth of the search
+# and all_metapaths is left empty. The enumeration differs from the default mode (mgtoolkit
+# get_all_metapaths_from): it yields every edge set that fires in some order from source and the
+# propositions and covers target, each once. Edge sets only supported through a cycle are left
+# out, and edge sets mgtoolkit misses are included, so redundancies, conflicts and dominants are
+# those of these edge sets (dominants: the dominant metapaths which fire from source).
+def detect_policy_inconsistencies_lazy_couple(pmg, source, target, glob_verbose=0, stop_on_conflict=False, max_dominants=None):
+    redundancies = PolicyAnalysisHelper.MetapathSet()
+    conflicts = PolicyAnalysisHelper.MetapathSet()
+    dominants = PolicyAnalysisHelper.MetapathSet()
+    all_metapaths = [] # Not collected in lazy mode
+    all_subsets = []
+
+    if glob_verbose >= 3:
+        print("source = {}; target = {};".format(source, target))
+    outputs = PolicyAnalysisHelper.metapath_outputs(pmg, source.union(pmg.propositions_set)) # Elements produced by the metapaths from source, for pruning
+    if not source.isdisjoint(target) or not target.issubset(outputs): # Targets not produced have no metapath
+        return (redundancies, conflicts, dominants, all_metapaths, all_subsets)
+
+    metapath_count = 0
+    for metapath in PolicyAnalysisHelper.iter_metapaths_from(pmg, source.union(pmg.propositions_set), target, distinct=True):
+        metapath_count += 1
+        if glob_verbose >= 2:
+            print(metapath_count)
+
+        if pmg.has_redundancies(metapath):
+            redundancies.add(metapath)
+        if pmg.has_conflicts(metapath):
+            conflicts.add(metapath)
+            if stop_on_conflict:
+                break
+        if pmg.is_dominant_metapath(metapath):
+            dominants.add(metapath)
+            if max_dominants is not None and len(dominants) >= max_dominants:
+                break
+
+    print("Metapaths classified for {} to {}: {}".format(source, target, metapath_count))
+
+    return (redundancies, conflicts, dominants, all_metapaths, all_subsets)
+
+
 
 # Partial recalculation algorithm for couple
 def partial_recalculation_couple(workflow_metagraph, source, target, response, metapaths):
@@ -82,16 +157,16 @@ def partial_recalculation_couple(workflow_metagraph, source, target, response, m
             recalc_metapaths = affected_metapaths_dominance_recalculation_couple(metapaths, affected_edges)
         # Recalculate dominance for previously existing metapaths
         if recalc_metapaths:
-            recalc_redundancies = []
-            recalc_conflicts = []
-            recalc_dominants = []
+            recalc_redundancies = PolicyAnalysisHelper.MetapathSet()
+            recalc_conflicts = PolicyAnalysisHelper.MetapathSet()
+            recalc_dominants = PolicyAnalysisHelper.MetapathSet()
             for metapath in recalc_metapaths:
                 if workflow_metagraph.has_redundancies(metapath):
-                    recalc_redundancies = add_metapath(metapath, recalc_redundancies)
+                    recalc_redundancies = PolicyAnalysisHelper.add_metapath(metapath, recalc_redundancies)
                 if workflow_metagraph.has_conflicts(metapath):
-                    recalc_conflicts = add_metapath(metapath, recalc_conflicts)
+                    recalc_conflicts = PolicyAnalysisHelper.add_metapath(metapath, recalc_conflicts)
                 if workflow_metagraph.is_dominant_metapath(metapath):
-                    recalc_dominants = add_metapath(metapath, recalc_dominants)
+                    recalc_dominants = PolicyAnalysisHelper.add_metapath(metapath, recalc_dominants)
 
         # 2 - Calculate new metapaths
         redundancies_part, conflicts_part , dominants_part, metapaths_part = detect_policy_inconsistencies_partial_add_random_edge_couple(workflow_metagraph, new_edge, source, target)
@@ -106,16 +181,16 @@ def partial_recalculation_couple(workflow_metagraph, source, target, response, m
             recalc_metapaths = affected_metapaths_dominance_recalculation(metapaths_1, affected_edges)
         # Recalculate dominance for previously existing metapaths
         if recalc_metapaths:
-            recalc_redundancies = []
-            recalc_conflicts = []
-            recalc_dominants = []
+            recalc_redundancies = PolicyAnalysisHelper.MetapathSet()
+            recalc_conflicts = PolicyAnalysisHelper.MetapathSet()
+            recalc_dominants = PolicyAnalysisHelper.MetapathSet()
             for metapath in recalc_metapaths:
                 if workflow_metagraph.has_redundancies(metapath):
-                    recalc_redundancies = add_metapath(metapath, recalc_redundancies)
+                    recalc_redundancies = PolicyAnalysisHelper.add_metapath(metapath, recalc_redundancies)
                 if workflow_metagraph.has_conflicts(metapath):
-                    recalc_conflicts = add_metapath(metapath, recalc_conflicts)
+                    recalc_conflicts = PolicyAnalysisHelper.add_metapath(metapath, recalc_conflicts)
                 if workflow_metagraph.is_dominant_metapath(metapath):
-                    recalc_dominants = add_metapath(metapath, recalc_dominants)
+                    recalc_dominants = PolicyAnalysisHelper.add_metapath(metapath, recalc_dominants)
 
         # 2 - Calculate new metapaths
         redundancies_part, conflicts_part , dominants_part, metapaths_part = detect_policy_inconsistencies_partial_add_random_edge_vars(workflow_metagraph, new_edge, new_variable, all_subsets)
@@ -167,14 +242,15 @@ def affected_metapaths_dominance_recalculation_couple():
 # Helper function for partial_recalculation_couple - Pick #0
 def detect_policy_inconsistencies_partial_add_random_edge_couple(pmg, added_edge, source, target, glob_verbose=0):
     # Find all metapaths and redundancies between all disjoint subsets:
-    redundancies = []
-    conflicts = []
-    dominants = []
-    all_metapaths = []
+    redundancies = PolicyAnalysisHelper.MetapathSet()
+    conflicts = PolicyAnalysisHelper.MetapathSet()
+    dominants = PolicyAnalysisHelper.MetapathSet()
+    all_metapaths = PolicyAnalysisHelper.MetapathSet()
 
     if glob_verbose >= 3:
         print("source = {}; target = {};".format(source, target))
-    if source.isdisjoint(target) and len(source.intersection(added_edge.invertex)) != 0:
+    outputs = PolicyAnalysisHelper.metapath_outputs(pmg, source.union(pmg.propositions_set)) # Elements produced by the metapaths from source, for pruning
+    if source.isdisjoint(target) and len(source.intersection(added_edge.invertex)) != 0 and target.issubset(outputs):
         print("NO")
         print(source)
         print(added_edge.invertex)
@@ -196,13 +272,15 @@ def detect_policy_inconsistencies_partial_add_random_edge_couple(pmg, added_edge
 
 
 # Calculate net redundancy from policy metagraph, a list of dominant metapaths and a list of source/destination couples
-def net_redundancy_from_couples(pmg, couples):
-    dominants = []
+def net_redundancy_from_couples(pmg, couples, glob_verbose=0):
+    dominants = PolicyAnalysisHelper.MetapathSet()
 
     for source, target in couples:
-        _, _, dominants_couple, _, _ = detect_policy_inconsistencies_full_couple(pmg, source, target)
+        # Propositions are part of the source, as in detect_policy_inconsistencies_full_couple
+        # The search is exact (DominanceChecker), metapaths only supported through cycles included
+        dominants_couple = PolicyAnalysisHelper.edge_set_tree_depth_first(pmg, source.union(pmg.propositions_set), target)
         for dominant in dominants_couple:
-            dominants = add_metapath(dominant, dominants)
+            dominants = PolicyAnalysisHelper.add_metapath(dominant, dominants)
 
     dominants_variables_set = set()
     dominants_propositions_set = set()
@@ -213,17 +291,17 @@ def net_redundancy_from_couples(pmg, couples):
             dominants_variables_set.update(edge.outvertex.intersection(pmg.variables_set))
             dominants_propositions_set.update(edge.invertex.intersection(pmg.propositions_set))
             dominants_propositions_set.update(edge.outvertex.intersection(pmg.propositions_set))
-            if not edge_in_list(edge, dominants_edges):
+            if not PolicyAnalysisHelper.edge_in_list(edge, dominants_edges):
                 dominants_edges.append(edge)
 
-    net_edges = pmg.edges
+    net_edges = list(pmg.edges)
     net_variables = pmg.variables_set - dominants_variables_set
     net_propositions = pmg.propositions_set - dominants_propositions_set
     for edge in dominants_edges:
         net_edges.remove(edge)
 
     if glob_verbose >= 0:
-        print_net_redundancies(net_variables, net_propositions, net_edges)
+        PolicyAnalysisHelper.print_net_redundancies(net_variables, net_propositions, net_edges)
 
     return (net_variables, net_propositions, net_edges)
 
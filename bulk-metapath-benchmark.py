@@ -0,0 +1,375 @@
+###############################################################################
+# Imports
+
+import argparse # Argument parser
+
+import Utility
+
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+import TriplesToMetagraph
+import YawlToMetagraph
+import PolicyAnalysisHelper
+
+
+###############################################################################
+# Argument parser
+
+def get_parser():
+    # Get parser for command line arguments
+    parser = argparse.ArgumentParser(description="Benchmark metapath enumeration on random workflow specifications", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--version", action="version", version='%(prog)s 1.0')
+    parser.add_argument("-v", "--verbose", action="count", default=0, help="increase output verbosity")
+    parser.add_argument("-m", "--mode", type=str, choices=BENCHMARKS.keys(), default="distinct", help="benchmark to run")
+    parser.add_argument("--gen-set-filter", type=str, metavar="GEN_SET_FILTER", default=None, help="generating sets to benchmark")
+    parser.add_argument("--edge-filter", type=str, metavar="EDGE_FILTER", default=None, help="edges to benchmark")
+    parser.add_argument("--policy-filter", type=str, metavar="POLICY_FILTER", default=None, help="policy sizes to benchmark")
+    parser.add_argument("--id-filter", type=str, metavar="ID_FILTER", default=None, help="IDs to benchmark")
+    parser.add_argument("-o", "--output-file", type=str, metavar="OUTPUT_FILE", default="measures/metapath-benchmark.dat", help="path to output file")
+    parser.add_argument("-y", "--yawl-mode", action="store_true", help="specification is in YAWL")
+    parser.add_argument("--max-edges", type=int, metavar="MAX_EDGES", default=None, help="maximum number of edges of a metapath")
+    parser.add_argument("--max-results", type=int, metavar="MAX_RESULTS", default=None, help="maximum number of metapaths per query")
+    parser.add_argument("--timeout", type=float, metavar="TIMEOUT", default=None, help="maximum time per query, in seconds")
+
+    return parser
+
+
+###############################################################################
+# Functions
+
+# Gather specification filenames, filtered like bulk-policy-analysis
+def gather_specs(spec_dir, gen_set_filter, edge_filter, policy_filter, id_filter, verbose):
+    workflow_categories = sorted(os.listdir(spec_dir))
+
+    if gen_set_filter:
+        gen_set_filter = tuple(generating_set_size + "-" for generating_set_size in gen_set_filter.split(','))
+        workflow_categories = [category for category in workflow_categories if category.startswith(gen_set_filter)]
+    if edge_filter:
+        edge_filter = ["{}-{}-edges".format(filter.split('.')[0], filter.split('.')[1]) for filter in edge_filter.split(',')]
+        workflow_categories = [category for category in workflow_categories if any(filter in category for filter in edge_filter)]
+    if policy_filter:
+        policy_filter = ["{}-policy".format(filter) for filter in policy_filter.split(',')]
+        workflow_categories = [category for category in workflow_categories if any(filter in category for filter in policy_filter)]
+    print("Workflow categories: {}".format(workflow_categories))
+
+    workflow_specs = []
+    for workflow_category in workflow_categories:
+        workflow_specs.extend(sorted([spec_dir + workflow_category + "/" + workflow_spec for workflow_spec in os.listdir(spec_dir + workflow_category)]))
+
+    if id_filter:
+        id_filter = ["/{}.dat".format(filter) for filter in id_filter.split(',')]
+        workflow_specs = [workflow_spec for workflow_spec in workflow_specs if any(filter in workflow_spec for filter in id_filter)]
+    print("Specifications: {}".format(len(workflow_specs)))
+    if verbose >= 1:
+        for workflow_spec in workflow_specs:
+            print("{}".format(workflow_spec))
+        print("")
+
+    return workflow_specs
+
+
+# Time a query under a fresh budget built from limits (max_edges, max_results, timeout)
+# Returns the measure (function_name, result_count, et, truncated) of the query.
+def timed(function_name, limits, function, *args, **kwargs):
+    budget = PolicyAnalysisHelper.SearchBudget(*limits)
+    start = time.perf_counter()
+    results = function(*args, budget=budget, **kwargs)
+    return (function_name, len(results), time.perf_counter() - start, budget.truncated)
+
+
+# Current enumeration (one metapath per ordering) against distinct edge set enumeration
+# Both modes run on the compact metagraph: the per-ordering mode visits the orderings the original
+# set-based recursive search visited, but that search is no longer in the tree, so the ratio
+# measures the distinct enumeration alone, not the gain of the compact metagraph over the original.
+def benchmark_distinct(mg, source, target, limits):
+    measures = []
+
+    measures.append(timed("find_all_metapaths", limits, PolicyAnalysisHelper.find_all_metapaths, mg, source, distinct=False))
+    measures.append(timed("find_all_metapaths_distinct", limits, PolicyAnalysisHelper.find_all_metapaths, mg, source, distinct=True))
+
+    measures.append(timed("find_all_metapaths_from", limits, PolicyAnalysisHelper.find_all_metapaths_from, mg, source, target, distinct=False))
+    measures.append(timed("find_all_metapaths_from_distinct", limits, PolicyAnalysisHelper.find_all_metapaths_from, mg, source, target, distinct=True))
+
+    return measures
+
+
+# Serial distinct enumeration against the process-parallel one, for increasing worker counts
+def benchmark_parallel(mg, source, target, limits):
+    measures = []
+
+    measures.append(timed("find_all_metapaths_from_distinct", limits, PolicyAnalysisHelper.find_all_metapaths_from, mg, source, target, distinct=True))
+    for workers in PARALLEL_WORKERS:
+        measures.append(timed("find_all_metapaths_from_distinct_{}_workers".format(workers), limits, PolicyAnalysisHelper.find_all_metapaths_from, mg, source, target, distinct=True, workers=workers))
+
+    return measures
+
+
+PARALLEL_WORKERS = [2, 4, 8, 16, 32]
+
+
+# Dominant metapaths by enumeration and dominance check against branch-and-bound search
+def benchmark_dominants(mg, source, target, limits):
+    measures = []
+    source = source.union(mg.propositions_set) # As in detect_policy_inconsistencies_full_couple
+
+    def enumerate_dominants(mg, source, target, budget=None):
+        dominant_metapaths = []
+        for metapath in PolicyAnalysisHelper.iter_metapaths_from(mg, source, target, distinct=True, budget=budget):
+            if mg.is_dominant_metapath(metapath):
+                dominant_metapaths.append(metapath)
+        return dominant_metapaths
+
+    measures.append(timed("enumerate_dominants", limits, enumerate_dominants, mg, source, target))
+    measures.append(timed("find_dominant_metapaths_from", limits, PolicyAnalysisHelper.find_dominant_metapaths_from, mg, source, target))
+
+    return measures
+
+# Distinct enumeration with and without target-relevance pruning
+def benchmark_relevance(mg, source, target, limits):
+    measures = []
+
+    measures.append(timed("find_all_metapaths_from_distinct", limits, PolicyAnalysisHelper.find_all_metapaths_from, mg, source, target, distinct=True))
+    measures.append(timed("find_all_metapaths_from_distinct_relevant", limits, PolicyAnalysisHelper.find_all_metapaths_from, mg, source, target, distinct=True, relevant_only=True))
+
+    return measures
+
+
+# Dominance of candidate metapaths checked by mgtoolkit against DominanceChecker
+# The candidates are the distinct metapaths from source and propositions to target. The
+# mismatch measure counts the candidates on which both checks disagree.
+def benchmark_dominance(mg, source, target, limits):
+    source = source.union(mg.propositions_set) # As in detect_policy_inconsistencies_full_couple
+    budget = PolicyAnalysisHelper.SearchBudget(*limits)
+    candidates = list(PolicyAnalysisHelper.iter_metapaths_from(mg, source, target, distinct=True, budget=budget))
+
+    edges = list(mg.edges)
+    edge_position = {id(edge): index for index, edge in enumerate(edges)}
+
+    start = time.perf_counter()
+    toolkit_dominants = [mg.is_dominant_metapath(metapath) for metapath in candidates]
+    toolkit_et = time.perf_counter() - start
+
+    start = time.perf_counter()
+    checker = PolicyAnalysisHelper.DominanceChecker(mg, source, target, edges)
+    checker_dominants = []
+    for metapath in candidates:
+        edges_set = 0
+        for edge in metapath.edge_list:
+            edges_set |= 1 << edge_position[id(edge)]
+        checker_dominants.append(checker.is_dominant(edges_set))
+    checker_et = time.perf_counter() - start
+
+    mismatches = sum(1 for toolkit, checker in zip(toolkit_dominants, checker_dominants) if toolkit != checker)
+
+    return [
+        ("is_dominant_metapath", sum(toolkit_dominants), toolkit_et, budget.truncated),
+        ("DominanceChecker", sum(checker_dominants), checker_et, budget.truncated),
+        ("dominance_mismatches", mismatches, 0.0, budget.truncated),
+    ]
+
+
+# pascal_triangle with the edges in the order of each strategy of EDGE_ORDERINGS
+# Each strategy gives three measures: dominant metapaths found, candidates evaluated and pruned.
+def benchmark_orderings(mg, source, target, limits):
+    measures = []
+
+    for strategy in PolicyAnalysisHelper.EDGE_ORDERINGS:
+        stats = PolicyAnalysisHelper.SearchStats()
+        edges = PolicyAnalysisHelper.order_edges(mg, source, target, strategy, ORDERING_SEED)
+        function_name, result_count, et, truncated = timed("pascal_triangle_{}".format(strategy), limits, PolicyAnalysisHelper.pascal_triangle, mg, source, target, edges, stats=stats)
+        measures.append((function_name, result_count, et, truncated))
+        measures.append((function_name + "_evaluated", stats.evaluated, et, truncated))
+        measures.append((function_name + "_pruned", stats.pruned, et, truncated))
+
+    return measures
+
+
+ORDERING_SEED = 0 # Seed of the random ordering
+
+
+# Every engine of DOMINANT_ENGINES and the automatic choice, with the features of the cost model
+# Features are given as measures of value result_count and time 0. Fit ENGINE_COST_MODEL on these.
+# components is left out (count -1) when a component is too large for it.
+def benchmark_engines(mg, source, target, limits):
+    measures = []
+
+    features = PolicyAnalysisHelper.dominant_search_features(mg, source, target)
+    for feature in ("relevant_edges", "average_invertex", "cyclic_components", "edge_components", "largest_edge_component"):
+        measures.append(("feature_{}".format(feature), features[feature], 0.0, False))
+
+    for engine in PolicyAnalysisHelper.DOMINANT_ENGINES:
+        start = time.perf_counter()
+        try:
+            results = PolicyAnalysisHelper.find_dominant_metapaths(mg, source, target, strategy=engine)
+        except ValueError as error:
+            print("{} skipped: {}".format(engine, error))
+            measures.append((engine, -1, time.perf_counter() - start, True))
+            continue
+        measures.append((engine, len(results), time.perf_counter() - start, False))
+
+    start = time.perf_counter()
+    choice = PolicyAnalysisHelper.choose_dominant_engine(mg, source, target)
+    results = PolicyAnalysisHelper.find_dominant_metapaths(mg, source, target, strategy=choice.engine)
+    measures.append(("auto_{}".format(choice.engine), len(results), time.perf_counter() - start, False))
+
+    return measures
+
+
+# Cheapest metapath by hyperpath search against the shortest metapath of the MgToSat program
+# Measures are the number of edges of the metapath found (-1 if none). The program is generated
+# without forced edge and solved in a subprocess (needs ortools), within the timeout if any.
+def benchmark_shortest(mg, source, target, limits):
+    import MgToSat # Imports ortools
+    measures = []
+
+    for combine in ("sum", "max"):
+        start = time.perf_counter()
+        metapath = PolicyAnalysisHelper.cheapest_metapath(mg, source, target, combine=combine)
+        measures.append(("cheapest_metapath_{}".format(combine), len(metapath.edge_list) if metapath else -1, time.perf_counter() - start, False))
+
+    MgToSat.glob_verbose = 0
+    fd, program_path = tempfile.mkstemp(prefix="shortest-", suffix=".py")
+    os.close(fd)
+    try:
+        start = time.perf_counter()
+        MgToSat.solver_instantiation(None, mg, False, source, target, None, program_path)
+        measures.append(("sat_generation", len(mg.edges), time.perf_counter() - start, False))
+
+        start = time.perf_counter()
+        try:
+            output = subprocess.run([sys.executable, program_path], capture_output=True, text=True, timeout=limits[2]).stdout
+            objective = re.search(r"Objective value = ([0-9.]+)", output)
+            measures.append(("sat_solve", int(round(float(objective.group(1)))) if objective else -1, time.perf_counter() - start, False))
+        except subprocess.TimeoutExpired:
+            measures.append(("sat_solve", -1, time.perf_counter() - start, True))
+    finally:
+        os.remove(program_path)
+
+    return measures
+
+
+# Edge classification of break_method against classify_edges, differential check
+# Measures are the dominant edges and time of each, then edge counts: agree, only_break_method,
+# only_classify_edges and unexplained. unexplained counts the edges on which the two disagree, in
+# either direction, outside the differences documented on classify_edges: an invertex containing
+# B that does not fire, a fired invertex using elements of B not produced again, or an outvertex
+# not reaching C alone. It should be 0.
+def benchmark_classification(mg, source, target, limits):
+    measures = []
+
+    start = time.perf_counter()
+    break_dominant, _ = PolicyAnalysisHelper.break_method(mg, source, target)
+    measures.append(("break_method", len(break_dominant), time.perf_counter() - start, False))
+    start = time.perf_counter()
+    classify_dominant, _ = PolicyAnalysisHelper.classify_edges(mg, source, target)
+    measures.append(("classify_edges", len(classify_dominant), time.perf_counter() - start, False))
+
+    cm = PolicyAnalysisHelper.CompactMetagraph.get_compact_metagraph(mg)
+    source_mask = cm.mask(source)
+    target_mask = PolicyAnalysisHelper.CompactMetagraph.target_mask(cm, target)
+    break_mask = cm.edges_mask(break_dominant)
+    classify_mask = cm.edges_mask(classify_dominant)
+    produced, fired = PolicyAnalysisHelper.CompactMetagraph.closure(cm, source_mask)
+    explained = 0 # Edges on which the two may differ, as documented on classify_edges
+    for idx, invertex in enumerate(cm.invertices):
+        outvertex = cm.outvertices[idx]
+        if not (fired >> idx) & 1:
+            explained |= (not source_mask & ~invertex) << idx # Invertex containing the source, not fired
+        elif source_mask & ~invertex and invertex & ~produced: # Source elements not produced again
+            explained |= 1 << idx
+        elif target_mask & ~outvertex and target_mask & ~PolicyAnalysisHelper.CompactMetagraph.closure(cm, outvertex)[0]: # Target not reached from the outvertex alone
+            explained |= 1 << idx
+
+    measures.append(("agree", cm.edge_count - PolicyAnalysisHelper.mask_size(break_mask ^ classify_mask), 0.0, False))
+    measures.append(("only_break_method", PolicyAnalysisHelper.mask_size(break_mask & ~classify_mask), 0.0, False))
+    measures.append(("only_classify_edges", PolicyAnalysisHelper.mask_size(classify_mask & ~break_mask), 0.0, False))
+    measures.append(("unexplained", PolicyAnalysisHelper.mask_size((break_mask ^ classify_mask) & ~explained), 0.0, False))
+
+    return measures
+
+
+BENCHMARKS = {
+    "distinct": benchmark_distinct,
+    "parallel": benchmark_parallel,
+    "dominants": benchmark_dominants,
+    "relevance": benchmark_relevance,
+    "dominance": benchmark_dominance,
+    "orderings": benchmark_orderings,
+    "engines": benchmark_engines,
+    "shortest": benchmark_shortest,
+    "classification": benchmark_classification,
+}
+
+
+# Dump measures of one specification to file
+def dump_measures(workflow_spec, mg, mode, measures, output_file):
+    parameter_chunks = workflow_spec.split('/')[-2].split('-') # 10-set-0-3-edges-1-policy
+    variables_count = int(parameter_chunks[0])
+    edge_prob = float(parameter_chunks[2] + '.' + parameter_chunks[3])
+    policy_size = int(parameter_chunks[5])
+    edge_number = len(mg.edges)
+
+    with open(output_file, 'a+') as output:
+        for function_name, result_count, et, truncated in measures:
+            output.write("{};{};{};{};{};{};{};{};{};{}\n".format(workflow_spec, variables_count, edge_prob, policy_size, edge_number, mode, function_name, result_count, et, truncated))
+
+
+###############################################################################
+# Main
+
+def main(verbose, mode, gen_set_filter, edge_filter, policy_filter, id_filter, output_file, yawl_mode, max_edges, max_results, timeout):
+    Utility.print_section("Benchmarking metapath enumeration ({})".format(mode))
+
+    if yawl_mode:
+        spec_dir = "workflow-specs/randomly-generated-yawl/"
+    else:
+        spec_dir = "workflow-specs/randomly-generated/"
+    print("Spec dir: {}".format(spec_dir))
+
+    workflow_specs = gather_specs(spec_dir, gen_set_filter, edge_filter, policy_filter, id_filter, verbose)
+
+    # Create directory
+    measures_dir = os.path.dirname(output_file)
+    if measures_dir and not os.path.exists(measures_dir):
+        os.makedirs(measures_dir)
+
+    for run_ctr, workflow_spec in enumerate(workflow_specs):
+        print("\nRun {} out of {}".format(run_ctr + 1, len(workflow_specs)))
+        print("Processing spec: {}".format(workflow_spec))
+        if yawl_mode:
+            mg = YawlToMetagraph.main(verbose, workflow_spec)
+        else:
+            mg = TriplesToMetagraph.main(verbose, workflow_spec)
+
+        # Source and target as in PolicyAnalysis
+        source = {sorted(mg.variables_set)[0]}
+        target = {sorted(mg.variables_set)[-1]}
+
+        measures = BENCHMARKS[mode](mg, source, target, (max_edges, max_results, timeout))
+        for function_name, result_count, et, truncated in measures:
+            print("{}: {} results in {:.6f}s{}".format(function_name, result_count, et, " (truncated)" if truncated else ""))
+
+        dump_measures(workflow_spec, mg, mode, measures, output_file)
+
+
+
+
+if __name__ == '__main__':
+    Utility.print_section("Getting arguments")
+
+    parser = get_parser() # Create a parser
+    args = parser.parse_args() # Parse arguments
+    print(args)
+
+    # Call main
+    main(args.verbose, args.mode, args.gen_set_filter, args.edge_filter, args.policy_filter, args.id_filter, args.output_file, args.yawl_mode, args.max_edges, args.max_results, args.timeout)
+
+    Utility.terminate_app(0)
+
+
+###############################################################################
@@ -0,0 +1,95 @@
+###############################################################################
+# Imports
+
+import argparse # Argument parser
+
+import Utility
+
+import os
+import random
+import time
+
+from mgtoolkit.library import *
+
+import PolicyAnalysisHelper
+
+
+###############################################################################
+# Argument parser
+
+def get_parser():
+    # Get parser for command line arguments
+    parser = argparse.ArgumentParser(description="Benchmark strongly connected components on random metagraphs of increasing size", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--version", action="version", version='%(prog)s 1.0')
+    parser.add_argument("-v", "--verbose", action="count", default=0, help="increase output verbosity")
+    parser.add_argument("-e", "--edge-counts", type=str, metavar="EDGE_COUNTS", default="100,1000,10000,100000", help="numbers of edges of the metagraphs")
+    parser.add_argument("-r", "--runs", type=int, metavar="RUNS", default=3, help="metagraphs per number of edges")
+    parser.add_argument("--variable-ratio", type=float, metavar="VARIABLE_RATIO", default=0.5, help="number of variables per edge")
+    parser.add_argument("--max-vertex-size", type=int, metavar="MAX_VERTEX_SIZE", default=1, help="maximum size of invertices and outvertices")
+    parser.add_argument("-s", "--seed", type=int, metavar="SEED", default=0, help="seed of the random metagraphs")
+    parser.add_argument("-o", "--output-file", type=str, metavar="OUTPUT_FILE", default="measures/scc-benchmark.dat", help="path to output file")
+
+    return parser
+
+
+###############################################################################
+# Functions
+
+# Random metagraph of edge_count edges over edge_count * variable_ratio variables
+# The edges are returned as a list next to the metagraph: tarjan_scc is given them directly, as
+# adding 100k edges to the metagraph one by one takes hours.
+def random_metagraph(rng, edge_count, variable_ratio, max_vertex_size):
+    variables = ["v{}".format(idx) for idx in range(max(max_vertex_size, int(edge_count * variable_ratio)))]
+    edges = []
+    for _ in range(edge_count):
+        invertex = set(rng.sample(variables, rng.randint(1, max_vertex_size)))
+        outvertex = set(rng.sample(variables, rng.randint(1, max_vertex_size)))
+        edges.append(Edge(invertex, outvertex))
+    return Metagraph(set(variables)), edges
+
+
+###############################################################################
+# Main
+
+def main(verbose, edge_counts, runs, variable_ratio, max_vertex_size, seed, output_file):
+    Utility.print_section("Benchmarking strongly connected components")
+
+    # Create directory
+    measures_dir = os.path.dirname(output_file)
+    if measures_dir and not os.path.exists(measures_dir):
+        os.makedirs(measures_dir)
+
+    rng = random.Random(seed)
+    for edge_count in [int(edge_count) for edge_count in edge_counts.split(',')]:
+        for run in range(runs):
+            mg, edges = random_metagraph(rng, edge_count, variable_ratio, max_vertex_size)
+
+            start = time.perf_counter()
+            nodes, components = PolicyAnalysisHelper.tarjan_scc(mg, edges)
+            et = time.perf_counter() - start
+
+            largest_component = max(len(component) for component in components)
+            print("{} edges (run {}): {} nodes, {} components, largest {} in {:.6f}s".format(edge_count, run + 1, len(nodes), len(components), largest_component, et))
+            if verbose >= 2:
+                print(components)
+
+            with open(output_file, 'a+') as output:
+                output.write("{};{};{};{};{};{};{}\n".format(edge_count, run, variable_ratio, len(nodes), len(components), largest_component, et))
+
+
+
+
+if __name__ == '__main__':
+    Utility.print_section("Getting arguments")
+
+    parser = get_parser() # Create a parser
+    args = parser.parse_args() # Parse arguments
+    print(args)
+
+    # Call main
+    main(args.verbose, args.edge_counts, args.runs, args.variable_ratio, args.max_vertex_size, args.seed, args.output_file)
+
+    Utility.terminate_app(0)
+
+
+###############################################################################
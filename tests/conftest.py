@@ -0,0 +1,48 @@
+###############################################################################
+# Imports
+
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mgtoolkit.library import *
+
+
+###############################################################################
+# Functions
+
+# Random conditional metagraph over variables v0..v{variable_count-1} and propositions p0..
+# Invertices and outvertices have 1 to max_vertex_size elements and may overlap.
+def random_metagraph(seed, variable_count=5, edge_count=5, proposition_count=0, max_vertex_size=2):
+    rng = random.Random(seed)
+    variables = ["v{}".format(idx) for idx in range(variable_count)]
+    propositions = ["p{}".format(idx) for idx in range(proposition_count)]
+    edges = []
+    for _ in range(edge_count * 10):
+        if len(edges) == edge_count:
+            break
+        invertex = set(rng.sample(variables, rng.randint(1, max_vertex_size)))
+        outvertex = set(rng.sample(variables, rng.randint(1, max_vertex_size))) - invertex
+        if rng.random() < 0.2: # Outvertex overlapping the invertex
+            outvertex.add(rng.choice(sorted(invertex)))
+        if not outvertex:
+            continue
+        attributes = rng.sample(propositions, rng.randint(0, len(propositions)))
+        edge = Edge(invertex, outvertex, attributes=attributes)
+        if all(edge.invertex != other.invertex or edge.outvertex != other.outvertex for other in edges):
+            edges.append(edge)
+    mg = ConditionalMetagraph(set(variables), set(propositions))
+    mg.add_edges_from(edges)
+    return mg
+
+
+# Metagraph with the given (invertex, outvertex) edges over their elements
+def metagraph_of(edges):
+    variables = set()
+    for invertex, outvertex in edges:
+        variables |= set(invertex) | set(outvertex)
+    mg = ConditionalMetagraph(variables, set())
+    mg.add_edges_from([Edge(set(invertex), set(outvertex), attributes=[]) for invertex, outvertex in edges])
+    return mg
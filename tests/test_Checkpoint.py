@@ -0,0 +1,83 @@
+###############################################################################
+# Imports
+
+import contextlib
+import io
+import os
+
+import pytest
+
+import Checkpoint
+import PolicyAnalysisHelper
+
+from conftest import random_metagraph
+
+
+###############################################################################
+# Functions
+
+# Keys of the dominant metapaths found by an engine
+def dominant_keys(metapaths):
+    return set(PolicyAnalysisHelper.metapath_key(metapath) for metapath in metapaths)
+
+
+# Spilling options of the engines which take them, every level spilled (memory_limit=0) or none
+def spill_options(spilled, tmp_path):
+    if not spilled:
+        return {}
+    scratch_dir = tmp_path / "scratch"
+    scratch_dir.mkdir()
+    return {"memory_limit": 0, "scratch_dir": str(scratch_dir)}
+
+
+###############################################################################
+# Tests
+
+# Interrupt the engine at the given dominance check, after at least its first level is saved, and
+# resume it from its checkpoint: the dominant metapaths are those of an uninterrupted search
+@pytest.mark.parametrize("engine, spilled", [("hasse", False), ("hasse", True), ("pascal_triangle", False), ("pascal_triangle", True), ("edge_set_tree", False)])
+@pytest.mark.parametrize("seed", [1, 13])
+@pytest.mark.parametrize("interrupt_at", [10, 25, 50])
+def test_resumed_engine_finds_same_dominants(engine, spilled, seed, interrupt_at, tmp_path, monkeypatch):
+    mg = random_metagraph(seed, variable_count=6, edge_count=9, max_vertex_size=2)
+    variables = sorted(mg.variables_set)
+    search = getattr(PolicyAnalysisHelper, engine)
+    args = (mg, {variables[0]}, {variables[-1]})
+    options = spill_options(spilled, tmp_path)
+    checkpoint_dir = str(tmp_path / "checkpoint")
+    with contextlib.redirect_stdout(io.StringIO()):
+        expected = search(*args, relevant_only=False)
+
+    is_dominant = PolicyAnalysisHelper.DominanceChecker.is_dominant
+    checks = []
+    def interrupted_is_dominant(self, edges_set):
+        checks.append(edges_set)
+        if len(checks) == interrupt_at:
+            raise KeyboardInterrupt()
+        return is_dominant(self, edges_set)
+    with monkeypatch.context() as patch:
+        patch.setattr(PolicyAnalysisHelper.DominanceChecker, "is_dominant", interrupted_is_dominant)
+        with contextlib.redirect_stdout(io.StringIO()):
+            with pytest.raises(KeyboardInterrupt):
+                search(*args, checkpoint=Checkpoint.Checkpoint(checkpoint_dir), relevant_only=False, **options)
+    assert os.path.exists(os.path.join(checkpoint_dir, "{}.pkl".format(engine)))
+
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        resumed = search(*args, checkpoint=Checkpoint.Checkpoint(checkpoint_dir, resume=True), relevant_only=False, **options)
+    assert "Checkpoint: resuming {}".format(engine) in output.getvalue()
+    assert dominant_keys(resumed) == dominant_keys(expected)
+    assert len(resumed) == len(expected)
+
+
+# A checkpoint saved by another search is refused
+@pytest.mark.parametrize("engine", ["hasse", "pascal_triangle", "edge_set_tree"])
+def test_checkpoint_of_other_search_raises(engine, tmp_path):
+    mg = random_metagraph(1, variable_count=6, edge_count=9, max_vertex_size=2)
+    variables = sorted(mg.variables_set)
+    search = getattr(PolicyAnalysisHelper, engine)
+    checkpoint_dir = str(tmp_path / "checkpoint")
+    with contextlib.redirect_stdout(io.StringIO()):
+        search(mg, {variables[0]}, {variables[-1]}, checkpoint=Checkpoint.Checkpoint(checkpoint_dir))
+        with pytest.raises(ValueError):
+            search(mg, {variables[1]}, {variables[-1]}, checkpoint=Checkpoint.Checkpoint(checkpoint_dir, resume=True))
@@ -0,0 +1,55 @@
+###############################################################################
+# Imports
+
+import CompactMetagraph
+import IncidenceMatrix
+import PolicyAnalysisHelper
+
+from conftest import metagraph_of, random_metagraph
+
+
+###############################################################################
+# Tests
+
+def test_mask_leaves_elements_unchanged():
+    mg = metagraph_of([({"v0"}, {"v1"})])
+    cm = CompactMetagraph.get_compact_metagraph(mg)
+    index = IncidenceMatrix.get_reachability_index(mg)
+    elements = list(cm.elements)
+
+    assert cm.mask({"v0", "unknown"}) == cm.mask({"v0"})
+    assert CompactMetagraph.target_mask(cm, {"v1", "unknown"}) & cm.unknown_bit
+    assert cm.elements == elements
+    assert IncidenceMatrix.get_reachability_index(mg) is index
+
+
+def test_unknown_target_is_never_reached():
+    mg = metagraph_of([({"v0"}, {"v1"})])
+    assert PolicyAnalysisHelper.find_a_metapath_from(mg, {"v0"}, {"v1"})
+    assert not PolicyAnalysisHelper.find_a_metapath_from(mg, {"v0"}, {"v1", "unknown"})
+    assert not PolicyAnalysisHelper.find_all_metapaths_from(mg, {"v0"}, {"v1", "unknown"})
+
+
+# The batched greatest supported subset gives the outputs of metapath_outputs for every subset,
+# cycle-supported edges included, across several batches
+def test_batch_metapath_outputs_matches_metapath_outputs(monkeypatch):
+    monkeypatch.setattr(IncidenceMatrix, "SWEEP_BATCH", 7)
+    for seed in range(40):
+        mg = random_metagraph(seed, variable_count=6, edge_count=8)
+        cm = CompactMetagraph.get_compact_metagraph(mg)
+        sources = list(range(1 << len(cm.elements)))
+        expected = [CompactMetagraph.metapath_outputs(cm, source) for source in sources]
+        assert IncidenceMatrix.metapath_output_masks(mg, sources) == expected
+
+
+# Closures of sources outside the index are right and only the RECENT_CLOSURES last are kept
+def test_reachability_index_keeps_recent_closures(monkeypatch):
+    monkeypatch.setattr(IncidenceMatrix, "RECENT_CLOSURES", 4)
+    mg = random_metagraph(5, variable_count=6, edge_count=8)
+    cm = CompactMetagraph.get_compact_metagraph(mg)
+    index = IncidenceMatrix.ReachabilityIndex(cm, IncidenceMatrix.get_incidence_matrices(mg))
+    indexed = len(index.closures)
+    for source in range(1 << len(cm.elements)):
+        assert index.produced(source) == CompactMetagraph.closure(cm, source)[0]
+        assert len(index.recent_closures) <= 4
+    assert len(index.closures) == indexed
@@ -0,0 +1,43 @@
+###############################################################################
+# Imports
+
+import contextlib
+import io
+import os
+
+import pytest
+
+import Checkpoint
+import PolicyAnalysisHelper
+
+from conftest import random_metagraph
+
+
+###############################################################################
+# Tests
+
+# Interrupt the engine at the given dominance check, every level being spilled (memory_limit=0)
+@pytest.mark.parametrize("engine", ["hasse", "pascal_triangle"])
+@pytest.mark.parametrize("interrupt_at", [1, 5, 20, 60])
+def test_interrupted_engine_removes_spilled_levels(engine, interrupt_at, tmp_path, monkeypatch):
+    mg = random_metagraph(3, variable_count=6, edge_count=9, max_vertex_size=2)
+    variables = sorted(mg.variables_set)
+    scratch_dir = tmp_path / "scratch"
+    scratch_dir.mkdir()
+
+    is_dominant = PolicyAnalysisHelper.DominanceChecker.is_dominant
+    checks = []
+    def interrupted_is_dominant(self, edges_set):
+        checks.append(edges_set)
+        if len(checks) == interrupt_at:
+            raise KeyboardInterrupt()
+        return is_dominant(self, edges_set)
+    monkeypatch.setattr(PolicyAnalysisHelper.DominanceChecker, "is_dominant", interrupted_is_dominant)
+
+    checkpoint = Checkpoint.Checkpoint(str(tmp_path / "checkpoint"))
+    with contextlib.redirect_stdout(io.StringIO()):
+        try:
+            getattr(PolicyAnalysisHelper, engine)(mg, {variables[0]}, {variables[-1]}, memory_limit=0, scratch_dir=str(scratch_dir), checkpoint=checkpoint, relevant_only=False)
+        except KeyboardInterrupt:
+            pass
+    assert os.listdir(str(scratch_dir)) == []
@@ -0,0 +1,159 @@
+###############################################################################
+# Imports
+
+import contextlib
+import io
+
+import pytest
+
+import CompactMetagraph
+import IncidenceMatrix
+import PolicyAnalysisHelper
+import PolicyInconsistencies
+import PolicyInconsistenciesCouple
+
+from conftest import metagraph_of, random_metagraph
+
+
+###############################################################################
+# Functions
+
+# Keys of the metapaths of each result of a detector
+def result_keys(results):
+    return [set(PolicyAnalysisHelper.metapath_key(metapath) for metapath in metapaths) for metapaths in results[:4]]
+
+
+# Run detect(*args) quietly, with or without the metapath outputs prefilter
+def detect_quietly(detect, args, monkeypatch, prefilter=True):
+    with monkeypatch.context() as patch:
+        if not prefilter: # Every element is produced, no source/target couple is pruned
+            patch.setattr(CompactMetagraph, "metapath_outputs", lambda cm, source: (1 << len(cm.elements)) - 1)
+            patch.setattr(IncidenceMatrix, "metapath_output_masks", lambda mg, sources: [(1 << len(CompactMetagraph.get_compact_metagraph(mg).elements)) - 1] * len(sources))
+            patch.setattr(PolicyAnalysisHelper, "metapath_outputs", lambda mg, B: set(CompactMetagraph.get_compact_metagraph(mg).elements))
+        with contextlib.redirect_stdout(io.StringIO()):
+            return detect(*args)
+
+
+###############################################################################
+# Tests
+
+# {v2, v4} -> {v3} and {v3} -> {v0, v2} form a metapath from {v4} to {v0, v3} although the first
+# edge never fires from {v4}
+def test_full_keeps_cycle_supported_metapaths(monkeypatch):
+    mg = metagraph_of([({"v2", "v4"}, {"v3"}), ({"v3"}, {"v0", "v2"})])
+    dominants = detect_quietly(PolicyInconsistencies.detect_policy_inconsistencies_full, (mg,), monkeypatch)[2]
+    assert (frozenset({"v4"}), frozenset({"v0", "v3"}), frozenset(mg.edges)) in result_keys([dominants])[0]
+
+
+@pytest.mark.parametrize("seed", range(12))
+def test_full_prefilter_keeps_results(seed, monkeypatch):
+    mg = random_metagraph(seed, variable_count=4, edge_count=3 + seed % 3, proposition_count=seed % 2)
+    detect = PolicyInconsistencies.detect_policy_inconsistencies_full
+    assert result_keys(detect_quietly(detect, (mg,), monkeypatch)) == result_keys(detect_quietly(detect, (mg,), monkeypatch, prefilter=False))
+
+
+@pytest.mark.parametrize("seed", range(12))
+def test_pair_detectors_prefilter_keeps_results(seed, monkeypatch):
+    mg = random_metagraph(seed, variable_count=5, edge_count=4 + seed % 3, proposition_count=1 + seed % 2)
+    for detect in (PolicyInconsistencies.detect_policy_inconsistencies_fixed, PolicyInconsistencies.detect_policy_inconsistencies_plus):
+        assert result_keys(detect_quietly(detect, (mg,), monkeypatch)) == result_keys(detect_quietly(detect, (mg,), monkeypatch, prefilter=False))
+
+
+def test_couple_prefilter_keeps_cycle_supported_metapaths(monkeypatch):
+    mg = metagraph_of([({"v2", "v4"}, {"v3"}), ({"v3"}, {"v0", "v2"})])
+    detect = PolicyInconsistenciesCouple.detect_policy_inconsistencies_full_couple
+    args = (mg, {"v4"}, {"v0", "v3"})
+    results = detect_quietly(detect, args, monkeypatch)
+    assert result_keys(results) == result_keys(detect_quietly(detect, args, monkeypatch, prefilter=False))
+    assert results[2]
+
+
+@pytest.mark.parametrize("seed", range(8))
+def test_full_budget_keeps_enumeration(seed, monkeypatch):
+    mg = random_metagraph(seed, variable_count=4, edge_count=3 + seed % 3, proposition_count=seed % 2)
+    detect = PolicyInconsistencies.detect_policy_inconsistencies_full
+    budget = PolicyAnalysisHelper.SearchBudget(max_edges=100, max_results=10 ** 6, timeout=3600)
+    results = detect_quietly(detect, (mg, 0, budget), monkeypatch)
+    assert result_keys(results) == result_keys(detect_quietly(detect, (mg,), monkeypatch))
+    assert not budget.truncated and not results[3].truncated
+
+
+def test_full_budget_max_results():
+    mg = metagraph_of([({"v0"}, {"v1"}), ({"v1"}, {"v2"})])
+    budget = PolicyAnalysisHelper.SearchBudget(max_results=1)
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = PolicyInconsistencies.detect_policy_inconsistencies_full(mg, budget=budget)
+    assert len(results[3]) == 1 and results[3].truncated
+
+
+@pytest.mark.parametrize("seed", range(6))
+def test_full_couple_workers_keep_results(seed, monkeypatch):
+    mg = random_metagraph(seed, variable_count=5, edge_count=5 + seed % 3, proposition_count=seed % 2)
+    variables = sorted(mg.variables_set)
+    detect = PolicyInconsistenciesCouple.detect_policy_inconsistencies_full_couple
+    serial = detect_quietly(detect, (mg, {variables[0]}, {variables[-1]}), monkeypatch)
+    parallel = detect_quietly(lambda *args: detect(*args, workers=2), (mg, {variables[0]}, {variables[-1]}), monkeypatch)
+    assert [[PolicyAnalysisHelper.metapath_key(metapath) for metapath in metapaths] for metapaths in serial[:4]] == [[PolicyAnalysisHelper.metapath_key(metapath) for metapath in metapaths] for metapaths in parallel[:4]]
+
+
+# mgtoolkit finds no metapath from v0 to v4 in this metagraph although there is one
+def test_full_couple_without_mgtoolkit_metapaths(monkeypatch):
+    mg = random_metagraph(12, variable_count=5, edge_count=5)
+    results = detect_quietly(PolicyInconsistenciesCouple.detect_policy_inconsistencies_full_couple, (mg, {"v0"}, {"v4"}), monkeypatch)
+    assert results[3] == []
+
+
+# Edges of the dominant metapaths from each couple, found by hasse
+def hasse_dominant_edges(mg, couples):
+    edges = set()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for source, target in couples:
+            for metapath in PolicyAnalysisHelper.hasse(mg, source.union(mg.propositions_set), target):
+                edges.update(metapath.edge_list)
+    return edges
+
+
+# {v2, v3} -> {v1, v3} is a dominant metapath from v2 to v1, supported by its own output v3
+def test_net_redundancy_keeps_cycle_supported_dominants():
+    mg = metagraph_of([({"v2", "v3"}, {"v1", "v3"}), ({"v0"}, {"v1"})])
+    with contextlib.redirect_stdout(io.StringIO()):
+        _, _, net_edges = PolicyInconsistenciesCouple.net_redundancy_from_couples(mg, [({"v2"}, {"v1"})])
+    assert [(edge.invertex, edge.outvertex) for edge in net_edges] == [({"v0"}, {"v1"})]
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_net_redundancy_matches_hasse(seed):
+    mg = random_metagraph(seed, variable_count=5, edge_count=4 + seed % 5, proposition_count=seed % 2)
+    variables = sorted(mg.variables_set)
+    couples = [({variables[0]}, {variables[-1]}), ({variables[1]}, {variables[-2]})]
+    with contextlib.redirect_stdout(io.StringIO()):
+        _, _, net_edges = PolicyInconsistenciesCouple.net_redundancy_from_couples(mg, couples)
+    assert set(net_edges) == set(mg.edges) - hasse_dominant_edges(mg, couples)
+
+
+# The lazy mode finds the dominant metapaths which fire from the source, each once
+@pytest.mark.parametrize("seed", range(30))
+def test_lazy_couple_finds_firing_dominants(seed, monkeypatch):
+    mg = random_metagraph(seed, variable_count=4, edge_count=6 + seed % 4, proposition_count=seed % 2)
+    cm = CompactMetagraph.get_compact_metagraph(mg)
+    variables = sorted(mg.variables_set)
+    source = {variables[0]}.union(mg.propositions_set)
+    args = (mg, {variables[0]}, {variables[-1]})
+    lazy = detect_quietly(lambda *args: PolicyInconsistenciesCouple.detect_policy_inconsistencies_full_couple(*args, lazy=True), args, monkeypatch)
+    with contextlib.redirect_stdout(io.StringIO()):
+        dominants = PolicyAnalysisHelper.hasse(mg, source, {variables[-1]})
+    firing = [metapath for metapath in dominants if CompactMetagraph.closure(cm, cm.mask(source), cm.edges_mask(metapath.edge_list))[1] == cm.edges_mask(metapath.edge_list)]
+    assert result_keys([lazy[2]]) == result_keys([firing])
+    assert len(lazy[2]) == len(firing)
+    assert lazy[3] == []
+
+
+@pytest.mark.parametrize("seed", range(12))
+def test_lazy_couple_early_exit(seed, monkeypatch):
+    mg = random_metagraph(seed, variable_count=5, edge_count=4 + seed % 5, proposition_count=seed % 2)
+    variables = sorted(mg.variables_set)
+    args = (mg, {variables[0]}, {variables[-1]})
+    complete = result_keys(detect_quietly(PolicyInconsistenciesCouple.detect_policy_inconsistencies_lazy_couple, args, monkeypatch))
+    lazy = detect_quietly(lambda *args: PolicyInconsistenciesCouple.detect_policy_inconsistencies_lazy_couple(*args, max_dominants=1), args, monkeypatch)
+    assert len(lazy[2]) == min(1, len(complete[2]))
+    assert all(keys <= complete_keys for keys, complete_keys in zip(result_keys(lazy)[:3], complete[:3]))
@@ -0,0 +1,48 @@
+###############################################################################
+# Imports
+
+import contextlib
+import io
+
+import pytest
+
+import CompactMetagraph
+import PolicyAnalysisHelper
+
+from conftest import random_metagraph
+
+
+###############################################################################
+# Tests
+
+# break_method and classify_edges agree on every edge but for the differences documented on
+# classify_edges, checked in both directions
+@pytest.mark.parametrize("seed", range(60))
+def test_classify_edges_matches_break_method(seed):
+    mg = random_metagraph(seed, variable_count=5 + seed % 4, edge_count=4 + seed % 10, proposition_count=seed % 2)
+    variables = sorted(mg.variables_set)
+    B = {variables[0]} if seed % 3 else {variables[0], variables[1]}
+    C = {variables[-1]} if seed % 4 else {variables[-1], variables[-2]}
+    with contextlib.redirect_stdout(io.StringIO()):
+        break_dominant, _ = PolicyAnalysisHelper.break_method(mg, B, C)
+        classify_dominant, classify_redundant = PolicyAnalysisHelper.classify_edges(mg, B, C)
+    assert len(classify_dominant) + len(classify_redundant) == len(mg.edges)
+
+    cm = CompactMetagraph.get_compact_metagraph(mg)
+    source = cm.mask(B)
+    target = CompactMetagraph.target_mask(cm, C)
+    produced, fired = CompactMetagraph.closure(cm, source)
+    break_mask = cm.edges_mask(break_dominant)
+    classify_mask = cm.edges_mask(classify_dominant)
+    for idx in range(cm.edge_count):
+        invertex = cm.invertices[idx]
+        fires = (fired >> idx) & 1
+        if (break_mask >> idx) & 1 and not (classify_mask >> idx) & 1:
+            # Invertex containing B, taken as reachable by break_method, without firing
+            assert not source & ~invertex and not fires
+        if (classify_mask >> idx) & 1 and not (break_mask >> idx) & 1:
+            # Fired from B, but using source elements which are not produced again, or reaching C
+            # only with other elements reachable from B
+            outvertex = cm.outvertices[idx]
+            assert fires
+            assert (source & ~invertex and invertex & ~produced) or (target & ~outvertex and target & ~CompactMetagraph.closure(cm, outvertex)[0])